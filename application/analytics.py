@@ -0,0 +1,263 @@
+import time
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import DDL, event, select, text
+
+from application.model import (
+    db,
+    LOOKUPS,
+    CohortRollup,
+    CompletedCourse,
+    CourseTermRollup,
+    JeeDetails,
+    Student,
+)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+RECOMPUTE_BATCH_SIZE = 50000
+QUALIFIED_LABELS = {"yes", "1", "true", "qualified"}
+
+# table -> [(dimension, column)]; lookup fields are counted by label
+COHORT_DIMENSIONS = {
+    "student": [("category", "category_id"), ("country", "country"), ("gender", "gender_id")],
+    "jeedetails": [("jee_qualified", "jee_qualified_id")],
+}
+
+
+def _dimension_value(row, dimension, column):
+    if dimension in LOOKUPS:
+        return f"COALESCE((SELECT label FROM lookup_{dimension} WHERE id = {row}.{column}), '')"
+    return f"COALESCE({row}.{column}, '')"
+
+
+def _count_cohort(table, row, sign):
+    statements = []
+    for dimension, column in COHORT_DIMENSIONS[table]:
+        value = _dimension_value(row, dimension, column)
+        statements.append(
+            f"""INSERT INTO rollup_cohort (dimension, value, count) VALUES ('{dimension}', {value}, {sign})
+            ON CONFLICT (dimension, value) DO UPDATE SET count = count + excluded.count;"""
+        )
+        statements.append(
+            f"DELETE FROM rollup_cohort WHERE dimension = '{dimension}' AND value = {value} AND count = 0;"
+        )
+    return "\n".join(statements)
+
+
+def _count_completion(row, sign):
+    # course_id 0 stands for a completion without a course
+    course_id = f"COALESCE({row}.course_id, 0)"
+    term = f"COALESCE({row}.term_of_completion, '')"
+    return f"""
+    INSERT INTO rollup_course_term (course_id, term, completions, marked, marks_sum)
+    VALUES ({course_id}, {term}, {sign}, {sign} * ({row}.marks IS NOT NULL), {sign} * COALESCE({row}.marks, 0))
+    ON CONFLICT (course_id, term) DO UPDATE SET
+        completions = completions + excluded.completions,
+        marked = marked + excluded.marked,
+        marks_sum = marks_sum + excluded.marks_sum;
+    DELETE FROM rollup_course_term WHERE course_id = {course_id} AND term = {term} AND completions = 0;"""
+
+
+def _cohort_triggers(table):
+    columns = ", ".join(column for dimension, column in COHORT_DIMENSIONS[table])
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_rollup_ai AFTER INSERT ON {table} BEGIN
+        {_count_cohort(table, "NEW", 1)}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_rollup_au AFTER UPDATE OF {columns} ON {table} BEGIN
+        {_count_cohort(table, "OLD", -1)}
+        {_count_cohort(table, "NEW", 1)}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {table}_rollup_ad AFTER DELETE ON {table} BEGIN
+        {_count_cohort(table, "OLD", -1)}
+        END""",
+    ]
+
+
+# The rollups change in the same transaction as the rows they count, so
+# every write path (API, bulk import, SQL) keeps them exact.
+ROLLUP_DDL = (
+    [
+        f"""CREATE TRIGGER IF NOT EXISTS completedcourse_rollup_ai AFTER INSERT ON completedcourse BEGIN
+        {_count_completion("NEW", 1)}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS completedcourse_rollup_au
+        AFTER UPDATE OF course_id, term_of_completion, marks ON completedcourse BEGIN
+        {_count_completion("OLD", -1)}
+        {_count_completion("NEW", 1)}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS completedcourse_rollup_ad AFTER DELETE ON completedcourse BEGIN
+        {_count_completion("OLD", -1)}
+        END""",
+    ]
+    + _cohort_triggers("student")
+    + _cohort_triggers("jeedetails")
+)
+
+for statement in ROLLUP_DDL:
+    event.listen(db.metadata, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+
+
+def recompute_sql(connection):
+    """Fill the emptied rollup tables with GROUP BY queries."""
+    connection.execute(
+        text(
+            """INSERT INTO rollup_course_term (course_id, term, completions, marked, marks_sum)
+            SELECT COALESCE(course_id, 0), COALESCE(term_of_completion, ''), COUNT(*), COUNT(marks),
+                   COALESCE(SUM(marks), 0)
+            FROM completedcourse GROUP BY 1, 2"""
+        )
+    )
+    for table, dimensions in COHORT_DIMENSIONS.items():
+        for dimension, column in dimensions:
+            value = _dimension_value(table, dimension, column)
+            connection.execute(
+                text(
+                    f"""INSERT INTO rollup_cohort (dimension, value, count)
+                    SELECT '{dimension}', {value}, COUNT(*) FROM {table} GROUP BY 2"""
+                )
+            )
+
+
+def _batches(connection, query):
+    result = connection.execution_options(stream_results=True).execute(query)
+    while True:
+        rows = result.fetchmany(RECOMPUTE_BATCH_SIZE)
+        if not rows:
+            return
+        yield rows
+
+
+def _recompute_numpy(connection):
+    totals = {}
+    query = select(CompletedCourse.course_id, CompletedCourse.term_of_completion, CompletedCourse.marks)
+    for rows in _batches(connection, query):
+        course_ids, terms, marks = zip(*rows)
+        course_ids = np.array([c or 0 for c in course_ids], dtype=np.int64)
+        terms, term_index = np.unique(np.array([t or "" for t in terms], dtype=object), return_inverse=True)
+        marks = np.array(marks, dtype=float)
+        keys, groups = np.unique(course_ids * len(terms) + term_index, return_inverse=True)
+        counts = np.bincount(groups)
+        marked = np.bincount(groups, weights=~np.isnan(marks))
+        sums = np.bincount(groups, weights=np.nan_to_num(marks))
+        for key, count, m, total in zip(keys.tolist(), counts.tolist(), marked.tolist(), sums.tolist()):
+            totals_key = (key // len(terms), terms[key % len(terms)])
+            previous = totals.get(totals_key, (0, 0, 0))
+            totals[totals_key] = (previous[0] + count, previous[1] + int(m), previous[2] + int(total))
+    if totals:
+        connection.execute(
+            CourseTermRollup.__table__.insert(),
+            [
+                {"course_id": course_id, "term": term, "completions": c, "marked": m, "marks_sum": s}
+                for (course_id, term), (c, m, s) in totals.items()
+            ],
+        )
+    for model, table in ((Student, "student"), (JeeDetails, "jeedetails")):
+        dimensions = COHORT_DIMENSIONS[table]
+        counts = {dimension: {} for dimension, column in dimensions}
+        query = select(*[model.__table__.c[column] for dimension, column in dimensions])
+        for rows in _batches(connection, query):
+            for (dimension, column), values in zip(dimensions, zip(*rows)):
+                if dimension in LOOKUPS:
+                    values = np.array([-1 if v is None else v for v in values], dtype=np.int64)
+                else:
+                    values = np.array(["" if v is None else v for v in values], dtype=object)
+                unique, value_counts = np.unique(values, return_counts=True)
+                for value, count in zip(unique.tolist(), value_counts.tolist()):
+                    counts[dimension][value] = counts[dimension].get(value, 0) + count
+        rows = []
+        for dimension, values in counts.items():
+            if dimension in LOOKUPS:
+                lookup = LOOKUPS[dimension].table
+                labels = dict(connection.execute(select(lookup.c.id, lookup.c.label)).all())
+                # NULLs and codes without a label are all counted under ""
+                by_label = {}
+                for code, count in values.items():
+                    label = labels.get(code, "")
+                    by_label[label] = by_label.get(label, 0) + count
+                values = by_label
+            rows.extend({"dimension": dimension, "value": value, "count": count} for value, count in values.items())
+        if rows:
+            connection.execute(CohortRollup.__table__.insert(), rows)
+
+
+def recompute_rollups(vectorized=False):
+    """Rebuild both rollup tables from the detail tables.
+
+    The triggers keep them exact, so this is only needed after loading data
+    with the triggers off or to verify them. Clearing the rollups first
+    takes SQLite's write lock, so the rows read next cannot change before
+    the new totals are stored. GROUP BY queries by default, which keep the
+    work inside SQLite; ``vectorized`` streams the rows into NumPy instead,
+    for databases where that is cheaper. Returns the seconds taken."""
+    started = time.perf_counter()
+    with db.engine.begin() as connection:
+        connection.execute(CourseTermRollup.__table__.delete())
+        connection.execute(CohortRollup.__table__.delete())
+        if vectorized:
+            _recompute_numpy(connection)
+        else:
+            recompute_sql(connection)
+    return time.perf_counter() - started
+
+
+def _counts(dimension):
+    rows = (
+        db.session.query(CohortRollup.value, CohortRollup.count)
+        .filter(CohortRollup.dimension == dimension, CohortRollup.count != 0)
+        .order_by(CohortRollup.count.desc(), CohortRollup.value)
+    )
+    return [{"value": value if value != "" else None, "count": count} for value, count in rows]
+
+
+def cohort_analytics(course_id=None, term=None):
+    """Course averages per term, student counts by category, country and
+    gender, and the JEE qualified ratio, read from the rollup tables."""
+    courses = db.session.query(
+        CourseTermRollup.course_id,
+        CourseTermRollup.term,
+        CourseTermRollup.completions,
+        CourseTermRollup.marked,
+        CourseTermRollup.marks_sum,
+    )
+    if course_id is not None:
+        courses = courses.filter(CourseTermRollup.course_id == course_id)
+    if term is not None:
+        courses = courses.filter(CourseTermRollup.term == term)
+    jee = _counts("jee_qualified")
+    total = sum(row["count"] for row in jee)
+    qualified = sum(row["count"] for row in jee if (row["value"] or "").strip().lower() in QUALIFIED_LABELS)
+    return {
+        "courses": [
+            {
+                "course_id": row.course_id or None,
+                "term": row.term or None,
+                "completions": row.completions,
+                "average_marks": round(row.marks_sum / row.marked, 2) if row.marked else None,
+            }
+            for row in courses.order_by(CourseTermRollup.course_id, CourseTermRollup.term)
+        ],
+        "students": {dimension: _counts(dimension) for dimension, column in COHORT_DIMENSIONS["student"]},
+        "jee": {
+            "total": total,
+            "qualified": qualified,
+            "qualified_ratio": round(qualified / total, 4) if total else None,
+            "by_status": jee,
+        },
+    }
+
+
+@click.command("recompute-rollups")
+@click.option("--numpy", "vectorized", is_flag=True, help="Aggregate with NumPy instead of GROUP BY.")
+@with_appcontext
+def recompute_rollups_command(vectorized):
+    """Rebuild the analytics rollups from the detail tables."""
+    if vectorized and np is None:
+        raise click.UsageError("--numpy requires numpy")
+    seconds = recompute_rollups(vectorized=vectorized)
+    click.echo(f"recomputed rollups in {seconds:.2f}s")
@@ -0,0 +1,266 @@
+import asyncio
+import json
+import os
+
+from flask_sqlalchemy import get_state
+from sqlalchemy import event, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from werkzeug.http import parse_etags, quote_etag
+
+from application.auth_cache import auth_cache
+from application.database import apply_pragmas
+from application.model import readable_columns
+from application.pagination import NDJSON
+from application.serialization import choose_encoding, compress, dumps
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    WSGIMiddleware = None
+
+try:
+    from sqlalchemy.ext.asyncio import create_async_engine
+except ImportError:
+    create_async_engine = None
+
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+WSGI_THREADS = 32
+
+
+class AsyncRoute:
+    """A GET endpoint answered on the event loop.
+
+    Selects the ``model`` rows of the authenticated user, or of the
+    ``user_id`` in the JSON body for admin routes, and returns the first one
+    (or all of them with ``many``) through ``serialize``. ``missing`` is the
+    response when there are none. Serializers that need the Flask app, such
+    as ones reading the course catalog, set ``blocking`` and run in a
+    worker thread. ``etag`` tags the rows for conditional GETs; by default a
+    single row is tagged with its version."""
+
+    def __init__(self, model, serialize, missing, admin=False, many=False, blocking=False, etag=None):
+        self.model = model
+        self.serialize = serialize
+        self.missing = missing
+        self.admin = admin
+        self.many = many
+        self.blocking = blocking
+        if etag is None and not many and hasattr(model, "version"):
+            etag = lambda rows: rows[0].version
+        self.etag = etag
+
+
+class AsyncApi:
+    """ASGI application serving ``routes`` with async SQLAlchemy and handing
+    every other request to the Flask app on a pool of ``threads``.
+
+    Only the fast path is async: a GET without query parameters from a user
+    whose token is already in the auth cache. Anything else (a token seen for
+    the first time, a failed role check, pagination or streaming, a user who
+    just wrote) goes to the Flask handler, so error responses and the JSON
+    contract stay the same. An in-memory database cannot be shared with a
+    second engine, so it is served entirely by the Flask app."""
+
+    def __init__(self, app, routes, threads=WSGI_THREADS):
+        if WSGIMiddleware is None:
+            raise RuntimeError("ASGI mode requires the a2wsgi package")
+        self.app = app
+        self.routes = routes
+        self.wsgi = WSGIMiddleware(app, workers=threads)
+        self.token_header = app.config["SECURITY_TOKEN_AUTHENTICATION_HEADER"].lower().encode()
+        self.url = async_database_url(app)
+        self._engine = None
+
+    @property
+    def engine(self):
+        # created on first use so every worker process opens its own
+        if self._engine is None:
+            config = self.app.config
+            self._engine = create_async_engine(
+                self.url,
+                # aiosqlite defaults to NullPool, a new connection and
+                # thread per request
+                poolclass=AsyncAdaptedQueuePool,
+                pool_size=config.get("DATABASE_READ_POOL_SIZE", 5),
+                max_overflow=config.get("DATABASE_MAX_OVERFLOW", 10),
+                pool_timeout=config.get("DATABASE_POOL_TIMEOUT", 30),
+            )
+            pragmas = dict(sqlite_pragmas(self.app), query_only="ON")
+            if self.url.get_backend_name() == "sqlite":
+                event.listen(
+                    self._engine.sync_engine,
+                    "connect",
+                    lambda connection, record: apply_pragmas(connection, pragmas),
+                )
+        return self._engine
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        route = None
+        if scope["type"] == "http" and scope["method"] == "GET" and not scope["query_string"]:
+            route = self.routes.get(scope["path"])
+        if route is None or self.url is None:
+            return await self.wsgi(scope, receive, send)
+        body = await read_body(receive)
+        result = await self.handle(route, scope, body)
+        if result is None:
+            return await self.wsgi(scope, replay(body, receive), send)
+        data, status, etag = result
+        if status == 304:
+            return await send_not_modified(send, etag)
+        if self.app.config.get("COMPRESSION"):
+            encoding = choose_encoding(dict(scope["headers"]).get(b"accept-encoding", b"").decode("latin-1"))
+            await send_json(send, data, status, encoding, self.app.config["COMPRESSION_MIN_SIZE"], etag)
+        else:
+            await send_json(send, data, status, etag=etag)
+
+    async def handle(self, route, scope, body):
+        headers = dict(scope["headers"])
+        if NDJSON.encode() in headers.get(b"accept", b""):
+            return None
+        token = headers.get(self.token_header)
+        entry = auth_cache.get(token.decode("latin-1")) if token else None
+        if entry is None:
+            return None
+        user_id, fs_uniquifier, active, roles = entry
+        if not active:
+            return None
+        writers = self.app.extensions.get("recent_writers")
+        if writers is not None and writers.get(user_id) is not None:
+            return None
+        if route.admin:
+            if "admin" not in {name for name, permissions in roles}:
+                return None
+            try:
+                user_id = json.loads(body)["user_id"]
+            except (ValueError, TypeError, KeyError):
+                return None
+        # plain rows: the serializers only read columns, and skipping the
+        # ORM identity map saves work on every request. Lookup codes come
+        # back as their labels, as the model attributes read them.
+        table = route.model.__table__
+        query = (
+            select(*[column.label(name) for name, column in readable_columns(route.model)])
+            .where(table.c.user_id == user_id)
+            .order_by(table.c.id)
+        )
+        async with self.engine.connect() as connection:
+            rows = (await connection.execute(query)).all()
+        if rows == []:
+            return (*route.missing, None)
+        if not route.many:
+            rows = rows[:1]
+        if_none_match = parse_etags(headers.get(b"if-none-match", b"").decode("latin-1"))
+        if route.blocking:
+            return await asyncio.to_thread(self._respond_in_app, route, rows, if_none_match)
+        return respond(route, rows, if_none_match)
+
+    def _respond_in_app(self, route, rows, if_none_match):
+        with self.app.app_context():
+            try:
+                return respond(route, rows, if_none_match)
+            finally:
+                get_state(self.app).db.session.remove()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self._engine is not None:
+                    await self._engine.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+def respond(route, rows, if_none_match):
+    """``(data, status, etag)`` for the rows of ``route``; a 304 without
+    data when ``If-None-Match`` already holds the ETag."""
+    etag = route.etag(rows) if route.etag is not None else None
+    if etag is not None and if_none_match.contains_weak(etag):
+        return None, 304, etag
+    data = [route.serialize(row) for row in rows]
+    return (data if route.many else data[0]), 200, etag
+
+
+def async_database_url(app):
+    """Async driver URL for the read database, or None when it cannot be
+    shared with another engine (in-memory SQLite) or has no async driver."""
+    if create_async_engine is None:
+        return None
+    url = make_url(
+        app.config.get("SQLALCHEMY_READ_DATABASE_URI") or app.config["SQLALCHEMY_DATABASE_URI"]
+    )
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        return None
+    if backend == "sqlite":
+        if url.database in (None, "", ":memory:"):
+            return None
+        url = url.set(database=os.path.join(app.root_path, url.database))
+    return url.set(drivername=ASYNC_DRIVERS[backend])
+
+
+def sqlite_pragmas(app):
+    options = app.config.get("SQLALCHEMY_READ_ENGINE_OPTIONS") or app.config.get(
+        "SQLALCHEMY_ENGINE_OPTIONS", {}
+    )
+    return {
+        name: value
+        for name, value in (options.get("sqlite_pragmas") or {}).items()
+        if name != "journal_mode"
+    }
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+def replay(body, receive):
+    """``receive`` for the fallback app: the body already read, then the
+    original channel (for disconnects)."""
+    sent = False
+
+    async def receive_again():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+
+    return receive_again
+
+
+async def send_json(send, data, status, encoding=None, min_size=None, etag=None):
+    """Send ``data`` as JSON, compressed with ``encoding`` when it is at
+    least ``min_size`` bytes; ``min_size`` None turns compression off. The
+    ETag is weakened once the body is compressed, as the Flask app does."""
+    payload = dumps(data) + b"\n"
+    headers = [(b"content-type", b"application/json")]
+    weak = False
+    if min_size is not None:
+        headers.append((b"vary", b"Accept-Encoding"))
+        if encoding is not None and len(payload) >= min_size:
+            payload = compress(payload, encoding)
+            headers.append((b"content-encoding", encoding.encode()))
+            weak = True
+    if etag is not None:
+        headers.append((b"etag", quote_etag(etag, weak).encode()))
+    headers.append((b"content-length", str(len(payload)).encode()))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": payload})
+
+
+async def send_not_modified(send, etag):
+    await send(
+        {"type": "http.response.start", "status": 304, "headers": [(b"etag", quote_etag(etag).encode())]}
+    )
+    await send({"type": "http.response.body", "body": b""})
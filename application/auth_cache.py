@@ -0,0 +1,160 @@
+import time
+
+from flask import current_app, request
+from flask_security.utils import set_request_attr
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from application.cache import TTLCache
+from application.model import db, User
+
+AUTH_CACHE_SIZE = 10000
+AUTH_CACHE_TTL = 300
+# with several worker processes a change is only dropped from the cache of
+# the process that made it, so the others must recheck soon
+AUTH_CACHE_WORKERS_TTL = 5
+REQUEST_USER_KEY = "application.token_user"
+REQUEST_USER_ID_KEY = "application.token_user_id"
+
+auth_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+
+
+class CachedRole:
+    def __init__(self, name, permissions):
+        self.name = name
+        self.permissions = permissions
+
+    def get_permissions(self):
+        return self.permissions
+
+
+class CachedUser:
+    """Authenticated user rebuilt from the token cache without a query.
+
+    ``id``, ``fs_uniquifier``, ``active`` and ``roles`` are enough for
+    Flask-Security's token and role checks. Any other attribute loads the
+    real ``User`` row once on first access."""
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, id, fs_uniquifier, active, roles):
+        self.id = id
+        self.fs_uniquifier = fs_uniquifier
+        self.active = active
+        self.roles = [CachedRole(name, permissions) for name, permissions in roles]
+        self._user = None
+
+    @property
+    def is_active(self):
+        return self.active
+
+    def get_id(self):
+        return str(self.fs_uniquifier)
+
+    def has_role(self, role):
+        return (role if isinstance(role, str) else role.name) in {r.name for r in self.roles}
+
+    def __getattr__(self, name):
+        if name.startswith("__") or name == "_user":
+            raise AttributeError(name)
+        if self._user is None:
+            self._user = User.query.get(self.id)
+        return getattr(self._user, name)
+
+
+def _request_token(request, security):
+    token = request.args.get(
+        security.token_authentication_key,
+        request.headers.get(security.token_authentication_header),
+    )
+    if request.is_json:
+        data = request.get_json(silent=True) or {}
+        if isinstance(data, dict):
+            token = data.get(security.token_authentication_key, token)
+    return token
+
+
+def _cache_ttl(token, security):
+    config = current_app.config
+    default = AUTH_CACHE_TTL if config.get("WORKER_PROCESSES", 1) == 1 else AUTH_CACHE_WORKERS_TTL
+    ttl = config.get("AUTH_CACHE_TTL", default)
+    if security.token_max_age:
+        data, issued_at = security.remember_token_serializer.loads(
+            token, max_age=security.token_max_age, return_timestamp=True
+        )
+        remaining = issued_at.timestamp() + security.token_max_age - time.time()
+        ttl = min(ttl, remaining)
+    return ttl
+
+
+def init_auth_cache(security):
+    """Put the token cache in front of Flask-Security's request loader.
+
+    Verified tokens map to (user_id, fs_uniquifier, active, roles); a hit
+    skips token deserialization and the user and role queries. The result
+    is also remembered for the rest of the request, so the repeated lookups
+    made by auth_required and roles_required cost nothing."""
+    login_manager = security.login_manager
+    load_user = login_manager._request_callback
+
+    def cached_request_loader(request):
+        user = request.environ.get(REQUEST_USER_KEY)
+        if user is not None:
+            return user
+        token = _request_token(request, security)
+        entry = auth_cache.get(token) if token else None
+        if entry is not None:
+            user = CachedUser(*entry)
+            set_request_attr("fs_authn_via", "token")
+        else:
+            user = load_user(request)
+            if user.is_authenticated:
+                roles = tuple(
+                    (role.name, frozenset(role.get_permissions())) for role in user.roles
+                )
+                auth_cache.set(
+                    token,
+                    (user.id, user.fs_uniquifier, user.active, roles),
+                    ttl=_cache_ttl(token, security),
+                )
+        request.environ[REQUEST_USER_KEY] = user
+        if user.is_authenticated:
+            request.environ[REQUEST_USER_ID_KEY] = user.id
+        return user
+
+    login_manager.request_loader(cached_request_loader)
+
+
+def request_user_id():
+    """Id of the user authenticated by token for this request, or None when
+    no token has been checked yet. Never queries the database."""
+    return request.environ.get(REQUEST_USER_ID_KEY)
+
+
+def invalidate_user(user_id):
+    if user_id is not None:
+        auth_cache.delete_where(lambda entry: entry[0] == user_id)
+
+
+def _user_changed(target, *args):
+    invalidate_user(target.id)
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault("auth_invalidated", set()).add(target.id)
+
+
+# Drop cached tokens as soon as a user's roles, uniquifier or active flag
+# change, and again after commit so a request racing the write cannot
+# leave the old values cached.
+event.listen(User.fs_uniquifier, "set", _user_changed)
+event.listen(User.active, "set", _user_changed)
+event.listen(User.roles, "append", _user_changed)
+event.listen(User.roles, "remove", _user_changed)
+event.listen(User, "after_delete", lambda mapper, connection, target: _user_changed(target))
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    for user_id in session.info.pop("auth_invalidated", ()):
+        invalidate_user(user_id)
@@ -0,0 +1,216 @@
+import csv
+import io
+import json
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam
+from sqlalchemy.exc import SQLAlchemyError
+
+from application.model import (
+    db,
+    CollegeDetails,
+    CompletedCourse,
+    Courses,
+    RecommendedCourses,
+    SchoolDetails,
+    Student,
+    User,
+    lookup_fields,
+)
+from application.validation import RequestModel
+
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+# kind -> (model, columns identifying an existing row)
+IMPORT_KINDS = {
+    "completedcourse": (CompletedCourse, ("user_id", "course_id")),
+    "student": (Student, ("user_id",)),
+    "school": (SchoolDetails, ("user_id",)),
+    "college": (CollegeDetails, ("user_id",)),
+}
+
+
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, row, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row, "error": message})
+
+    def as_dict(self):
+        return {
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "error_count": self.error_count,
+            "errors": self.errors,
+        }
+
+
+def iter_records(stream, fmt):
+    """Yield ``(row_number, record)`` from a binary CSV or NDJSON stream one
+    row at a time. ``record`` is an exception for lines that do not parse."""
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    if fmt == "csv":
+        for number, record in enumerate(csv.DictReader(text), start=1):
+            # DictReader puts the fields beyond the header under None
+            if None in record:
+                yield number, ValueError(f"{len(record[None])} more fields than the header")
+                continue
+            yield number, {k: (v if v != "" else None) for k, v in record.items()}
+    elif fmt == "ndjson":
+        for number, line in enumerate(text, start=1):
+            if line.strip() == "":
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                record = e
+            if not isinstance(record, (dict, Exception)):
+                record = ValueError("expected a JSON object")
+            yield number, record
+    else:
+        raise ValueError(f"unsupported format: {fmt}")
+
+
+class Importer:
+    """Validate and upsert rows of one kind in chunked transactions.
+
+    Existing ``user.id`` and ``course.id`` values are loaded once up front so
+    rows are validated without a query each; every chunk then costs one
+    lookup of existing keys, one executemany insert, one executemany update
+    and one commit."""
+
+    def __init__(self, kind, chunk_size=CHUNK_SIZE):
+        if kind not in IMPORT_KINDS:
+            raise ValueError(f"unsupported kind: {kind}")
+        self.kind = kind
+        self.model, self.key = IMPORT_KINDS[kind]
+        self.table = self.model.__table__
+        # categorical fields arrive as labels and are stored as lookup codes
+        self.lookups = lookup_fields(self.model)
+        self.codes = [field.column_key for field in self.lookups.values()]
+        # the version column's defaults tag every inserted and updated row
+        skip = {"id", "version", *self.codes}
+        self.columns = {c.name: c for c in self.table.columns if c.name not in skip}
+        # parsed and range checked as the admin endpoints parse their bodies
+        self.parser = RequestModel(self.model, required=self.key, admin=True)
+        self.chunk_size = chunk_size
+        self.user_ids = {id for (id,) in db.session.query(User.id)}
+        self.course_ids = {id for (id,) in db.session.query(Courses.id)}
+        self.report = ImportReport()
+
+    def run(self, records, progress=None):
+        """Import ``records``; ``progress`` is called with the number of rows
+        read so far after each chunk is written."""
+        chunk = {}
+        number = 0
+        for number, record in records:
+            row = self._validate(number, record)
+            if row is None:
+                continue
+            chunk[tuple(row[k] for k in self.key)] = (number, row)
+            if len(chunk) >= self.chunk_size:
+                self._write(chunk)
+                chunk = {}
+                if progress is not None:
+                    progress(number)
+        if chunk:
+            self._write(chunk)
+        if progress is not None:
+            progress(number)
+        return self.report
+
+    def _validate(self, number, record):
+        if isinstance(record, Exception):
+            self.report.error(number, str(record))
+            return None
+        unknown = [k for k in record if k not in self.columns and k not in self.lookups]
+        if unknown != []:
+            self.report.error(number, "unknown fields: " + ", ".join(sorted(unknown)))
+            return None
+        values, error = self.parser.parse(record)
+        if error is not None:
+            self.report.error(number, error)
+            return None
+        row = {name: values[name] for name in self.columns}
+        for name, field in self.lookups.items():
+            row[field.column_key] = field.lookup.code(values[name])
+        if row["user_id"] not in self.user_ids:
+            self.report.error(number, f"user {row['user_id']} does not exist")
+            return None
+        if "course_id" in row and row["course_id"] not in self.course_ids:
+            self.report.error(number, f"course {row['course_id']} does not exist")
+            return None
+        return row
+
+    def _existing_ids(self, chunk):
+        user_ids = {key[0] for key in chunk}
+        key_columns = [self.table.c[k] for k in self.key]
+        rows = db.session.query(self.table.c.id, *key_columns).filter(
+            self.table.c.user_id.in_(user_ids)
+        )
+        return {tuple(row[1:]): row[0] for row in rows}
+
+    def _write(self, chunk):
+        try:
+            existing = self._existing_ids(chunk)
+            inserts = []
+            updates = []
+            for key, (number, row) in chunk.items():
+                if key in existing:
+                    updates.append(dict(row, _id=existing[key]))
+                else:
+                    inserts.append(row)
+            if inserts:
+                db.session.execute(self.table.insert(), inserts)
+            if updates:
+                db.session.execute(
+                    self.table.update()
+                    .where(self.table.c.id == bindparam("_id"))
+                    .values({name: bindparam(name) for name in [*self.columns, *self.codes]}),
+                    updates,
+                )
+            if self.kind == "completedcourse":
+                RecommendedCourses.query.filter(
+                    RecommendedCourses.user_id.in_({key[0] for key in chunk})
+                ).update({"stale": True}, synchronize_session=False)
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            for number, row in chunk.values():
+                self.report.error(number, f"database error: {e.__class__.__name__}")
+            return
+        self.report.inserted += len(inserts)
+        self.report.updated += len(updates)
+
+
+def import_records(kind, stream, fmt, chunk_size=CHUNK_SIZE, progress=None):
+    return Importer(kind, chunk_size).run(iter_records(stream, fmt), progress).as_dict()
+
+
+def detect_format(filename, mimetype):
+    if filename and filename.lower().endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    if mimetype in ("application/x-ndjson", "application/jsonl"):
+        return "ndjson"
+    return "csv"
+
+
+@click.command("import-records")
+@click.argument("kind", type=click.Choice(list(IMPORT_KINDS)))
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(["csv", "ndjson"]))
+@click.option("--chunk-size", default=CHUNK_SIZE, show_default=True)
+@with_appcontext
+def import_records_command(kind, path, fmt, chunk_size):
+    """Bulk load completed courses, students, school or college details."""
+    with open(path, "rb") as f:
+        report = import_records(kind, f, fmt or detect_format(path, None), chunk_size)
+    click.echo(json.dumps(report, indent=2))
@@ -0,0 +1,189 @@
+import hashlib
+import json
+import threading
+
+from flask import current_app, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from werkzeug.local import LocalProxy
+
+from application.cache import TTLCache
+from application.model import db, Courses
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+CATALOG_KEY = "course_catalog"
+ETAG_KEY = "course_catalog:etag"
+SHARED_TTL = 3600
+LOCAL_TTL = 5
+REQUEST_CATALOG_KEY = "application.course_catalog"
+
+
+class LocalBackend:
+    """Process-local store, the default. Other processes (server workers,
+    the job runner) do not see its invalidations, so entries expire after
+    ``ttl`` seconds and each process reloads the catalog at least that
+    often."""
+
+    def __init__(self, ttl=LOCAL_TTL):
+        self._data = TTLCache(maxsize=16, ttl=ttl)
+
+    def get(self, key):
+        return self._data.get(key)
+
+    def set(self, key, value):
+        self._data.set(key, value)
+
+    def delete(self, key):
+        self._data.delete(key)
+
+
+class RedisBackend:
+    """Catalog shared by every worker through redis, so a course write in one
+    process is seen by the others on their next read."""
+
+    def __init__(self, url, ttl=SHARED_TTL):
+        if redis is None:
+            raise RuntimeError("COURSE_CACHE_URL requires the redis package")
+        self._redis = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self._redis.get(key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value):
+        self._redis.set(key, json.dumps(value), ex=self.ttl)
+
+    def delete(self, key):
+        self._redis.delete(key)
+
+
+def catalog_backend(url=None, ttl=LOCAL_TTL):
+    """Redis when ``url`` is set, else a LocalBackend expiring after
+    ``ttl`` seconds."""
+    if url:
+        return RedisBackend(url)
+    return LocalBackend(ttl)
+
+
+class CatalogSnapshot:
+    def __init__(self, etag, courses):
+        self.etag = etag
+        self.courses = courses
+        self.by_id = {course["id"]: course for course in courses}
+
+    def get(self, course_id):
+        return self.by_id.get(course_id)
+
+
+class CourseCatalog:
+    """Read-through cache of the whole course table.
+
+    Every process keeps the current snapshot in memory and only compares its
+    ETag with the backend's, once per request. Course writes invalidate the
+    backend after commit, and the next read reloads all courses with a
+    single query."""
+
+    def __init__(self, backend=None):
+        self.backend = backend or LocalBackend()
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._generation = 0
+
+    def snapshot(self):
+        if has_request_context():
+            snapshot = request.environ.get(REQUEST_CATALOG_KEY)
+            if snapshot is None:
+                snapshot = request.environ[REQUEST_CATALOG_KEY] = self._current()
+            return snapshot
+        return self._current()
+
+    def _current(self):
+        etag = self.backend.get(ETAG_KEY)
+        snapshot = self._snapshot
+        if snapshot is not None and etag == snapshot.etag:
+            return snapshot
+        with self._lock:
+            generation = self._generation
+            data = self.backend.get(CATALOG_KEY) if etag is not None else None
+            if data is None or data["etag"] != etag:
+                data = self._load()
+                # a write committed while loading makes this copy stale
+                if generation == self._generation:
+                    self.backend.set(CATALOG_KEY, data)
+                    self.backend.set(ETAG_KEY, data["etag"])
+            snapshot = CatalogSnapshot(data["etag"], data["courses"])
+            if generation == self._generation:
+                self._snapshot = snapshot
+        return snapshot
+
+    def _load(self):
+        rows = db.session.query(
+            Courses.id, Courses.name, Courses.code, Courses.pre_requisite, Courses.level
+        ).order_by(Courses.id)
+        courses = [
+            {
+                "id": row.id,
+                "name": row.name,
+                "code": row.code,
+                "pre_requisite": row.pre_requisite,
+                "level": row.level,
+            }
+            for row in rows
+        ]
+        etag = hashlib.sha1(json.dumps(courses, sort_keys=True).encode()).hexdigest()
+        return {"etag": etag, "courses": courses}
+
+    def get(self, course_id):
+        return self.snapshot().get(course_id)
+
+    def invalidate(self):
+        self._generation += 1
+        self._snapshot = None
+        if has_request_context():
+            request.environ.pop(REQUEST_CATALOG_KEY, None)
+        self.backend.delete(ETAG_KEY)
+        self.backend.delete(CATALOG_KEY)
+
+
+def init_catalog(app):
+    """Give ``app`` its own catalog, kept in ``app.extensions`` like the
+    lookup codes, on the backend its COURSE_CACHE_URL and COURSE_CACHE_TTL
+    name."""
+    app.extensions["course_catalog"] = CourseCatalog(
+        catalog_backend(app.config.get("COURSE_CACHE_URL"), app.config.get("COURSE_CACHE_TTL", LOCAL_TTL))
+    )
+
+
+# the current app's catalog
+course_catalog = LocalProxy(lambda: current_app.extensions["course_catalog"])
+
+
+def _courses_changed(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info["course_catalog_changed"] = True
+
+
+# Any committed course change, whether from CourseApi, a script or a test,
+# drops the cached catalog.
+event.listen(Courses, "after_insert", _courses_changed)
+event.listen(Courses, "after_update", _courses_changed)
+event.listen(Courses, "after_delete", _courses_changed)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    if session.info.pop("course_catalog_changed", False) and has_app_context():
+        catalog = current_app.extensions.get("course_catalog")
+        if catalog is not None:
+            catalog.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop("course_catalog_changed", None)
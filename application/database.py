@@ -0,0 +1,285 @@
+import contextlib
+import os
+import weakref
+
+from flask import has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import event, orm
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+from application.cache import TTLCache
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+READ_METHODS = ("GET", "HEAD")
+READ_YOUR_WRITES_SECONDS = 5
+
+# Applied to every connection in production mode. cache_size is negative,
+# so it is in KiB (64 MB per connection).
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "cache_size": -65536,
+    "mmap_size": 268435456,
+    "temp_store": "MEMORY",
+}
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+class RoutingSession(SignallingSession):
+    """Session that sends the reads of GET and HEAD requests to the read
+    engine, when one is configured, and everything else to the primary.
+
+    Once the session has flushed, the rest of its transaction stays on the
+    primary so the request sees its own writes. A user who made a write
+    request in the last ``READ_YOUR_WRITES_SECONDS`` also reads from the
+    primary, so replica lag never hides their own changes."""
+
+    def __init__(self, db, **options):
+        self.db = db
+        SignallingSession.__init__(self, db, **options)
+        event.listen(self, "after_flush", _mark_written)
+        event.listen(self, "after_commit", _clear_written)
+        event.listen(self, "after_rollback", _clear_written)
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._reads_from_replica():
+            engine = self.db.get_read_engine(self.app)
+            if engine is not None:
+                return engine
+        return SignallingSession.get_bind(self, mapper, clause)
+
+    def _reads_from_replica(self):
+        return (
+            has_request_context()
+            and request.method in READ_METHODS
+            and not self._flushing
+            and not self.info.get("written")
+            and not _recent_writer(self.app)
+        )
+
+
+def _recent_writer(app):
+    writers = app.extensions.get("recent_writers")
+    if writers is None:
+        return False
+    user_id = app.extensions["request_identity"]()
+    return user_id is not None and writers.get(user_id) is not None
+
+
+def _mark_written(session, flush_context):
+    session.info["written"] = True
+
+
+def _clear_written(session):
+    session.info.pop("written", None)
+
+
+class Database(SQLAlchemy):
+    """Flask-SQLAlchemy with SQLite pragma profiles and an optional read
+    engine (``SQLALCHEMY_READ_DATABASE_URI``) used by RoutingSession."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def create_engine(self, sa_url, engine_opts):
+        pragmas = engine_opts.pop("sqlite_pragmas", None)
+        engine = SQLAlchemy.create_engine(self, sa_url, engine_opts)
+        if pragmas:
+            event.listen(
+                engine, "connect", lambda connection, record: apply_pragmas(connection, pragmas)
+            )
+        return engine
+
+    def get_read_engine(self, app=None):
+        app = self.get_app(app)
+        uri = app.config.get("SQLALCHEMY_READ_DATABASE_URI")
+        if not uri:
+            return None
+        state = get_state(app)
+        with self._engine_lock:
+            engine = getattr(state, "read_engine", None)
+            if engine is None:
+                options = dict(app.config.get("SQLALCHEMY_READ_ENGINE_OPTIONS", {}))
+                sa_url, options = self.apply_driver_hacks(app, make_url(uri), options)
+                open_mode = app.config.get("SQLITE_READ_MODE")
+                if sa_url.get_backend_name() == "sqlite" and open_mode in ("ro", "immutable"):
+                    # open through a file: URI so SQLite itself refuses writes;
+                    # immutable also skips locking and is only safe for a
+                    # replica file nothing writes to while it is open
+                    query = {"mode": "ro"} if open_mode == "ro" else {"immutable": "1"}
+                    sa_url = sa_url.set(
+                        database="file:" + sa_url.database, query=dict(query, uri="true")
+                    )
+                engine = state.read_engine = self.create_engine(sa_url, options)
+        return engine
+
+
+def is_memory_database(url):
+    url = make_url(url)
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+# apps whose engines are dropped in forked children
+_fork_safe_apps = weakref.WeakSet()
+
+
+def dispose_engines(app):
+    """Forget the pooled connections of ``app``'s engines without closing
+    them, as a process forked from the one that opened them must; new ones
+    are opened on next use. Takes no locks, so it is safe right after a
+    fork."""
+    state = app.extensions.get("sqlalchemy")
+    if state is None:
+        return
+    engines = [connector._engine for connector in state.connectors.values()]
+    engines.append(getattr(state, "read_engine", None))
+    for engine in engines:
+        if engine is not None:
+            engine.dispose(close=False)
+
+
+def _dispose_after_fork():
+    for app in list(_fork_safe_apps):
+        dispose_engines(app)
+
+
+def _make_fork_safe(app):
+    if not hasattr(os, "register_at_fork"):
+        return
+    if len(_fork_safe_apps) == 0:
+        os.register_at_fork(after_in_child=_dispose_after_fork)
+    _fork_safe_apps.add(app)
+
+
+@contextlib.contextmanager
+def setup_lock(app):
+    """Hold an exclusive lock on ``<database>.setup-lock`` while creating
+    tables and migrating, so worker processes starting together on one
+    SQLite file take turns. A no-op for other databases and where fcntl is
+    missing."""
+    url = make_url(app.config["SQLALCHEMY_DATABASE_URI"])
+    if fcntl is None or url.get_backend_name() != "sqlite" or is_memory_database(url):
+        yield
+        return
+    # Flask-SQLAlchemy resolves relative SQLite paths against the app root
+    path = os.path.join(app.root_path, url.database) + ".setup-lock"
+    with open(path, "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def configure_database(app, mode, identity=None):
+    """Apply the engine settings for ``mode`` and set up read routing.
+
+    "production" needs a file database. It turns on WAL and the pragma
+    profile, sizes the connection pools with pre-ping, and reads from the
+    same file through a second, query-only engine unless
+    ``SQLALCHEMY_READ_DATABASE_URI`` names a replica. Any other mode keeps
+    Flask-SQLAlchemy's defaults and only routes reads when a replica is
+    configured.
+
+    ``identity`` returns the id of the user making the request, or None; it
+    must not query the database. With it, users who just wrote keep reading
+    from the primary. Those users are remembered per process, so with
+    ``WORKER_PROCESSES`` above 1 a separate replica is refused: a user's
+    next read may land on another worker.
+
+    Engines are created on first use, and a process forked after that
+    drops the inherited connections, so the app can be built before a
+    server forks its workers."""
+    _make_fork_safe(app)
+    config = app.config
+    config["DATABASE_MODE"] = mode
+    config.setdefault("SQLALCHEMY_READ_DATABASE_URI", os.environ.get("READ_DATABASE_URI"))
+    config.setdefault("SQLITE_READ_MODE", "ro")
+    config.setdefault("READ_YOUR_WRITES_SECONDS", READ_YOUR_WRITES_SECONDS)
+    if mode == "production":
+        _configure_production(app)
+    if config.get("WORKER_PROCESSES", 1) > 1:
+        _check_workers(config)
+    if config["SQLALCHEMY_READ_DATABASE_URI"]:
+        _configure_read_routing(app, identity)
+    if mode == "production" or config["SQLALCHEMY_READ_DATABASE_URI"]:
+        # return pooled connections even when an app context outlives the
+        # request
+        @app.teardown_request
+        def close_session(exc):
+            get_state(app).db.session.remove()
+
+
+def _configure_production(app):
+    config = app.config
+    uri = config["SQLALCHEMY_DATABASE_URI"]
+    url = make_url(uri)
+    if is_memory_database(url):
+        raise ValueError("production database mode needs a file database")
+    config.setdefault("DATABASE_POOL_SIZE", 4)
+    config.setdefault("DATABASE_READ_POOL_SIZE", 8)
+    config.setdefault("DATABASE_MAX_OVERFLOW", 4)
+    config.setdefault("DATABASE_POOL_TIMEOUT", 30)
+    config.setdefault("SQLITE_PRAGMAS", dict(SQLITE_PRAGMAS))
+    busy_timeout = config["SQLITE_PRAGMAS"].get("busy_timeout", 0) / 1000
+
+    def engine_options(pool_size, pragmas):
+        options = {
+            "poolclass": QueuePool,
+            "pool_size": pool_size,
+            "max_overflow": config["DATABASE_MAX_OVERFLOW"],
+            "pool_timeout": config["DATABASE_POOL_TIMEOUT"],
+            "pool_pre_ping": True,
+        }
+        if url.get_backend_name() == "sqlite":
+            options["connect_args"] = {"check_same_thread": False, "timeout": busy_timeout}
+            options["sqlite_pragmas"] = pragmas
+        return options
+
+    config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(
+        config["DATABASE_POOL_SIZE"], config["SQLITE_PRAGMAS"]
+    )
+    if not config["SQLALCHEMY_READ_DATABASE_URI"]:
+        config["SQLALCHEMY_READ_DATABASE_URI"] = uri
+    read_pragmas = {
+        name: value for name, value in config["SQLITE_PRAGMAS"].items() if name != "journal_mode"
+    }
+    config["SQLALCHEMY_READ_ENGINE_OPTIONS"] = engine_options(
+        config["DATABASE_READ_POOL_SIZE"], dict(read_pragmas, query_only="ON")
+    )
+
+
+def _check_workers(config):
+    if is_memory_database(config["SQLALCHEMY_DATABASE_URI"]):
+        raise ValueError("several worker processes need a file database")
+    replica = config["SQLALCHEMY_READ_DATABASE_URI"]
+    if replica and replica != config["SQLALCHEMY_DATABASE_URI"]:
+        raise ValueError("a read replica needs a single worker process; read-your-writes is tracked per process")
+
+
+def _configure_read_routing(app, identity):
+    if identity is None:
+        return
+    writers = TTLCache(maxsize=100000, ttl=app.config["READ_YOUR_WRITES_SECONDS"])
+    app.extensions["recent_writers"] = writers
+    app.extensions["request_identity"] = identity
+
+    @app.after_request
+    def remember_writer(response):
+        if request.method not in READ_METHODS and response.status_code < 400:
+            user_id = identity()
+            if user_id is not None:
+                writers.set(user_id, True)
+        return response
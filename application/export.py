@@ -0,0 +1,204 @@
+import csv
+import io
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import false
+
+from application.model import (
+    db,
+    LOOKUPS,
+    CollegeDetails,
+    CompletedCourse,
+    Courses,
+    JeeDetails,
+    SchoolDetails,
+    Student,
+    User,
+    readable_columns,
+)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+
+def _model_columns(model, prefix, skip=("id", "user_id", "version")):
+    return [(prefix + name, column) for name, column in readable_columns(model) if name not in skip]
+
+
+# (output name, column) for one row per student and completed course
+EXPORT_COLUMNS = (
+    [("user_id", User.id), ("full_name", User.full_name), ("email", User.email)]
+    + _model_columns(Student, "")
+    + _model_columns(SchoolDetails, "school_")
+    + _model_columns(CollegeDetails, "college_")
+    + _model_columns(JeeDetails, "jee_")
+    + [
+        ("course_id", CompletedCourse.course_id),
+        ("course_code", Courses.code),
+        ("course_name", Courses.name),
+        ("course_marks", CompletedCourse.marks),
+        ("term_of_completion", CompletedCourse.term_of_completion),
+    ]
+)
+EXPORT_FIELDS = [name for name, column in EXPORT_COLUMNS]
+
+
+def export_query(category=None, country=None, year=None):
+    """One joined query over every student with their school, college, JEE
+    and completed course rows; students with several completed courses get
+    one row per course."""
+    query = (
+        db.session.query(*[column.label(name) for name, column in EXPORT_COLUMNS])
+        .select_from(Student)
+        .join(User, User.id == Student.user_id)
+        .outerjoin(SchoolDetails, SchoolDetails.user_id == Student.user_id)
+        .outerjoin(CollegeDetails, CollegeDetails.user_id == Student.user_id)
+        .outerjoin(JeeDetails, JeeDetails.user_id == Student.user_id)
+        .outerjoin(CompletedCourse, CompletedCourse.user_id == Student.user_id)
+        .outerjoin(Courses, Courses.id == CompletedCourse.course_id)
+    )
+    if category is not None:
+        # compare codes so the filter needs no join; a label never stored
+        # matches nothing
+        code = LOOKUPS["category"].code(category, create=False)
+        query = query.filter(Student.category_id == code if code is not None else false())
+    if country is not None:
+        query = query.filter(Student.country == country)
+    if year is not None:
+        query = query.filter(CompletedCourse.term_of_completion.like(f"%{year}"))
+    return query.order_by(Student.user_id, CompletedCourse.id).yield_per(EXPORT_BATCH_SIZE)
+
+
+def _batches(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == EXPORT_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for batch in _batches(rows):
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+class _Drain(io.RawIOBase):
+    """Write-only file that hands back whatever was written since the last
+    ``drain``, so Arrow writers can stream without a full in-memory file."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _arrow_schema():
+    types = {int: pa.int64(), bool: pa.bool_(), datetime: pa.timestamp("us")}
+    return pa.schema(
+        [
+            (name, types.get(column.type.python_type, pa.string()))
+            for name, column in EXPORT_COLUMNS
+        ]
+    )
+
+
+def iter_arrow(rows, fmt):
+    schema = _arrow_schema()
+    sink = _Drain()
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(sink, schema)
+        write = writer.write_table
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+        write = writer.write_batch
+    for batch in _batches(rows):
+        columns = list(zip(*batch))
+        data = [pa.array(values, type=field.type) for values, field in zip(columns, schema)]
+        if fmt == "parquet":
+            write(pa.Table.from_arrays(data, schema=schema))
+        else:
+            write(pa.RecordBatch.from_arrays(data, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def _counted(rows, progress):
+    count = 0
+    for row in rows:
+        yield row
+        count += 1
+        if count % EXPORT_BATCH_SIZE == 0:
+            progress(count)
+    progress(count)
+
+
+def iter_export(fmt, progress=None, **filters):
+    """Yield the export as byte/str chunks, keeping at most one batch of
+    rows in memory. ``progress`` is called with the number of rows read so
+    far after every batch."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"unsupported format: {fmt}")
+    if fmt != "csv" and pa is None:
+        raise ValueError(f"{fmt} export requires pyarrow")
+    rows = export_query(**filters)
+    if progress is not None:
+        rows = _counted(rows, progress)
+    if fmt == "csv":
+        return iter_csv(rows)
+    return iter_arrow(rows, fmt)
+
+
+@click.command("export-students")
+@click.argument("path", type=click.Path(dir_okay=False, writable=True))
+@click.option("--format", "fmt", type=click.Choice(list(EXPORT_FORMATS)), default="csv", show_default=True)
+@click.option("--category")
+@click.option("--country")
+@click.option("--year")
+@with_appcontext
+def export_students_command(path, fmt, category, country, year):
+    """Export students with school, college, JEE and completed courses."""
+    chunks = iter_export(fmt, category=category, country=country, year=year)
+    with open(path, "w", newline="") if fmt == "csv" else open(path, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+    click.echo(f"exported students to {path}")
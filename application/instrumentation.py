@@ -0,0 +1,288 @@
+import hmac
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import Response, has_request_context, request
+from flask_security import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+REQUEST_TIMINGS_KEY = "application.timings"
+REQUEST_STARTED_KEY = "application.started"
+SQL_STARTED_KEY = "instrumentation_started"
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SAMPLE_INTERVAL = 0.005
+PROMETHEUS = "text/plain; version=0.0.4; charset=utf-8"
+
+# (metric, per-request timing, help, buckets)
+REQUEST_HISTOGRAMS = [
+    ("http_request_duration_seconds", None, "Wall time of the request.", DURATION_BUCKETS),
+    ("http_request_sql_statements", "sql_statements", "SQL statements run.", COUNT_BUCKETS),
+    ("http_request_sql_duration_seconds", "sql_seconds", "Time spent in SQL statements.", DURATION_BUCKETS),
+    (
+        "http_request_password_hash_duration_seconds",
+        "password_hash_seconds",
+        "Time spent hashing and verifying passwords.",
+        DURATION_BUCKETS,
+    ),
+    (
+        "http_request_serialization_duration_seconds",
+        "serialization_seconds",
+        "Time spent encoding the response body.",
+        DURATION_BUCKETS,
+    ),
+]
+
+
+def record_timing(name, value):
+    """Add ``value`` to the current request's ``name`` timing. Does nothing
+    outside an instrumented request."""
+    if has_request_context():
+        timings = request.environ.get(REQUEST_TIMINGS_KEY)
+        if timings is not None:
+            timings[name] += value
+
+
+class Histogram:
+    """Cumulative Prometheus histogram keyed by a tuple of label values."""
+
+    def __init__(self, name, help, labels, buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0, 0.0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, [list(s[0]), s[1], s[2]]) for key, s in self._series.items())
+        for label_values, (counts, count, total) in series:
+            labels = _labels(zip(self.labels, label_values))
+            for bound, bucket in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {bucket}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+def _labels(pairs):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return ",".join(f'{name}="{escape(value)}"' for name, value in pairs)
+
+
+class Metrics:
+    """Per-route request histograms plus the counters of registered caches
+    (anything with a ``stats()`` dict of hits, misses, evictions and size)."""
+
+    def __init__(self):
+        self.histograms = [
+            (timing, Histogram(name, help, ("route", "method"), buckets))
+            for name, timing, help, buckets in REQUEST_HISTOGRAMS
+        ]
+        self.caches = {}
+
+    def observe_request(self, route, method, elapsed, timings):
+        for timing, histogram in self.histograms:
+            histogram.observe((route, method), elapsed if timing is None else timings[timing])
+
+    def render(self):
+        lines = []
+        for timing, histogram in self.histograms:
+            lines.extend(histogram.render())
+        stats = {name: cache.stats() for name, cache in sorted(self.caches.items())}
+        for key, kind in (("hits", "counter"), ("misses", "counter"), ("evictions", "counter"), ("size", "gauge")):
+            name = f"app_cache_{key}_total" if kind == "counter" else f"app_cache_{key}"
+            lines.append(f"# TYPE {name} {kind}")
+            for cache, values in stats.items():
+                lines.append(f"{name}{{{_labels([('cache', cache)])}}} {values[key]}")
+        return "\n".join(lines) + "\n"
+
+
+class SlowRequestProfiler:
+    """Sampling profiler for slow requests.
+
+    A background thread records the stack of every in-flight request each
+    ``interval`` seconds. When a request takes longer than ``threshold``
+    seconds its samples are written to ``directory`` in folded format (one
+    "outer;...;inner count" line per distinct stack), which flamegraph.pl and
+    speedscope read as is. Faster requests are discarded."""
+
+    def __init__(self, directory, threshold, interval=SAMPLE_INTERVAL):
+        self.directory = directory
+        self.threshold = threshold
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def start_request(self):
+        self._ensure_sampler()
+        with self._lock:
+            self._active[threading.get_ident()] = Counter()
+
+    def finish_request(self, route, method, elapsed):
+        with self._lock:
+            samples = self._active.pop(threading.get_ident(), None)
+        if not samples or elapsed < self.threshold:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+        path = os.path.join(
+            self.directory, f"{time.time():.3f}-{method}-{slug}-{int(elapsed * 1000)}ms.folded"
+        )
+        with open(path, "w") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+    def _ensure_sampler(self):
+        # one sampler per process, started again after a fork
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._active = {}
+                    threading.Thread(target=self._sample, daemon=True).start()
+                    self._pid = os.getpid()
+
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for ident, samples in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        samples[_folded(frame)] += 1
+
+
+def _folded(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+# start times are kept per cursor on the pooled connection, and dropped
+# again when the statement fails, so they never outlive the statement
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault(SQL_STARTED_KEY, {})[id(cursor)] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info[SQL_STARTED_KEY].pop(id(cursor))
+    record_timing("sql_statements", 1)
+    record_timing("sql_seconds", time.perf_counter() - started)
+
+
+def _handle_error(context):
+    execution = context.execution_context
+    if context.connection is not None and execution is not None:
+        context.connection.info.get(SQL_STARTED_KEY, {}).pop(id(execution.cursor), None)
+
+
+def _listen_for_sql():
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Engine, "handle_error", _handle_error)
+
+
+def _may_read_metrics(app):
+    token = app.config["METRICS_TOKEN"]
+    if token and hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+        return True
+    return "security" in app.extensions and current_user.is_authenticated and current_user.has_role("admin")
+
+
+def init_instrumentation(app, api, caches=None):
+    """Record per-route timings and serve them on ``/metrics``.
+
+    Off unless ``INSTRUMENTATION`` is set (env ``INSTRUMENTATION=1``). Each
+    request observes its wall time, SQL statement count and time (from
+    engine events, on every engine), password hashing time and response
+    encoding time. ``PROFILE_SLOW_REQUEST_MS`` also turns on the sampling
+    profiler, writing the stacks of slower requests to ``PROFILE_DIR``.
+
+    ``/metrics`` is served to admins and to scrapers sending
+    ``Authorization: Bearer <METRICS_TOKEN>``."""
+    config = app.config
+    config.setdefault("INSTRUMENTATION", os.environ.get("INSTRUMENTATION") == "1")
+    config.setdefault("METRICS_TOKEN", os.environ.get("METRICS_TOKEN"))
+    config.setdefault("PROFILE_SLOW_REQUEST_MS", os.environ.get("PROFILE_SLOW_REQUEST_MS"))
+    config.setdefault("PROFILE_DIR", os.environ.get("PROFILE_DIR", os.path.join(app.instance_path, "profiles")))
+    if not config["INSTRUMENTATION"]:
+        return None
+    metrics = app.extensions["metrics"] = Metrics()
+    metrics.caches.update(caches or {})
+    profiler = None
+    if config["PROFILE_SLOW_REQUEST_MS"] is not None:
+        profiler = SlowRequestProfiler(
+            config["PROFILE_DIR"], float(config["PROFILE_SLOW_REQUEST_MS"]) / 1000
+        )
+        app.extensions["slow_request_profiler"] = profiler
+    _listen_for_sql()
+
+    encode = api.representations.get("application/json")
+    if encode is not None:
+        def timed_encode(data, code, headers=None):
+            started = time.perf_counter()
+            try:
+                return encode(data, code, headers)
+            finally:
+                record_timing("serialization_seconds", time.perf_counter() - started)
+
+        api.representations["application/json"] = timed_encode
+
+    @app.before_request
+    def start_timing():
+        request.environ[REQUEST_TIMINGS_KEY] = Counter(
+            sql_statements=0, sql_seconds=0.0, password_hash_seconds=0.0, serialization_seconds=0.0
+        )
+        request.environ[REQUEST_STARTED_KEY] = time.perf_counter()
+        if profiler is not None:
+            profiler.start_request()
+
+    @app.teardown_request
+    def observe(exc):
+        started = request.environ.get(REQUEST_STARTED_KEY)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        metrics.observe_request(route, request.method, elapsed, request.environ[REQUEST_TIMINGS_KEY])
+        if profiler is not None:
+            profiler.finish_request(route, request.method, elapsed)
+
+    @app.route("/metrics")
+    def prometheus_metrics():
+        if not _may_read_metrics(app):
+            return {"error": "metrics need an admin token or METRICS_TOKEN"}, 403
+        return Response(metrics.render(), content_type=PROMETHEUS)
+
+    return metrics
@@ -0,0 +1,400 @@
+"""Background jobs: a queue in the ``job`` table and a local pool of worker
+processes that runs it, so bulk imports, exports, rollup recomputes and
+recommendation refreshes never hold a request thread.
+
+    FLASK_APP="main:make_app()" DATABASE_URI=sqlite:///database.sqlite3 flask run-jobs --workers 2
+
+Workers share the queue through the database, so they need a file
+database rather than the in-memory default.
+"""
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import click
+from flask import current_app, request
+from flask.cli import with_appcontext
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import aliased
+
+from application.analytics import np, recompute_rollups
+from application.bulk_import import IMPORT_KINDS, detect_format, import_records
+from application.export import EXPORT_FORMATS, iter_export, pa
+from application.model import db, Job
+from application.recommendation import refresh_recommendations
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = 2
+# type -> jobs of that type running at once across all workers; a type at
+# its limit leaves the other workers to the rest of the queue
+JOB_LIMITS = {"import": 1, "export": 1, "recompute_rollups": 1, "refresh_recommendations": 1}
+# added to the niceness of worker processes, so the API keeps the CPU first
+JOB_NICE = 10
+MAX_ATTEMPTS = 3
+POLL_INTERVAL = 1.0
+PROGRESS_INTERVAL = 1.0
+CLAIM_CANDIDATES = 20
+
+
+def _flag(value):
+    return value in (True, 1, "1", "true", "yes")
+
+
+def _job_file(name):
+    directory = current_app.config["JOB_DIR"]
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, name)
+
+
+def _import_params(args):
+    kind = args.get("kind")
+    if kind not in IMPORT_KINDS:
+        raise ValueError("kind must be one of " + ", ".join(IMPORT_KINDS))
+    upload = request.files.get("file")
+    if upload is not None:
+        stream, fmt = upload.stream, detect_format(upload.filename, upload.mimetype)
+    else:
+        stream, fmt = request.stream, detect_format(None, request.mimetype)
+    fmt = args.get("format", fmt)
+    if fmt not in ("csv", "ndjson"):
+        raise ValueError(f"unsupported format: {fmt}")
+    # the upload is read by a worker, so it is stored before the job is queued
+    path = _job_file(f"upload-{uuid.uuid4().hex}.{fmt}")
+    with open(path, "wb") as f:
+        shutil.copyfileobj(stream, f)
+    return {"kind": kind, "format": fmt, "path": path}
+
+
+def _run_import(job, params, progress):
+    try:
+        with open(params["path"], "rb") as f:
+            return import_records(params["kind"], f, params["format"], progress=progress)
+    finally:
+        os.remove(params["path"])
+
+
+def _export_params(args):
+    fmt = args.get("format", "csv")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"unsupported format: {fmt}")
+    if fmt != "csv" and pa is None:
+        raise ValueError(f"{fmt} export requires pyarrow")
+    return {
+        "format": fmt,
+        "category": args.get("category"),
+        "country": args.get("country"),
+        "year": args.get("year"),
+    }
+
+
+def _run_export(job, params, progress):
+    fmt = params["format"]
+    path = _job_file(f"export-{job.id}.{EXPORT_FORMATS[fmt][1]}")
+    chunks = iter_export(
+        fmt, progress=progress, category=params["category"], country=params["country"], year=params["year"]
+    )
+    # written under another name first, so a result is never half a file
+    partial = path + ".part"
+    try:
+        with open(partial, "w", newline="") if fmt == "csv" else open(partial, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+    except BaseException:
+        os.remove(partial)
+        raise
+    os.replace(partial, path)
+    job.result_path = path
+    return {"format": fmt, "rows": progress.done, "size": os.path.getsize(path)}
+
+
+def _rollup_params(args):
+    vectorized = _flag(args.get("numpy"))
+    if vectorized and np is None:
+        raise ValueError("numpy rollups require numpy")
+    return {"numpy": vectorized}
+
+
+def _run_rollups(job, params, progress):
+    return {"seconds": round(recompute_rollups(vectorized=params["numpy"]), 3)}
+
+
+def _recommendation_params(args):
+    batch_size = args.get("batch_size", 500)
+    try:
+        batch_size = int(batch_size)
+    except (TypeError, ValueError):
+        raise ValueError("batch_size must be an integer")
+    if not 1 <= batch_size <= 10000:
+        raise ValueError("batch_size must be between 1 and 10000")
+    return {"all": _flag(args.get("all")), "batch_size": batch_size}
+
+
+def _run_recommendations(job, params, progress):
+    users = refresh_recommendations(
+        batch_size=params["batch_size"], stale_only=not params["all"], progress=progress
+    )
+    return {"users": users}
+
+
+# type -> (parameters, run). ``parameters`` turns the submitted arguments
+# into the JSON stored with the job, raising ValueError when they are
+# invalid; it runs in the request. ``run(job, params, progress)`` runs in a
+# worker and returns the job's result.
+JOB_TYPES = {
+    "import": (_import_params, _run_import),
+    "export": (_export_params, _run_export),
+    "recompute_rollups": (_rollup_params, _run_rollups),
+    "refresh_recommendations": (_recommendation_params, _run_recommendations),
+}
+
+
+def submit_job(job_type, args, created_by=None):
+    """Queue a job of ``job_type`` and return it. Raises ValueError when
+    ``args`` are not valid parameters for it."""
+    parameters, run = JOB_TYPES[job_type]
+    job = Job(type=job_type, params=parameters(args), created_by=created_by)
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+class Progress:
+    """Records how far a running job has got on its row, at most once per
+    PROGRESS_INTERVAL. Called with ``(done, total=None)``."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.done = None
+        self.total = None
+        self.written = 0.0
+
+    def __call__(self, done, total=None):
+        self.done = done
+        self.total = total
+        if time.monotonic() - self.written >= PROGRESS_INTERVAL:
+            self.write()
+
+    def write(self):
+        self.written = time.monotonic()
+        # outside the job's session, so it is seen while the job's own
+        # transaction is still open
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(
+                    Job.__table__.update()
+                    .where(Job.__table__.c.id == self.job_id)
+                    .values(progress=self.done, total=self.total)
+                )
+        except OperationalError:
+            # the job may hold SQLite's write lock; the final state is
+            # written when it finishes
+            pass
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_job(worker, limits):
+    """Mark the oldest queued job whose type is under its limit as running
+    by ``worker`` and return it, or None when none can start.
+
+    The limit is checked again inside the UPDATE that claims the job, so
+    workers racing for the same slot cannot both take it."""
+    running = dict(
+        db.session.query(Job.type, func.count()).filter(Job.status == "running").group_by(Job.type)
+    )
+    open_types = [t for t in JOB_TYPES if running.get(t, 0) < limits.get(t, 1)]
+    if open_types == []:
+        db.session.commit()
+        return None
+    candidates = (
+        db.session.query(Job.id, Job.type)
+        .filter(Job.status == "queued", Job.type.in_(open_types))
+        .order_by(Job.id)
+        .limit(CLAIM_CANDIDATES)
+        .all()
+    )
+    for job_id, job_type in candidates:
+        other = aliased(Job)
+        running = (
+            select(func.count(other.id))
+            .where(other.type == job_type, other.status == "running")
+            .scalar_subquery()
+        )
+        claimed = Job.query.filter(
+            Job.id == job_id, Job.status == "queued", running < limits.get(job_type, 1)
+        ).update(
+            {
+                "status": "running",
+                "worker": worker,
+                "started_at": datetime.utcnow(),
+                "attempts": Job.attempts + 1,
+            },
+            synchronize_session=False,
+        )
+        db.session.commit()
+        if claimed:
+            return db.session.get(Job, job_id)
+    return None
+
+
+def run_job(job):
+    """Run a claimed job and record its result or error."""
+    parameters, run = JOB_TYPES[job.type]
+    progress = Progress(job.id)
+    try:
+        result = run(job, job.params, progress)
+    except Exception as e:
+        db.session.rollback()
+        logger.exception("job %s (%s) failed", job.id, job.type)
+        job.status = "failed"
+        job.error = f"{e.__class__.__name__}: {e}"
+    else:
+        job.status = "succeeded"
+        job.result = result
+    if progress.done is not None:
+        job.progress = progress.done
+        job.total = progress.total
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+
+
+def work(stopping=None, poll_interval=POLL_INTERVAL, once=False):
+    """Claim and run jobs until ``stopping`` (a threading.Event) is set, or
+    with ``once`` until none can start. Returns the number of jobs run."""
+    stopping = stopping or threading.Event()
+    worker = worker_name()
+    limits = current_app.config["JOB_LIMITS"]
+    count = 0
+    while not stopping.is_set():
+        job = claim_job(worker, limits)
+        if job is not None:
+            run_job(job)
+            count += 1
+        db.session.remove()
+        if job is None:
+            if once:
+                break
+            stopping.wait(poll_interval)
+    return count
+
+
+def run_pending():
+    """Run the queued jobs in this process; for tests and for deployments
+    without a worker pool."""
+    return work(once=True)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def requeue_abandoned():
+    """Queue again the running jobs of workers on this host that have
+    exited, or fail them once they have been tried MAX_ATTEMPTS times.
+    Returns the number of jobs recovered."""
+    host = socket.gethostname()
+    count = 0
+    for job in Job.query.filter(Job.status == "running", Job.worker.like(f"{host}:%")):
+        if _alive(int(job.worker.rsplit(":", 1)[1])):
+            continue
+        if job.attempts >= MAX_ATTEMPTS:
+            job.status = "failed"
+            job.error = "worker exited"
+            job.finished_at = datetime.utcnow()
+        else:
+            job.status = "queued"
+            job.worker = None
+        count += 1
+    db.session.commit()
+    return count
+
+
+def _worker_process(app, poll_interval):
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    # Ctrl-C reaches the whole process group; the pool stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    os.nice(app.config["JOB_NICE"])
+    # connections the pool opened before forking are dropped by the fork
+    # hook configure_database installs
+    with app.app_context():
+        work(stopping, poll_interval)
+
+
+def run_workers(processes, poll_interval=POLL_INTERVAL):
+    """Run ``processes`` forked worker processes until SIGTERM or SIGINT,
+    replacing any that exit and recovering their jobs. On shutdown each
+    worker finishes the job it is running first."""
+    app = current_app._get_current_object()
+    stopping = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: stopping.set())
+    context = multiprocessing.get_context("fork")
+    requeue_abandoned()
+    db.session.remove()
+    workers = []
+    while not stopping.is_set():
+        alive = [process for process in workers if process.is_alive()]
+        if len(alive) < len(workers):
+            for process in workers:
+                process.join(0)
+            requeue_abandoned()
+            db.session.remove()
+        workers = alive
+        while len(workers) < processes:
+            process = context.Process(target=_worker_process, args=(app, poll_interval), daemon=True)
+            process.start()
+            workers.append(process)
+        stopping.wait(poll_interval)
+    for process in workers:
+        process.terminate()
+    for process in workers:
+        process.join()
+
+
+def _limits(value):
+    limits = dict(JOB_LIMITS)
+    for item in filter(None, value.split(",")):
+        job_type, limit = item.split("=")
+        limits[job_type.strip()] = int(limit)
+    return limits
+
+
+def init_jobs(app):
+    """Job settings: JOB_WORKERS processes in the pool, JOB_LIMITS per type
+    (env ``JOB_LIMITS=export=1,import=2``), JOB_DIR for uploads and results
+    (default ``<instance path>/jobs``) and JOB_NICE for the workers."""
+    config = app.config
+    config.setdefault("JOB_WORKERS", int(os.environ.get("JOB_WORKERS", JOB_WORKERS)))
+    config.setdefault("JOB_LIMITS", _limits(os.environ.get("JOB_LIMITS", "")))
+    config.setdefault("JOB_DIR", os.environ.get("JOB_DIR") or os.path.join(app.instance_path, "jobs"))
+    config.setdefault("JOB_NICE", int(os.environ.get("JOB_NICE", JOB_NICE)))
+
+
+@click.command("run-jobs")
+@click.option("--workers", type=int, help="Worker processes (default: JOB_WORKERS).")
+@click.option("--once", is_flag=True, help="Run the queued jobs in this process, then exit.")
+@with_appcontext
+def run_jobs_command(workers, once):
+    """Run background jobs from the job queue."""
+    if once:
+        click.echo(f"ran {run_pending()} jobs")
+        return
+    run_workers(workers or current_app.config["JOB_WORKERS"])
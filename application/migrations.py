@@ -0,0 +1,281 @@
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import func, inspect, select, text
+from sqlalchemy.exc import IntegrityError
+
+from application.analytics import ROLLUP_DDL, recompute_sql
+from application.database import setup_lock
+from application.model import db, CohortRollup, CourseTermRollup, Job, to_integer
+from application.search import fill_search_index
+
+schema_version = db.Table(
+    "schema_version",
+    db.Column("version", db.Integer, primary_key=True),
+    db.Column("description", db.String, nullable=False),
+    db.Column("applied_at", db.DateTime, nullable=False),
+)
+
+# table -> (integer columns, categorical columns) stored as strings before
+# version 2
+TYPED_COLUMNS = {
+    "student": (
+        ["hours_dedicated"],
+        ["gender", "category", "pwd", "bandwith", "target_for_iitm"],
+    ),
+    "schooldetails": (["marks", "year_of_passing"], ["type_of_school", "pass_status"]),
+    "collegedetails": (["year_of_joining", "year_of_completion", "current_year"], ["college_status"]),
+    "jeedetails": (["qualified_year"], ["jee_qualified", "qualified_month"]),
+}
+
+
+def _whole_number(value):
+    value = str(value).strip()
+    try:
+        number = to_integer(value)
+    except ValueError:
+        number = to_integer(float(value))
+    if number is not None and not -(2**63) <= number < 2**63:
+        raise ValueError(f"out of range: {value}")
+    return number
+
+
+def _typed_columns(connection):
+    """Move the string columns of TYPED_COLUMNS to integers and lookup codes.
+
+    Each column is converted in place (add the typed column, copy, drop the
+    old one), so indexes and triggers on the tables survive. The new columns
+    of every table are added before any data is copied or any column is
+    dropped: triggers created by db.create_all() may already refer to them,
+    and SQLite checks every trigger in the schema on DROP COLUMN.
+
+    Numbers are read as to_integer reads them, so blanks become NULL and
+    " 90 ", "-3" or "88.0" are kept; any other value stops the migration
+    with the ids of its rows, leaving the database as it was. Every label,
+    blank ones too, gets a code as Lookup.code would give it."""
+    pending = []
+    for table, (integers, categories) in TYPED_COLUMNS.items():
+        columns = {c["name"]: c["type"] for c in inspect(connection).get_columns(table)}
+        categories = [name for name in categories if name in columns]
+        integers = [name for name in integers if columns[name].python_type is not int]
+        for name in categories:
+            lookup = f"lookup_{name}"
+            connection.execute(
+                text(f"CREATE TABLE IF NOT EXISTS {lookup} (id INTEGER PRIMARY KEY, label VARCHAR NOT NULL UNIQUE)")
+            )
+            connection.execute(
+                text(
+                    f"""INSERT INTO {lookup} (label)
+                    SELECT DISTINCT {name} FROM {table}
+                    WHERE {name} IS NOT NULL AND {name} NOT IN (SELECT label FROM {lookup})
+                    ORDER BY {name}"""
+                )
+            )
+            if f"{name}_id" not in columns:
+                connection.execute(
+                    text(f"ALTER TABLE {table} ADD COLUMN {name}_id SMALLINT REFERENCES {lookup} (id)")
+                )
+        for name in integers:
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {name}_int INTEGER"))
+        pending.append((table, integers, categories))
+    numbers = {}
+    invalid = []
+    for table, integers, categories in pending:
+        for name in integers:
+            numbers[table, name] = []
+            rows = connection.execute(text(f"SELECT id, {name} FROM {table} WHERE {name} IS NOT NULL"))
+            ids = []
+            for id, value in rows:
+                try:
+                    numbers[table, name].append({"id": id, "value": _whole_number(value)})
+                except ValueError:
+                    ids.append(id)
+            if ids != []:
+                invalid.append(f"{table}.{name} in rows " + ", ".join(map(str, ids)))
+    if invalid != []:
+        raise ValueError("not whole numbers: " + "; ".join(invalid))
+    for table, integers, categories in pending:
+        for name in categories:
+            connection.execute(
+                text(f"UPDATE {table} SET {name}_id = (SELECT id FROM lookup_{name} WHERE label = {table}.{name})")
+            )
+            connection.execute(text(f"ALTER TABLE {table} DROP COLUMN {name}"))
+        for name in integers:
+            if numbers[table, name] != []:
+                connection.execute(
+                    text(f"UPDATE {table} SET {name}_int = :value WHERE id = :id"), numbers[table, name]
+                )
+            connection.execute(text(f"ALTER TABLE {table} DROP COLUMN {name}"))
+            connection.execute(text(f"ALTER TABLE {table} RENAME COLUMN {name}_int TO {name}"))
+
+
+def _rollups(connection):
+    for table in (CourseTermRollup.__table__, CohortRollup.__table__):
+        table.create(connection, checkfirst=True)
+    if connection.dialect.name == "sqlite":
+        for statement in ROLLUP_DDL:
+            connection.execute(text(statement))
+    connection.execute(CourseTermRollup.__table__.delete())
+    connection.execute(CohortRollup.__table__.delete())
+    recompute_sql(connection)
+
+
+VERSIONED_TABLES = ["student", "schooldetails", "collegedetails", "jeedetails", "completedcourse"]
+
+
+def _row_versions(connection):
+    """Add the version column ETags are built from, with a random tag for
+    every existing row."""
+    if connection.dialect.name == "sqlite":
+        random_tag = "lower(hex(randomblob(16)))"
+    else:
+        random_tag = "md5(random()::text || id::text)"
+    for table in VERSIONED_TABLES:
+        columns = {c["name"] for c in inspect(connection).get_columns(table)}
+        if "version" not in columns:
+            connection.execute(text(f"ALTER TABLE {table} ADD COLUMN version VARCHAR(32) NOT NULL DEFAULT ''"))
+        connection.execute(text(f"UPDATE {table} SET version = {random_tag} WHERE version = ''"))
+
+
+def _jobs(connection):
+    Job.__table__.create(connection, checkfirst=True)
+
+
+# tables holding at most one row per user
+ONE_PER_USER_TABLES = ["student", "schooldetails", "collegedetails", "jeedetails"]
+
+
+def _unique_user_ids(connection):
+    """Make the user_id index of ONE_PER_USER_TABLES unique. Of duplicated
+    rows the first is kept, as that is the one the API has been serving."""
+    for table in ONE_PER_USER_TABLES:
+        connection.execute(
+            text(
+                f"""DELETE FROM {table} WHERE user_id IS NOT NULL AND id NOT IN (
+                    SELECT MIN(id) FROM {table} GROUP BY user_id
+                )"""
+            )
+        )
+        connection.execute(text(f"DROP INDEX IF EXISTS ix_{table}_user_id"))
+        connection.execute(text(f"CREATE UNIQUE INDEX ix_{table}_user_id ON {table} (user_id)"))
+
+
+def _search_index(connection):
+    # db.create_all() creates the table and triggers on an existing
+    # database but leaves the table empty
+    if connection.dialect.name == "sqlite":
+        fill_search_index(connection)
+
+
+# (version, description, statements). Append new migrations with the next
+# version number and never edit one that has shipped. Statements, SQL or
+# functions taking the connection, must be idempotent: db.create_all()
+# already builds a fresh database with the current schema, and migrations
+# are then run over it as well.
+MIGRATIONS = [
+    (
+        1,
+        "index user_id lookups and make completed courses unique per user",
+        [
+            "CREATE INDEX IF NOT EXISTS ix_student_user_id ON student (user_id)",
+            "CREATE INDEX IF NOT EXISTS ix_schooldetails_user_id ON schooldetails (user_id)",
+            "CREATE INDEX IF NOT EXISTS ix_collegedetails_user_id ON collegedetails (user_id)",
+            "CREATE INDEX IF NOT EXISTS ix_jeedetails_user_id ON jeedetails (user_id)",
+            "CREATE INDEX IF NOT EXISTS ix_completedcourse_course_id ON completedcourse (course_id)",
+            "CREATE INDEX IF NOT EXISTS ix_roles_users_user_id_role_id ON roles_users (user_id, role_id)",
+            "CREATE INDEX IF NOT EXISTS ix_roles_users_role_id ON roles_users (role_id)",
+            # keep the most recent row of any duplicated (user_id, course_id)
+            """DELETE FROM completedcourse WHERE id NOT IN (
+                SELECT MAX(id) FROM completedcourse GROUP BY user_id, course_id
+            )""",
+            """CREATE UNIQUE INDEX IF NOT EXISTS uq_completedcourse_user_id_course_id
+            ON completedcourse (user_id, course_id)""",
+        ],
+    ),
+    (
+        2,
+        "store years, marks and hours as integers and categorical fields as lookup codes",
+        [_typed_columns],
+    ),
+    (
+        3,
+        "add analytics rollups maintained by triggers",
+        [_rollups],
+    ),
+    (
+        4,
+        "version profile rows for ETags and optimistic concurrency",
+        [_row_versions],
+    ),
+    (
+        5,
+        "add the background job queue",
+        [_jobs],
+    ),
+    (
+        6,
+        "allow one student, school, college and JEE row per user",
+        [_unique_user_ids],
+    ),
+    (
+        7,
+        "fill the student search index for rows written before it existed",
+        [_search_index],
+    ),
+]
+
+
+def current_version():
+    schema_version.create(db.engine, checkfirst=True)
+    with db.engine.connect() as connection:
+        return connection.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def upgrade_schema():
+    """Apply pending migrations in order, each in its own transaction.
+
+    Returns the versions applied. Several processes may start at once; a
+    version another process recorded first is skipped."""
+    applied = []
+    current = current_version()
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        try:
+            with db.engine.begin() as connection:
+                for statement in statements:
+                    if callable(statement):
+                        statement(connection)
+                    else:
+                        connection.execute(text(statement))
+                connection.execute(
+                    schema_version.insert().values(
+                        version=version, description=description, applied_at=datetime.utcnow()
+                    )
+                )
+        except IntegrityError:
+            continue
+        applied.append(version)
+    return applied
+
+
+def setup_database(app):
+    """Create missing tables and apply pending migrations. Worker processes
+    starting together on one SQLite file do this one at a time, so only the
+    first does any work."""
+    with app.app_context(), setup_lock(app):
+        db.create_all()
+        return upgrade_schema()
+
+
+@click.command("upgrade-db")
+@with_appcontext
+def upgrade_db_command():
+    """Create missing tables and apply pending schema migrations."""
+    applied = setup_database(current_app._get_current_object())
+    if applied == []:
+        click.echo(f"schema is up to date at version {current_version()}")
+    else:
+        click.echo("applied migrations " + ", ".join(str(v) for v in applied))
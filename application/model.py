@@ -1,15 +1,216 @@
-from flask_sqlalchemy import SQLAlchemy
+import uuid
+from datetime import datetime
+
+from flask import current_app
 from flask_security import UserMixin, RoleMixin
+from sqlalchemy import event, select
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import Session, joinedload, validates
+
+from application.database import Database
 
-db = SQLAlchemy()
+db = Database()
 
 roles_users = db.Table(
     "roles_users",
     db.Column("user_id", db.Integer(), db.ForeignKey("user.id")),
-    db.Column("role_id", db.Integer(), db.ForeignKey("role.id")),
+    db.Column("role_id", db.Integer(), db.ForeignKey("role.id"), index=True),
+    db.Index("ix_roles_users_user_id_role_id", "user_id", "role_id"),
 )
 
 
+class Lookup:
+    """Small-int codes for the labels of one categorical field.
+
+    The labels live in a ``lookup_<name>`` table and detail rows store the
+    code. Labels are append-only: one not seen before is added on first
+    write, so the JSON contract still accepts any string. Codes are cached
+    per app; new ones only once their transaction commits."""
+
+    def __init__(self, name):
+        self.name = name
+        self.table = db.Table(
+            f"lookup_{name}",
+            # INTEGER on SQLite makes it the rowid, so it numbers itself
+            db.Column("id", db.SmallInteger().with_variant(db.Integer, "sqlite"), primary_key=True),
+            db.Column("label", db.String, nullable=False, unique=True),
+        )
+
+    def code(self, label, create=True):
+        """Code of ``label``, adding it when ``create`` is set; otherwise
+        None for a label never stored."""
+        if label is None:
+            return None
+        label = lookup_label(label)
+        codes, labels = self._cache()
+        code = codes.get(label)
+        if code is None:
+            code = db.session.info.get("lookup_pending", {}).get((self, label))
+        if code is None:
+            codes, labels = self._load()
+            code = codes.get(label)
+        if code is None and create:
+            db.session.execute(
+                self.table.insert().prefix_with("OR IGNORE", dialect="sqlite").values(label=label)
+            )
+            code = db.session.execute(
+                select(self.table.c.id).where(self.table.c.label == label)
+            ).scalar_one()
+            db.session.info.setdefault("lookup_pending", {})[(self, label)] = code
+        return code
+
+    def label(self, code):
+        if code is None:
+            return None
+        codes, labels = self._cache()
+        label = labels.get(code)
+        if label is None:
+            for (lookup, pending), pending_code in db.session.info.get("lookup_pending", {}).items():
+                if lookup is self and pending_code == code:
+                    return pending
+            codes, labels = self._load()
+            label = labels[code]
+        return label
+
+    def _load(self):
+        pending = {label for lookup, label in db.session.info.get("lookup_pending", {}) if lookup is self}
+        rows = db.session.execute(select(self.table.c.id, self.table.c.label)).all()
+        return self._remember((code, label) for code, label in rows if label not in pending)
+
+    def _cache(self):
+        # (label -> code, code -> label); per app, as every app has its own
+        # database and so its own codes
+        return current_app.extensions.setdefault("lookups", {}).get(self.name, ({}, {}))
+
+    def _remember(self, pairs):
+        codes = dict(self._cache()[0])
+        codes.update((label, code) for code, label in pairs)
+        cache = codes, {code: label for label, code in codes.items()}
+        current_app.extensions.setdefault("lookups", {})[self.name] = cache
+        return cache
+
+    def field(self, column_key):
+        """Model attribute reading and writing the label of the code stored in
+        ``column_key``. In queries it is the label, as a subquery."""
+        lookup = self
+
+        def get_label(instance):
+            return lookup.label(getattr(instance, column_key))
+
+        def set_label(instance, value):
+            setattr(instance, column_key, lookup.code(value))
+
+        def label_expression(cls):
+            return (
+                select(lookup.table.c.label)
+                .where(lookup.table.c.id == getattr(cls, column_key))
+                .scalar_subquery()
+            )
+
+        field = hybrid_property(get_label, set_label, expr=label_expression)
+        field.lookup = lookup
+        field.column_key = column_key
+        return field
+
+
+def lookup_label(value):
+    # booleans were stored as "1" and "0" when these columns were strings
+    if isinstance(value, bool):
+        return str(int(value))
+    return str(value)
+
+
+@event.listens_for(Session, "after_commit")
+def _remember_pending_lookups(session):
+    pending = session.info.pop("lookup_pending", {})
+    for lookup, label in pending:
+        lookup._remember([(pending[(lookup, label)], label)])
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending_lookups(session):
+    session.info.pop("lookup_pending", None)
+
+
+def lookup_fields(model):
+    """``{name: field}`` for the lookup attributes of ``model``."""
+    return {
+        name: attribute
+        for name, attribute in vars(model).items()
+        if isinstance(attribute, hybrid_property) and hasattr(attribute, "lookup")
+    }
+
+
+def readable_columns(model):
+    """``(name, column)`` for each column of ``model``, with lookup codes
+    replaced by their labels."""
+    names = {field.column_key: name for name, field in lookup_fields(model).items()}
+    return [
+        (names.get(column.key, column.key), getattr(model, names.get(column.key, column.key)))
+        for column in model.__table__.columns
+    ]
+
+
+def to_integer(value):
+    """``value`` as an int; numeric strings and whole floats are accepted."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(f"not an integer: {value!r}")
+    return int(value)
+
+
+def integer_fields(*names):
+    """Validator storing ``names`` as ints whatever the caller passed."""
+    return validates(*names)(lambda self, key, value: to_integer(value))
+
+
+def to_datetime(value):
+    """``value`` as a datetime; ISO 8601 strings are parsed."""
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+LOOKUPS = {
+    name: Lookup(name)
+    for name in (
+        "gender",
+        "category",
+        "pwd",
+        "bandwith",
+        "target_for_iitm",
+        "type_of_school",
+        "pass_status",
+        "college_status",
+        "jee_qualified",
+        "qualified_month",
+    )
+}
+
+
+def lookup_column(name):
+    return db.Column(f"{name}_id", db.SmallInteger, db.ForeignKey(f"lookup_{name}.id"))
+
+
+def new_version(previous=None):
+    return uuid.uuid4().hex
+
+
+def version_column():
+    """Tag of the row's current contents, used as its ETag.
+
+    A random tag rather than a counter, so a row deleted and created again
+    under the same id never repeats one. The ORM sets it on every write and
+    checks it on UPDATE and DELETE (``version_id_col``); the defaults cover
+    bulk writes through Core."""
+    return db.Column(db.String(32), nullable=False, default=new_version, onupdate=new_version)
+
+
+def versioned(version):
+    return {"version_id_col": version, "version_id_generator": new_version}
+
+
 class User(db.Model, UserMixin):
     __tablename__ = "user"
     id = db.Column(db.Integer, autoincrement=True, primary_key=True)
@@ -18,6 +219,10 @@ class User(db.Model, UserMixin):
     full_name = db.Column(db.String, nullable=False)
     active = db.Column(db.Boolean)
     fs_uniquifier = db.Column(db.String, unique=True, nullable=False)
+    # Everything is loaded on access; use user_with() to fetch detail rows
+    # together with the user. roles are not eager loaded: joining them
+    # through roles_users nests the join, and SQLite then scans roles_users
+    # instead of using its index.
     roles = db.relationship("Role", secondary=roles_users, backref=db.backref("users"))
     student = db.relationship("Student", backref="user")
     school = db.relationship("SchoolDetails", backref="user")
@@ -45,71 +250,178 @@ class Courses(db.Model):
 class Student(db.Model):
     __tablename__ = "student"
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), index=True, unique=True)
     dob = db.Column(db.DateTime, nullable=False)
     roll_no = db.Column(db.String)
-    gender = db.Column(db.String)
-    category = db.Column(db.String)
+    gender_id = lookup_column("gender")
+    category_id = lookup_column("category")
     country = db.Column(db.String)
-    pwd = db.Column(db.String)
+    pwd_id = lookup_column("pwd")
     type_of_disability = db.Column(db.String)
     requirement = db.Column(db.String)
-    bandwith = db.Column(db.String)
+    bandwith_id = lookup_column("bandwith")
     reason_of_joining = db.Column(db.String)
-    hours_dedicated = db.Column(db.String)
+    hours_dedicated = db.Column(db.Integer)
     source_kind = db.Column(db.String)
-    target_for_iitm = db.Column(db.String)
+    target_for_iitm_id = lookup_column("target_for_iitm")
+    version = version_column()
+
+    gender = LOOKUPS["gender"].field("gender_id")
+    category = LOOKUPS["category"].field("category_id")
+    pwd = LOOKUPS["pwd"].field("pwd_id")
+    bandwith = LOOKUPS["bandwith"].field("bandwith_id")
+    target_for_iitm = LOOKUPS["target_for_iitm"].field("target_for_iitm_id")
+    _integers = integer_fields("hours_dedicated")
+    _dates = validates("dob")(lambda self, key, value: to_datetime(value))
+    __mapper_args__ = versioned(version)
 
 
 class SchoolDetails(db.Model):
     __tablename__ = "schooldetails"
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), index=True, unique=True)
     school_name = db.Column(db.String)
-    type_of_school = db.Column(db.String)
-    marks = db.Column(db.String)
-    pass_status = db.Column(db.String)
-    year_of_passing = db.Column(db.String)
+    type_of_school_id = lookup_column("type_of_school")
+    marks = db.Column(db.Integer)
+    pass_status_id = lookup_column("pass_status")
+    year_of_passing = db.Column(db.Integer)
     city = db.Column(db.String)
     state = db.Column(db.String)
     other_city = db.Column(db.String)
     other_state = db.Column(db.String)
     country_of_school = db.Column(db.String)
+    version = version_column()
+
+    type_of_school = LOOKUPS["type_of_school"].field("type_of_school_id")
+    pass_status = LOOKUPS["pass_status"].field("pass_status_id")
+    _integers = integer_fields("marks", "year_of_passing")
+    __mapper_args__ = versioned(version)
 
 
 class CollegeDetails(db.Model):
     __tablename__ = "collegedetails"
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), index=True, unique=True)
     college_name = db.Column(db.String)
     university = db.Column(db.String)
     field_of_study = db.Column(db.String)
     roll_no = db.Column(db.String)
-    college_status = db.Column(db.String)
-    year_of_joining = db.Column(db.String)
-    year_of_completion = db.Column(db.String)
-    current_year = db.Column(db.String)
+    college_status_id = lookup_column("college_status")
+    year_of_joining = db.Column(db.Integer)
+    year_of_completion = db.Column(db.Integer)
+    current_year = db.Column(db.Integer)
     reason_for_dropping = db.Column(db.String)
     college_state = db.Column(db.String)
     college_country = db.Column(db.String)
     qualifying_criteria = db.Column(db.String)
+    version = version_column()
+
+    college_status = LOOKUPS["college_status"].field("college_status_id")
+    _integers = integer_fields("year_of_joining", "year_of_completion", "current_year")
+    __mapper_args__ = versioned(version)
 
 
 class JeeDetails(db.Model):
     __tablename__ = "jeedetails"
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
-    jee_qualified = db.Column(db.String)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), index=True, unique=True)
+    jee_qualified_id = lookup_column("jee_qualified")
     reg_id = db.Column(db.String)
-    qualified_month = db.Column(db.String)
-    qualified_year = db.Column(db.String)
+    qualified_month_id = lookup_column("qualified_month")
+    qualified_year = db.Column(db.Integer)
+    version = version_column()
+
+    jee_qualified = LOOKUPS["jee_qualified"].field("jee_qualified_id")
+    qualified_month = LOOKUPS["qualified_month"].field("qualified_month_id")
+    _integers = integer_fields("qualified_year")
+    __mapper_args__ = versioned(version)
 
 
 class CompletedCourse(db.Model):
     __tablename__ = "completedcourse"
+    # also serves user_id lookups, so user_id has no index of its own
+    __table_args__ = (
+        db.Index("uq_completedcourse_user_id_course_id", "user_id", "course_id", unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
-    course_id = db.Column(db.Integer, db.ForeignKey("course.id"))
+    course_id = db.Column(db.Integer, db.ForeignKey("course.id"), index=True)
     marks = db.Column(db.Integer)
     term_of_completion = db.Column(db.String)
-    course = db.relationship("Courses", backref="c")
\ No newline at end of file
+    version = version_column()
+    # course names come from the course catalog cache; joining here would
+    # only duplicate it
+    course = db.relationship("Courses", backref="c")
+    __mapper_args__ = versioned(version)
+
+
+class RecommendedCourses(db.Model):
+    __tablename__ = "recommendation"
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    course_ids = db.Column(db.String, nullable=False, default="")
+    stale = db.Column(db.Boolean, nullable=False, default=False)
+    updated_at = db.Column(db.DateTime)
+
+
+class CourseTermRollup(db.Model):
+    """Completed courses per course and term, kept current by triggers
+    (application/analytics.py). ``term`` is "" when not recorded."""
+
+    __tablename__ = "rollup_course_term"
+    course_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    term = db.Column(db.String, primary_key=True)
+    completions = db.Column(db.Integer, nullable=False, default=0)
+    marked = db.Column(db.Integer, nullable=False, default=0)
+    marks_sum = db.Column(db.Integer, nullable=False, default=0)
+
+
+class CohortRollup(db.Model):
+    """Row counts per value of a student or JEE field, kept current by
+    triggers. ``value`` is "" when the field is empty."""
+
+    __tablename__ = "rollup_cohort"
+    dimension = db.Column(db.String, primary_key=True)
+    value = db.Column(db.String, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class Job(db.Model):
+    """Background job run by the worker pool (application/jobs.py).
+
+    ``status`` moves from "queued" to "running" to "succeeded" or "failed".
+    ``progress`` counts the units of work done, out of ``total`` when it is
+    known in advance."""
+
+    __tablename__ = "job"
+    id = db.Column(db.Integer, primary_key=True)
+    type = db.Column(db.String, nullable=False)
+    status = db.Column(db.String, nullable=False, default="queued")
+    params = db.Column(db.JSON, nullable=False, default=dict)
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer)
+    result = db.Column(db.JSON)
+    error = db.Column(db.String)
+    # file the job wrote its result to, served by the result endpoint
+    result_path = db.Column(db.String)
+    # "host:pid" of the worker running it
+    worker = db.Column(db.String)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    created_by = db.Column(db.Integer, db.ForeignKey("user.id"))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    __table_args__ = (db.Index("ix_job_status_type", "status", "type"),)
+
+
+def user_with(user_id, *relationships):
+    """Load one user together with ``relationships`` (e.g. ``User.school``)
+    in a single joined query. Returns None when the user does not exist."""
+    # .all() rather than .first(): LIMIT makes the eager joins wrap the
+    # user in a subquery, which SQLite then scans
+    users = (
+        User.query.options(*[joinedload(r) for r in relationships])
+        .populate_existing()
+        .filter_by(id=user_id)
+        .all()
+    )
+    return users[0] if users != [] else None
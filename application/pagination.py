@@ -0,0 +1,139 @@
+import base64
+import json
+
+from flask import Response, request, stream_with_context
+from sqlalchemy import tuple_
+
+from application.serialization import dumps
+from application.versioning import conditional
+
+MAX_PAGE_SIZE = 500
+STREAM_BATCH_SIZE = 500
+NDJSON = "application/x-ndjson"
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise ValueError("invalid cursor")
+    if not isinstance(values, list):
+        raise ValueError("invalid cursor")
+    return values
+
+
+def _cursor_value_ok(value, column):
+    """Whether ``value`` from a cursor can be compared with ``column``: a
+    JSON scalar of the column's type, and for integers one SQLite can bind.
+    A forged cursor must not put lists or dicts into the query."""
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        return False
+    if isinstance(value, int) and not -(2**63) <= value < 2**63:
+        return False
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        # untyped expressions, such as the search score
+        return True
+    if python_type is int:
+        return isinstance(value, int)
+    if python_type is float:
+        return isinstance(value, (int, float))
+    if python_type is str:
+        return isinstance(value, str)
+    return True
+
+
+def wants_stream():
+    return request.args.get("stream") == "ndjson" or request.accept_mimetypes.best == NDJSON
+
+
+def ndjson_response(rows, serialize):
+    """Stream ``rows`` as newline delimited JSON without materializing them."""
+
+    def generate():
+        for row in rows:
+            yield dumps(serialize(row), default=str) + b"\n"
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON)
+
+
+def list_response(query, columns, serialize, empty=None, etag=None, descending=False):
+    """Build the response for a collection endpoint from an ORM query.
+
+    Rows are ordered by ``columns`` and paged by keyset: ``?limit=N`` returns
+    at most N rows and an ``X-Next-Cursor`` header when more remain, and
+    ``?after=<cursor>`` continues from there. Without ``limit`` the whole
+    collection is returned as before. ``?stream=ndjson`` (or an
+    ``Accept: application/x-ndjson`` header) streams every remaining row from
+    a server-side cursor instead. ``empty`` is returned when the first page
+    has no rows. ``etag``, a function of the rows of the page, tags pages
+    for conditional GETs. ``descending`` lists the highest keys first."""
+    after = request.args.get("after")
+    if after is not None:
+        try:
+            values = decode_cursor(after)
+        except ValueError:
+            return {"error": "invalid cursor"}, 400
+        if len(values) != len(columns) or not all(map(_cursor_value_ok, values, columns)):
+            return {"error": "invalid cursor"}, 400
+        if descending:
+            query = query.filter(tuple_(*columns) < tuple_(*values))
+        else:
+            query = query.filter(tuple_(*columns) > tuple_(*values))
+    query = query.order_by(*[column.desc() for column in columns] if descending else columns)
+    if wants_stream():
+        return ndjson_response(query.yield_per(STREAM_BATCH_SIZE), serialize)
+    limit = request.args.get("limit", type=int)
+    headers = {}
+    if limit is None:
+        rows = query.all()
+    else:
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        rows = query.limit(limit + 1).all()
+        if len(rows) > limit:
+            rows = rows[:limit]
+            headers[NEXT_CURSOR_HEADER] = encode_cursor(
+                [getattr(rows[-1], column.key) for column in columns]
+            )
+    if rows == [] and after is None and empty is not None:
+        return empty
+    if etag is not None:
+        return conditional(etag(rows), lambda: ([serialize(row) for row in rows], 200, headers))
+    return [serialize(row) for row in rows], 200, headers
+
+
+def sequence_response(items, key, serialize, empty=None):
+    """``list_response`` for an in-memory sequence already ordered by ``key``,
+    such as a cached catalog. Accepts the same ``limit``, ``after`` and
+    ``stream`` parameters and produces the same cursors."""
+    after = request.args.get("after")
+    if after is not None:
+        try:
+            values = decode_cursor(after)
+        except ValueError:
+            return {"error": "invalid cursor"}, 400
+        if len(values) != 1:
+            return {"error": "invalid cursor"}, 400
+        try:
+            items = [item for item in items if key(item) > values[0]]
+        except TypeError:
+            return {"error": "invalid cursor"}, 400
+    if wants_stream():
+        return ndjson_response(items, serialize)
+    limit = request.args.get("limit", type=int)
+    headers = {}
+    rows = list(items)
+    if limit is not None:
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        if len(rows) > limit:
+            rows = rows[:limit]
+            headers[NEXT_CURSOR_HEADER] = encode_cursor([key(rows[-1])])
+    if rows == [] and after is None and empty is not None:
+        return empty
+    return [serialize(row) for row in rows], 200, headers
@@ -0,0 +1,117 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+import passlib.hash
+from flask import current_app
+from flask_security.utils import get_hmac, use_double_hash
+
+from application.instrumentation import record_timing
+
+DEFAULT_QUEUE_PER_WORKER = 4
+DEFAULT_TIMEOUT = 30
+
+
+class PasswordPoolFull(Exception):
+    """Raised when every password worker is busy and the queue is full, or
+    when a queued call does not finish within ``PASSWORD_HASH_TIMEOUT``."""
+
+
+def _verify(scheme, password, password_hash):
+    return getattr(passlib.hash, scheme).verify(password, password_hash)
+
+
+def _hash(scheme, password, options):
+    return getattr(passlib.hash, scheme).using(**options).hash(password)
+
+
+class PasswordHasher:
+    """Runs password hashing and verification on a bounded process pool.
+
+    bcrypt is deliberately slow, so running it on the request thread lets a
+    burst of logins stall every other endpoint. Work is handed to
+    ``PASSWORD_HASH_WORKERS`` processes (0 runs it inline) and at most
+    ``PASSWORD_HASH_QUEUE_DEPTH`` calls may be queued or running at once;
+    beyond that ``PasswordPoolFull`` is raised so the caller can answer 429
+    instead of piling up requests. A call counts against the depth until its
+    worker is done with it, even when the caller has given up waiting.
+
+    The HMAC pre-hash from Flask-Security is still applied in the calling
+    process, so hashes stay compatible with ``hash_password`` and
+    ``verify_password``."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+        self._pid = None
+
+    def _pool(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    workers = current_app.config["PASSWORD_HASH_WORKERS"]
+                    depth = current_app.config.get(
+                        "PASSWORD_HASH_QUEUE_DEPTH", max(workers, 1) * DEFAULT_QUEUE_PER_WORKER
+                    )
+                    self._executor = None
+                    if workers > 0:
+                        self._executor = ProcessPoolExecutor(
+                            max_workers=workers,
+                            mp_context=multiprocessing.get_context("spawn"),
+                        )
+                    self._slots = threading.BoundedSemaphore(depth)
+                    self._pid = os.getpid()
+        return self._executor, self._slots
+
+    def _run(self, fn, *args):
+        executor, slots = self._pool()
+        if not slots.acquire(blocking=False):
+            raise PasswordPoolFull()
+        started = time.perf_counter()
+        try:
+            if executor is None:
+                try:
+                    return fn(*args)
+                finally:
+                    slots.release()
+            try:
+                future = executor.submit(fn, *args)
+            except BaseException:
+                slots.release()
+                raise
+            future.add_done_callback(lambda future: slots.release())
+            timeout = current_app.config.get("PASSWORD_HASH_TIMEOUT", DEFAULT_TIMEOUT)
+            try:
+                return future.result(timeout=timeout)
+            except TimeoutError:
+                # frees the slot now if the call never started
+                future.cancel()
+                raise PasswordPoolFull()
+        finally:
+            record_timing("password_hash_seconds", time.perf_counter() - started)
+
+    def verify(self, password, password_hash):
+        if use_double_hash(password_hash):
+            password = get_hmac(password)
+        scheme = current_app.extensions["security"].pwd_context.identify(password_hash)
+        return self._run(_verify, scheme, password, password_hash)
+
+    def hash(self, password):
+        if use_double_hash():
+            password = get_hmac(password).decode("ascii")
+        scheme = current_app.config["SECURITY_PASSWORD_HASH"]
+        options = current_app.config.get("SECURITY_PASSWORD_HASH_OPTIONS", {}).get(scheme, {})
+        return self._run(_hash, scheme, password, options)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown()
+            self._executor = None
+            self._pid = None
+
+
+password_hasher = PasswordHasher()
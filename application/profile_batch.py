@@ -0,0 +1,141 @@
+from sqlalchemy.exc import IntegrityError
+
+from application.catalog import course_catalog
+from application.model import (
+    db,
+    CollegeDetails,
+    CompletedCourse,
+    JeeDetails,
+    SchoolDetails,
+    Student,
+    User,
+    readable_columns,
+    user_with,
+)
+from application.recommendation import mark_stale
+from application.validation import college_body, completed_course_body, jee_body, school_body, student_body
+
+# section -> (model, relationship, body of its single endpoint); each user
+# has at most one row of these
+DETAIL_SECTIONS = {
+    "student": (Student, User.student, student_body),
+    "school": (SchoolDetails, User.school, school_body),
+    "college": (CollegeDetails, User.college, college_body),
+    "jee": (JeeDetails, User.jee, jee_body),
+}
+COURSES_SECTION = "completed_courses"
+MAX_COMPLETED_COURSES = 500
+
+
+def _writable(model):
+    return [name for name, column in readable_columns(model) if name not in ("id", "user_id", "version")]
+
+
+def parse_batch(payload):
+    """``(sections, errors)``: every section of ``payload`` parsed by the
+    body its single endpoint reads, keeping only the fields sent, and
+    ``{section: message}`` for the sections that cannot be written. The
+    batch is valid when ``errors`` is empty."""
+    if not isinstance(payload, dict) or payload == {}:
+        return {}, {"batch": "expected a JSON object with at least one section"}
+    sections = {}
+    errors = {}
+    for section, data in payload.items():
+        if section in DETAIL_SECTIONS:
+            model, relationship, body = DETAIL_SECTIONS[section]
+            values, error = body.parse(data, partial=True)
+            if error is None:
+                unknown = sorted(set(data) - set(_writable(model)))
+                if unknown != []:
+                    error = "unknown fields: " + ", ".join(unknown)
+        elif section == COURSES_SECTION:
+            values, error = _parse_courses(data)
+        elif section == "user_id":
+            continue
+        else:
+            error = "unknown section"
+        if error is not None:
+            errors[section] = error
+        else:
+            sections[section] = values
+    return sections, errors
+
+
+def _parse_courses(courses):
+    if not isinstance(courses, list):
+        return None, "expected a list of completed courses"
+    if len(courses) > MAX_COMPLETED_COURSES:
+        return None, f"at most {MAX_COMPLETED_COURSES} completed courses"
+    parsed = []
+    seen = set()
+    for i, course in enumerate(courses):
+        values, error = completed_course_body.parse(course, partial=True)
+        if error is None:
+            unknown = sorted(set(course) - set(_writable(CompletedCourse)))
+            course_id = values.get("course_id")
+            if unknown != []:
+                error = "unknown fields: " + ", ".join(unknown)
+            elif course_id is None:
+                error = "course_id is required"
+            elif course_catalog.get(course_id) is None:
+                error = f"course {course_id} does not exist"
+            elif course_id in seen:
+                error = f"course {course_id} is listed twice"
+            seen.add(course_id)
+        if error is not None:
+            return None, f"item {i}: {error}"
+        parsed.append(values)
+    return parsed, None
+
+
+def save_profile_batch(user_id, payload):
+    """Create or update every section of ``payload`` for ``user_id`` in one
+    transaction.
+
+    Sections the user already has are updated with the fields given; the
+    others are created. Completed courses are matched on ``course_id``.
+    Nothing is written unless every section is valid. Returns
+    ``(body, status)`` with a "created" or "updated" result per section."""
+    sections, errors = parse_batch(payload)
+    if errors:
+        return {"error": "invalid sections", "errors": errors}, 400
+    details = [s for s in sections if s in DETAIL_SECTIONS]
+    relationships = [DETAIL_SECTIONS[s][1] for s in details]
+    if COURSES_SECTION in sections:
+        relationships.append(User.c_course)
+    user = user_with(user_id, *relationships)
+    if user is None:
+        return {"error": "User Not Found"}, 404
+    if "student" in sections and user.student == [] and sections["student"].get("dob") is None:
+        return {"error": "invalid sections", "errors": {"student": "dob is required"}}, 400
+    results = {}
+    for section in details:
+        model, relationship, body = DETAIL_SECTIONS[section]
+        rows = getattr(user, relationship.key)
+        row = rows[0] if rows != [] else model(user_id=user.id)
+        results[section] = "updated" if rows != [] else "created"
+        for name, value in sections[section].items():
+            setattr(row, name, value)
+        db.session.add(row)
+    if COURSES_SECTION in sections:
+        existing = {c.course_id: c for c in user.c_course}
+        results[COURSES_SECTION] = []
+        for course in sections[COURSES_SECTION]:
+            row = existing.get(course["course_id"])
+            results[COURSES_SECTION].append(
+                {"course_id": course["course_id"], "result": "updated" if row is not None else "created"}
+            )
+            if row is None:
+                row = CompletedCourse(user_id=user.id)
+            for name, value in course.items():
+                setattr(row, name, value)
+            db.session.add(row)
+        mark_stale(user.id)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # a concurrent request created one of the sections first; every
+        # section is unique per user
+        db.session.rollback()
+        return {"error": "Profile changed concurrently, retry"}, 409
+    return {"message": "Profile saved", "results": results}, 200
@@ -0,0 +1,264 @@
+import re
+import threading
+import time
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy.exc import SQLAlchemyError
+
+from application.catalog import course_catalog
+from application.model import db, CompletedCourse, RecommendedCourses, User
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+LEVEL_ORDER = {"foundation": 0, "diploma": 1, "degree": 2}
+NO_PREREQUISITE = {"", "none", "nil", "na", "n/a", "-"}
+PREREQUISITE_SEPARATOR = re.compile(r"\s*[,;|/]\s*")
+# only splits an entry that is not itself a course name, such as
+# "Data Structures and Algorithms"
+CONJUNCTION = re.compile(r"\s*(?:&|\band\b)\s*", re.IGNORECASE)
+
+
+def level_rank(level):
+    return LEVEL_ORDER.get((level or "").strip().lower(), len(LEVEL_ORDER))
+
+
+class PrerequisiteGraph:
+    """In-memory DAG of course ids built from ``Courses.pre_requisite``.
+
+    ``pre_requisite`` holds course codes or names separated by commas,
+    semicolons or slashes, or by "and" or "&" when the entry as a whole is
+    not a course name. Entries that do not match a course in the catalog
+    are treated as free text and ignored. The graph is built from
+    the course catalog cache and rebuilt only when the catalog's ETag
+    changes, so requests never re-scan the course table.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def snapshot(self):
+        catalog = course_catalog.snapshot()
+        snapshot = self._snapshot
+        if snapshot is None or snapshot[0] != catalog.etag:
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot is None or snapshot[0] != catalog.etag:
+                    snapshot = (catalog.etag, self._build(catalog.courses))
+                    self._snapshot = snapshot
+        return snapshot[1]
+
+    def _build(self, rows):
+        ids_by_key = {}
+        for row in rows:
+            for key in (row["code"], row["name"]):
+                if key:
+                    ids_by_key[key.strip().lower()] = row["id"]
+        courses = {}
+        requires = {}
+        for row in rows:
+            id = row["id"]
+            courses[id] = {
+                "course_id": id,
+                "name": row["name"],
+                "code": row["code"],
+                "level": row["level"],
+            }
+            requires[id] = frozenset(
+                ids_by_key[token]
+                for token in self._tokens(row["pre_requisite"], ids_by_key)
+                if token in ids_by_key and ids_by_key[token] != id
+            )
+        order = sorted(
+            courses,
+            key=lambda id: (level_rank(courses[id]["level"]), courses[id]["code"] or "", id),
+        )
+        return courses, requires, order
+
+    @staticmethod
+    def _tokens(pre_requisite, known):
+        if pre_requisite is None:
+            return []
+        tokens = []
+        for entry in PREREQUISITE_SEPARATOR.split(pre_requisite):
+            entry = entry.strip().lower()
+            if entry in known:
+                tokens.append(entry)
+                continue
+            for token in CONJUNCTION.split(entry):
+                if token not in NO_PREREQUISITE:
+                    tokens.append(token)
+        return tokens
+
+    def eligible(self, completed):
+        """Return courses not in ``completed`` whose prerequisites are all in it,
+        ranked by level."""
+        courses, requires, order = self.snapshot()
+        completed = set(completed)
+        return [
+            courses[id]
+            for id in order
+            if id not in completed and requires[id] <= completed
+        ]
+
+
+course_graph = PrerequisiteGraph()
+
+
+def mark_stale(user_id):
+    """Flag one user's materialized recommendations for recomputation.
+
+    Runs in the caller's transaction, so commit it together with the write
+    that changed the user's completed courses."""
+    RecommendedCourses.query.filter_by(user_id=user_id).update(
+        {"stale": True}, synchronize_session=False
+    )
+
+
+def mark_all_stale():
+    RecommendedCourses.query.update({"stale": True}, synchronize_session=False)
+
+
+def _join_ids(ids):
+    return ",".join(str(id) for id in ids)
+
+
+def _split_ids(course_ids):
+    return [int(id) for id in course_ids.split(",") if id]
+
+
+def _eligible_for(user_id):
+    completed = db.session.query(CompletedCourse.course_id).filter_by(user_id=user_id)
+    return course_graph.eligible(course_id for (course_id,) in completed)
+
+
+def recommend(user_id):
+    """Return the ranked eligible courses for ``user_id``.
+
+    Reads the materialized row when it is fresh; otherwise computes the
+    result from the prerequisite graph and stores it for the next call.
+    As in refresh_recommendations, the row is written before completions
+    are read: a concurrent completed-course write then either commits first
+    and is counted, or waits for this transaction and marks the new row
+    stale, so no invalidation is lost."""
+    courses = course_graph.snapshot()[0]
+    row = RecommendedCourses.query.get(user_id)
+    if row is not None and not row.stale:
+        return [courses[id] for id in _split_ids(row.course_ids) if id in courses]
+    try:
+        if row is None:
+            row = RecommendedCourses(user_id=user_id, stale=True)
+            db.session.add(row)
+        row.updated_at = datetime.utcnow()
+        db.session.flush()
+        result = _eligible_for(user_id)
+        row.course_ids = _join_ids(c["course_id"] for c in result)
+        row.stale = False
+        db.session.commit()
+        return result
+    except SQLAlchemyError:
+        db.session.rollback()
+    return _eligible_for(user_id)
+
+
+def _prerequisite_matrix(snapshot):
+    courses, requires, order = snapshot
+    index = {id: i for i, id in enumerate(order)}
+    # matrix[i, j] is 1 when course order[j] requires course order[i]
+    matrix = np.zeros((len(order), len(order)), dtype=np.int32)
+    for id, required in requires.items():
+        for r in required:
+            matrix[index[r], index[id]] = 1
+    return index, matrix, np.array(order, dtype=np.int64)
+
+
+def _eligible_batch(matrix, user_ids, completed_by_user):
+    if matrix is None:
+        return {
+            user_id: [
+                c["course_id"]
+                for c in course_graph.eligible(completed_by_user.get(user_id, ()))
+            ]
+            for user_id in user_ids
+        }
+    index, prerequisites, order = matrix
+    done = np.zeros((len(user_ids), len(order)), dtype=np.int32)
+    for row, user_id in enumerate(user_ids):
+        for course_id in completed_by_user.get(user_id, ()):
+            if course_id in index:
+                done[row, index[course_id]] = 1
+    eligible = (((1 - done) @ prerequisites) == 0) & (done == 0)
+    return {user_id: order[eligible[row]].tolist() for row, user_id in enumerate(user_ids)}
+
+
+def refresh_recommendations(batch_size=500, stale_only=True, progress=None):
+    """Recompute materialized recommendations in batches of users.
+
+    With ``stale_only`` only users whose row is missing or marked stale are
+    recomputed. Each batch is written in its own transaction; the existing
+    rows are deleted first so a concurrent completed-course write cannot
+    interleave between reading completions and storing the result.
+    ``progress`` is called with the users done and the total after each
+    batch. Returns the number of users refreshed."""
+    matrix = None
+    if np is not None:
+        matrix = _prerequisite_matrix(course_graph.snapshot())
+    query = db.session.query(User.id).outerjoin(
+        RecommendedCourses, RecommendedCourses.user_id == User.id
+    )
+    if stale_only:
+        query = query.filter(
+            (RecommendedCourses.user_id == None) | (RecommendedCourses.stale == True)
+        )
+    user_ids = [user_id for (user_id,) in query.order_by(User.id)]
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start : start + batch_size]
+        RecommendedCourses.query.filter(RecommendedCourses.user_id.in_(batch)).delete(
+            synchronize_session=False
+        )
+        completed_by_user = {}
+        completed = db.session.query(CompletedCourse.user_id, CompletedCourse.course_id)
+        for user_id, course_id in completed.filter(CompletedCourse.user_id.in_(batch)):
+            completed_by_user.setdefault(user_id, set()).add(course_id)
+        eligible = _eligible_batch(matrix, batch, completed_by_user)
+        now = datetime.utcnow()
+        db.session.execute(
+            RecommendedCourses.__table__.insert(),
+            [
+                {
+                    "user_id": user_id,
+                    "course_ids": _join_ids(eligible[user_id]),
+                    "stale": False,
+                    "updated_at": now,
+                }
+                for user_id in batch
+            ],
+        )
+        db.session.commit()
+        if progress is not None:
+            progress(start + len(batch), len(user_ids))
+    return len(user_ids)
+
+
+@click.command("refresh-recommendations")
+@click.option("--all", "refresh_all", is_flag=True, help="Recompute every user, not only stale rows.")
+@click.option("--batch-size", default=500, show_default=True)
+@click.option("--interval", default=0, help="Keep running, refreshing stale rows every N seconds.")
+@with_appcontext
+def refresh_recommendations_command(refresh_all, batch_size, interval):
+    """Precompute course recommendations for all users."""
+    while True:
+        count = refresh_recommendations(batch_size=batch_size, stale_only=not refresh_all)
+        click.echo(f"refreshed recommendations for {count} users")
+        if not interval:
+            break
+        refresh_all = False
+        time.sleep(interval)
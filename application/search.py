@@ -0,0 +1,142 @@
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import DDL, event, func, literal, literal_column, or_, table, text
+
+from application.model import db, User, Student
+
+SEARCH_TABLE = "student_search"
+
+
+def _refresh_row(user_id):
+    return f"""
+    DELETE FROM {SEARCH_TABLE} WHERE rowid = {user_id};
+    INSERT INTO {SEARCH_TABLE} (rowid, full_name, roll_no, email)
+    SELECT u.id, u.full_name,
+           (SELECT s.roll_no FROM student s WHERE s.user_id = u.id ORDER BY s.id LIMIT 1),
+           u.email
+    FROM "user" u WHERE u.id = {user_id};"""
+
+
+# One FTS5 row per user, keyed by rowid = user.id, with the trigram tokenizer
+# so MATCH behaves like a case-insensitive substring search. The triggers
+# keep it in sync with every write to user and student, whichever code path
+# makes it.
+SEARCH_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE}
+    USING fts5(full_name, roll_no, email, tokenize = 'trigram')""",
+    f"""CREATE TRIGGER IF NOT EXISTS user_search_ai AFTER INSERT ON "user" BEGIN
+    {_refresh_row("NEW.id")}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS user_search_au AFTER UPDATE OF full_name, email ON "user" BEGIN
+    {_refresh_row("NEW.id")}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS user_search_ad AFTER DELETE ON "user" BEGIN
+    DELETE FROM {SEARCH_TABLE} WHERE rowid = OLD.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS student_search_ai AFTER INSERT ON student BEGIN
+    {_refresh_row("NEW.user_id")}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS student_search_au AFTER UPDATE OF roll_no, user_id ON student BEGIN
+    {_refresh_row("OLD.user_id")}
+    {_refresh_row("NEW.user_id")}
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS student_search_ad AFTER DELETE ON student BEGIN
+    {_refresh_row("OLD.user_id")}
+    END""",
+]
+
+for statement in SEARCH_DDL:
+    event.listen(db.metadata, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+event.listen(
+    db.metadata,
+    "before_drop",
+    DDL(f"DROP TABLE IF EXISTS {SEARCH_TABLE}").execute_if(dialect="sqlite"),
+)
+
+# the trigram tokenizer cannot MATCH fewer than three characters
+MIN_MATCH_LENGTH = 3
+
+
+def fill_search_index(connection):
+    """Create the search table and triggers if needed and repopulate them
+    from the user and student tables."""
+    for statement in SEARCH_DDL:
+        connection.execute(text(statement))
+    connection.execute(text(f"DELETE FROM {SEARCH_TABLE}"))
+    connection.execute(
+        text(
+            f"""INSERT INTO {SEARCH_TABLE} (rowid, full_name, roll_no, email)
+            SELECT u.id, u.full_name,
+                   (SELECT s.roll_no FROM student s WHERE s.user_id = u.id ORDER BY s.id LIMIT 1),
+                   u.email
+            FROM "user" u"""
+        )
+    )
+
+
+def rebuild_search_index():
+    fill_search_index(db.session)
+    db.session.commit()
+
+
+def search_students(query):
+    """Return an ORM query over students whose name, roll number or email
+    contains ``query`` and the columns that order it, best matches first.
+
+    Rows have user_id, full_name, roll_no, email and score attributes."""
+    if db.engine.dialect.name != "sqlite":
+        return _search_students_like(query)
+    if len(query) >= MIN_MATCH_LENGTH:
+        score = func.bm25(literal_column(SEARCH_TABLE))
+        condition = text(f"{SEARCH_TABLE} MATCH :match").bindparams(
+            match='"' + query.replace('"', '""') + '"'
+        )
+    else:
+        score = literal(0.0)
+        condition = text(
+            "full_name LIKE :like OR roll_no LIKE :like OR email LIKE :like"
+        ).bindparams(like=f"%{query}%")
+    matches = (
+        db.session.query(
+            literal_column("rowid").label("user_id"),
+            literal_column("full_name").label("full_name"),
+            literal_column("roll_no").label("roll_no"),
+            literal_column("email").label("email"),
+            score.label("score"),
+        )
+        .select_from(table(SEARCH_TABLE))
+        .filter(condition)
+        .subquery()
+    )
+    return db.session.query(matches), [matches.c.score, matches.c.user_id]
+
+
+def _search_students_like(query):
+    pattern = f"%{query}%"
+    matches = (
+        db.session.query(
+            User.id.label("user_id"),
+            User.full_name,
+            Student.roll_no,
+            User.email,
+            literal(0.0).label("score"),
+        )
+        .outerjoin(Student, Student.user_id == User.id)
+        .filter(
+            or_(
+                User.full_name.ilike(pattern),
+                User.email.ilike(pattern),
+                Student.roll_no.ilike(pattern),
+            )
+        )
+        .subquery()
+    )
+    return db.session.query(matches), [matches.c.score, matches.c.user_id]
+
+
+@click.command("rebuild-search-index")
+@with_appcontext
+def rebuild_search_index_command():
+    """Rebuild the student full-text search index."""
+    rebuild_search_index()
+    click.echo("student search index rebuilt")
@@ -0,0 +1,174 @@
+import json
+import os
+import time
+import zlib
+from datetime import datetime
+
+from flask import make_response, request
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header
+
+from application.instrumentation import record_timing
+from application.model import readable_columns
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/csv", "text/plain")
+COMPRESSION_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+# preferred first when the client accepts several equally
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def schema(fields, convert=None, extra=None):
+    """Function building the response dict of a row.
+
+    ``fields`` are read as attributes, so ORM objects and query rows both
+    work, and come out in the order given. ``convert`` maps a field to a
+    function applied to its value when it is not None; ``extra`` maps
+    additional keys to functions of the whole row. The function is compiled
+    once to return a dict literal, so it costs no more per row than writing
+    the dict out by hand."""
+    convert = convert or {}
+    extra = extra or {}
+    for name in (*fields, *extra):
+        if not name.isidentifier():
+            raise ValueError(f"not a field name: {name!r}")
+    namespace = {}
+    items = []
+    for name in fields:
+        if name in convert:
+            namespace[f"convert_{name}"] = convert[name]
+            items.append(f"{name!r}: None if row.{name} is None else convert_{name}(row.{name})")
+        else:
+            items.append(f"{name!r}: row.{name}")
+    for name, compute in extra.items():
+        namespace[f"extra_{name}"] = compute
+        items.append(f"{name!r}: extra_{name}(row)")
+    exec(f"def build(row):\n    return {{{', '.join(items)}}}", namespace)
+    build = namespace["build"]
+    build.fields = (*fields, *extra)
+    return build
+
+
+def model_schema(model, exclude=("id", "user_id", "version"), text=(), extra=None):
+    """``schema`` of the columns of ``model`` in table order, with lookup fields
+    read as their labels. Dates are written with ``str`` and the ``text``
+    fields as strings, as the JSON contract (Api.yaml) has them."""
+    fields = [name for name, column in readable_columns(model) if name not in exclude]
+    convert = {name: str for name in text}
+    for column in model.__table__.columns:
+        if column.key in fields and column.type.python_type is datetime:
+            convert[column.key] = str
+    return schema(fields, convert, extra)
+
+
+def dumps(data, default=None):
+    """``data`` as compact JSON bytes, encoded by orjson when it is
+    installed. Values orjson refuses, such as integers wider than 64 bits,
+    go through the json module instead. ``default`` is called for values
+    neither can encode, datetimes included, as with ``json.dumps``."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(
+                data, default=default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+            )
+        except TypeError:
+            pass
+    return json.dumps(data, default=default, separators=(",", ":")).encode()
+
+
+def output_json(data, code, headers=None):
+    """Flask-RESTful representation for application/json."""
+    response = make_response(dumps(data) + b"\n", code)
+    response.headers.extend(headers or {})
+    return response
+
+
+def choose_encoding(accept_encoding):
+    """The content coding to answer an ``Accept-Encoding`` header with, or
+    None for identity."""
+    if not accept_encoding:
+        return None
+    return parse_accept_header(accept_encoding, Accept).best_match(ENCODINGS)
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+
+def compress_chunks(chunks, encoding):
+    """Compress a streamed body as it is produced."""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        process, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        process, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        data = process(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+def compress_response(response, min_size=COMPRESSION_MIN_SIZE):
+    """Encode ``response`` with the coding the request accepts.
+
+    Bodies under ``min_size`` bytes are left as they are, since compressing
+    them costs more than it saves. Streamed bodies are compressed chunk by
+    chunk. The ETag becomes weak, as the bytes now depend on the coding."""
+    if (
+        request.method == "HEAD"
+        or response.status_code < 200
+        or response.status_code in (204, 304)
+        or response.mimetype not in COMPRESSIBLE_TYPES
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+    if encoding is None:
+        return response
+    started = time.perf_counter()
+    if response.is_streamed:
+        response.response = compress_chunks(response.iter_encoded(), encoding)
+        response.headers.pop("Content-Length", None)
+    else:
+        body = response.get_data()
+        if len(body) < min_size:
+            return response
+        response.set_data(compress(body, encoding))
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag is not None and not weak:
+        response.set_etag(etag, weak=True)
+    record_timing("serialization_seconds", time.perf_counter() - started)
+    return response
+
+
+def init_serialization(app, api):
+    """Encode Flask-RESTful responses with ``dumps`` and compress bodies of
+    at least ``COMPRESSION_MIN_SIZE`` bytes (env ``COMPRESSION_MIN_SIZE``)
+    for clients that send ``Accept-Encoding``. ``COMPRESSION=0`` leaves
+    compression to a proxy in front of the app."""
+    config = app.config
+    config.setdefault("COMPRESSION", os.environ.get("COMPRESSION", "1") == "1")
+    config.setdefault(
+        "COMPRESSION_MIN_SIZE", int(os.environ.get("COMPRESSION_MIN_SIZE", COMPRESSION_MIN_SIZE))
+    )
+    api.representations["application/json"] = output_json
+    if config["COMPRESSION"]:
+        app.after_request(lambda response: compress_response(response, config["COMPRESSION_MIN_SIZE"]))
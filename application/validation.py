@@ -0,0 +1,162 @@
+from datetime import datetime
+
+from flask import request
+
+from application.model import (
+    CollegeDetails,
+    CompletedCourse,
+    JeeDetails,
+    SchoolDetails,
+    Student,
+    lookup_fields,
+    to_datetime,
+    to_integer,
+)
+
+# integer field -> (minimum, maximum), None for no bound
+INTEGER_RANGES = {
+    "hours_dedicated": (0, 168),
+    "marks": (0, None),
+    "year_of_passing": (1900, 2100),
+    "year_of_joining": (1900, 2100),
+    "year_of_completion": (1900, 2100),
+    "current_year": (0, 10),
+    "qualified_year": (1900, 2100),
+}
+MAX_LABEL_LENGTH = 100
+MAX_TEXT_LENGTH = 2000
+# set by the server, never read from a request body
+SERVER_FIELDS = ("id", "user_id", "version")
+
+
+def _integer(name, minimum=None, maximum=None):
+    def parse(value):
+        try:
+            value = to_integer(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{name} must be an integer")
+        if value is None:
+            return None
+        if minimum is not None and value < minimum:
+            raise ValueError(f"{name} must be at least {minimum}")
+        if maximum is not None and value > maximum:
+            raise ValueError(f"{name} must be at most {maximum}")
+        return value
+
+    return parse
+
+
+def _date(name):
+    def parse(value):
+        try:
+            return to_datetime(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{name} must be an ISO 8601 date")
+
+    return parse
+
+
+def _label(name):
+    # stored as lookup codes, which accept numbers and booleans as labels
+    def parse(value):
+        if not isinstance(value, (str, int, float)) or value == "":
+            raise ValueError(f"{name} must be a non-empty string")
+        if len(str(value)) > MAX_LABEL_LENGTH:
+            raise ValueError(f"{name} must be at most {MAX_LABEL_LENGTH} characters")
+        return value
+
+    return parse
+
+
+def _text(name):
+    def parse(value):
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            raise ValueError(f"{name} must be a string")
+        value = str(value)
+        if len(value) > MAX_TEXT_LENGTH:
+            raise ValueError(f"{name} must be at most {MAX_TEXT_LENGTH} characters")
+        return value
+
+    return parse
+
+
+class RequestModel:
+    """Parser of the JSON body written to ``model``, built once from its
+    columns.
+
+    Integers are coerced and range checked (INTEGER_RANGES), dates parsed
+    from ISO 8601, lookup fields checked as labels and other columns taken
+    as text. Columns that cannot be NULL and the ``required`` fields must be
+    sent. ``admin`` bodies also name the ``user_id`` they write to. Numbers
+    may arrive as strings and categorical fields as numbers or booleans, as
+    the API has always accepted."""
+
+    def __init__(self, model, required=(), admin=False):
+        self.model = model
+        self.fields = []
+        self.required = set(required)
+        if admin:
+            self.fields.append(("user_id", _integer("user_id")))
+            self.required.add("user_id")
+        lookups = lookup_fields(model)
+        codes = {field.column_key for field in lookups.values()}
+        for column in model.__table__.columns:
+            if column.key in SERVER_FIELDS:
+                continue
+            if column.key in codes:
+                name = next(name for name, field in lookups.items() if field.column_key == column.key)
+                self.fields.append((name, _label(name)))
+                continue
+            name = column.key
+            if column.type.python_type is int:
+                parse = _integer(name, *INTEGER_RANGES.get(name, (None, None)))
+            elif column.type.python_type is datetime:
+                parse = _date(name)
+            else:
+                parse = _text(name)
+            self.fields.append((name, parse))
+            if not column.nullable and column.default is None:
+                self.required.add(name)
+
+    def parse(self, data, partial=False):
+        """``(values, error)``: every field's value, None for those not sent,
+        or the message of the first invalid one. ``partial`` bodies carry
+        only the fields they change, so nothing is required and only the
+        fields sent are returned."""
+        if not isinstance(data, dict):
+            return None, "expected a JSON object"
+        values = {}
+        for name, parse in self.fields:
+            value = data.get(name)
+            if value is None:
+                if partial:
+                    if name in data:
+                        values[name] = None
+                    continue
+                if name in self.required:
+                    return None, f"{name} is required"
+                values[name] = None
+                continue
+            try:
+                values[name] = parse(value)
+            except ValueError as e:
+                return None, str(e)
+        return values, None
+
+    def load(self):
+        """``parse`` the current request's body, read once."""
+        return self.parse(request.get_json(silent=True))
+
+
+# request bodies, parsed and validated once before any query; the profile
+# batch loads its sections with the same ones
+student_body = RequestModel(Student)
+school_body = RequestModel(SchoolDetails)
+college_body = RequestModel(CollegeDetails)
+jee_body = RequestModel(JeeDetails)
+completed_course_body = RequestModel(CompletedCourse, required=("course_id",))
+admin_student_body = RequestModel(Student, admin=True)
+admin_school_body = RequestModel(SchoolDetails, admin=True)
+admin_college_body = RequestModel(CollegeDetails, admin=True)
+admin_jee_body = RequestModel(JeeDetails, admin=True)
+admin_completed_course_body = RequestModel(CompletedCourse, required=("course_id",), admin=True)
@@ -0,0 +1,64 @@
+import hashlib
+
+from flask import Response, request
+from sqlalchemy.orm.exc import StaleDataError
+
+from application.model import db
+
+PRECONDITION_FAILED = ({"error": "Details changed since they were read"}, 412)
+
+
+def conditional(etag, build):
+    """Return 304 when ``If-None-Match`` already holds ``etag``; otherwise
+    build the response and attach the ETag to it. The comparison is weak,
+    so it still matches once compression has weakened the ETag."""
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    result = build()
+    if isinstance(result, Response):
+        result.set_etag(etag)
+        return result
+    if not isinstance(result, tuple):
+        result = (result, 200)
+    if len(result) == 2:
+        result = result + ({},)
+    body, status, headers = result
+    return body, status, dict(headers, ETag=f'"{etag}"')
+
+
+def combined_etag(*parts):
+    """One ETag for a response built from several versioned parts, such as
+    the rows of a list and the catalog their course names come from."""
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(str(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def if_match_error(row):
+    """The 412 response when the request sends ``If-Match`` and it does not
+    name the current version of ``row``, else None.
+
+    The tag names the row version rather than the bytes of one encoding,
+    so a tag weakened by compression still identifies it."""
+    if request.if_match and not request.if_match.contains_weak(row.version):
+        return PRECONDITION_FAILED
+    return None
+
+
+def commit_versioned():
+    """Commit, or roll back and return the 412 response when a concurrent
+    request changed or deleted one of the versioned rows first."""
+    try:
+        db.session.commit()
+    except StaleDataError:
+        db.session.rollback()
+        return PRECONDITION_FAILED
+    return None
+
+
+def etag_header(row):
+    return {"ETag": f'"{row.version}"'}
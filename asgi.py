@@ -0,0 +1,76 @@
+"""ASGI entry point for production.
+
+    DATABASE_URI=sqlite:///database.sqlite3 DATABASE_MODE=production python asgi.py
+
+ASGI_WORKERS (default: WEB_CONCURRENCY, else one per CPU), ASGI_HOST,
+ASGI_PORT and ASGI_WSGI_THREADS (threads per worker for the synchronous
+endpoints) tune the server. These work as well:
+
+    WEB_CONCURRENCY=4 uvicorn asgi:application
+    WEB_CONCURRENCY=4 gunicorn --worker-class uvicorn.workers.UvicornWorker asgi:application
+
+Both servers take their worker count from WEB_CONCURRENCY; set it there
+rather than with --workers, as the app reads it too. Every worker process
+imports this module and builds its own app, engines and caches; they share
+only the database, so several workers need a file database, and cached
+tokens and course catalogs are rechecked after a few seconds instead of
+being invalidated across processes (COURSE_CACHE_URL shares the catalog).
+"""
+import os
+
+from application.async_api import AsyncApi, AsyncRoute
+from application.database import is_memory_database
+from application.model import CollegeDetails, CompletedCourse, JeeDetails, SchoolDetails, Student
+from main import (
+    college_details,
+    completed_course_details,
+    completed_courses_etag,
+    jee_details,
+    make_app,
+    school_details,
+    student_details,
+)
+
+NO_DETAIL = ({"error": "no detail found"}, 404)
+NOT_FOUND = ({"error": "Details doesnot exits"}, 404)
+COLLEGE_NOT_FOUND = ({"error": "details doesnot exits"}, 400)
+
+ROUTES = {}
+for prefix, admin in (("/api", False), ("/api/admin", True)):
+    ROUTES[prefix + "/student"] = AsyncRoute(Student, student_details, NO_DETAIL, admin=admin)
+    ROUTES[prefix + "/school"] = AsyncRoute(SchoolDetails, school_details, NO_DETAIL, admin=admin)
+    ROUTES[prefix + "/college"] = AsyncRoute(CollegeDetails, college_details, COLLEGE_NOT_FOUND, admin=admin)
+    ROUTES[prefix + "/jee"] = AsyncRoute(JeeDetails, jee_details, NOT_FOUND, admin=admin)
+    ROUTES[prefix + "/completedcourse"] = AsyncRoute(
+        CompletedCourse,
+        completed_course_details,
+        NOT_FOUND,
+        admin=admin,
+        many=True,
+        blocking=True,
+        etag=completed_courses_etag,
+    )
+
+app = make_app()
+application = AsyncApi(app, ROUTES, threads=int(os.environ.get("ASGI_WSGI_THREADS", 32)))
+
+
+def main():
+    import uvicorn
+
+    workers = int(os.environ.get("ASGI_WORKERS", os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1)))
+    if workers > 1 and is_memory_database(app.config["SQLALCHEMY_DATABASE_URI"]):
+        raise SystemExit("several workers need a file DATABASE_URI; each would get its own empty database")
+    # read by the app in every worker
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+    uvicorn.run(
+        "asgi:application",
+        host=os.environ.get("ASGI_HOST", "127.0.0.1"),
+        port=int(os.environ.get("ASGI_PORT", 8000)),
+        workers=workers,
+        log_level=os.environ.get("ASGI_LOG_LEVEL", "warning"),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,456 @@
+"""Latency and throughput of every API route at 10k, 100k and 1M students.
+
+For each scale, builds (or reuses) a synthetic database with datagen.py,
+copies it so writes never leak into the next run, serves the API from
+main.py on a local threaded server, and runs one scenario per route and
+method. Results go to a JSON file; given a baseline file, scenarios whose
+p95 latency or throughput got worse by more than the threshold are
+reported and the exit status is 1:
+
+    python benchmarks/api_suite.py --scales 10k 100k --output new.json --baseline old.json
+
+Write scenarios put back what they change (DELETE then POST, PUT with the
+same values), so every scenario sees the generated data set. Statuses are
+recorded per scenario; only 5xx responses count as errors.
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from flask_restful import Api
+from werkzeug.serving import make_server
+
+import datagen
+from main import create_app, db, register_resources
+from application.model import CompletedCourse, Courses, User
+
+DEFAULT_THRESHOLD = 0.10
+QUANTILES = {"p50_ms": 0.5, "p90_ms": 0.9, "p95_ms": 0.95, "p99_ms": 0.99}
+
+
+class Scenario:
+    """One route and method. ``build(ctx, i)`` returns the keyword arguments
+    of the i-th request (json, query, body, content_type); ``admin`` sends
+    the admin token instead of the i-th student's. ``limit`` caps the
+    requests of expensive routes; ``spare`` runs on a second set of users
+    that no other scenario touches."""
+
+    def __init__(self, method, path, build=None, admin=False, limit=None, route=None, spare=False):
+        self.method = method
+        self.path = path
+        self.build = build or (lambda ctx, i: {})
+        self.admin = admin
+        self.limit = limit
+        self.route = route or path
+        self.spare = spare
+        self.name = f"{method} {path}"
+
+
+def student_body(ctx, i):
+    return {
+        "dob": "2000-01-01 00:00:00",
+        "roll_no": f"B{ctx.users[i]}",
+        "gender": "Female",
+        "category": "General",
+        "country": "India",
+        "pwd": "No",
+        "type_of_disability": None,
+        "requirement": None,
+        "bandwith": "High",
+        "reason_of_joining": "Career",
+        "hours_dedicated": "10",
+        "source_kind": "Friends",
+        "target_for_iitm": "Degree",
+    }
+
+
+def school_body(ctx, i):
+    return {
+        "school_name": "Benchmark School",
+        "type_of_school": "CBSE",
+        "marks": "90",
+        "pass_status": "Passed",
+        "year_of_passing": "2018",
+        "city": "Chennai",
+        "state": "Tamil Nadu",
+        "other_city": None,
+        "other_state": None,
+        "country_of_school": "India",
+    }
+
+
+def college_body(ctx, i):
+    return {
+        "college_name": "Benchmark College",
+        "university": "Benchmark University",
+        "field_of_study": "Science",
+        "roll_no": f"C{ctx.users[i]}",
+        "college_status": "Pursuing",
+        "year_of_joining": "2019",
+        "year_of_completion": "2023",
+        "current_year": "3",
+        "reason_for_dropping": None,
+        "college_state": "Tamil Nadu",
+        "college_country": "India",
+        "qualifying_criteria": "JEE",
+    }
+
+
+def jee_body(ctx, i):
+    return {"jee_qualified": "Yes", "reg_id": f"J{ctx.users[i]}", "qualified_month": "May", "qualified_year": "2018"}
+
+
+def completed_body(ctx, i):
+    return {"course_id": ctx.courses_of[i], "marks": 75, "term_of_completion": "May 2021"}
+
+
+def batch_body(ctx, i):
+    return {
+        "student": student_body(ctx, i),
+        "school": school_body(ctx, i),
+        "college": college_body(ctx, i),
+        "jee": jee_body(ctx, i),
+        "completed_courses": [completed_body(ctx, i)],
+    }
+
+
+def as_admin(build):
+    return lambda ctx, i: {"json": dict(build(ctx, i), user_id=ctx.users[i])}
+
+
+def as_user(build):
+    return lambda ctx, i: {"json": build(ctx, i)}
+
+
+def detail_scenarios(prefix, resource, body, writes=("PUT", "DELETE", "POST")):
+    admin = prefix == "/api/admin"
+    wrap = as_admin if admin else as_user
+    return [Scenario("GET", prefix + resource, wrap(lambda ctx, i: {}), admin=admin)] + [
+        Scenario(method, prefix + resource, wrap(body), admin=admin) for method in writes
+    ]
+
+
+def scenarios():
+    result = [
+        Scenario("POST", "/api/login", lambda ctx, i: {
+            "json": {"email": ctx.emails[i], "password": datagen.PASSWORD}
+        }, limit=100),
+        Scenario("POST", "/api/register", lambda ctx, i: {
+            "json": {"email": f"register-{ctx.tag}-{i}@bench.example", "password": datagen.PASSWORD,
+                     "full_name": f"Registered {i}"}
+        }, limit=100),
+        Scenario("GET", "/api/courses"),
+        Scenario("GET", "/api/profile"),
+        Scenario("POST", "/api/profile/batch", as_user(batch_body)),
+        Scenario("GET", "/api/recommendation"),
+        Scenario("GET", "/api/admin/course", lambda ctx, i: {"json": {"id": ctx.course_ids[i % len(ctx.course_ids)]}}, admin=True),
+        Scenario("PUT", "/api/admin/course", lambda ctx, i: {"json": ctx.course_rows[i % len(ctx.course_rows)]}, admin=True, limit=50),
+        Scenario("POST", "/api/admin/course", lambda ctx, i: {
+            "json": {"name": f"New {ctx.tag} {i}", "code": f"NEW{ctx.tag}{i}", "pre_requisite": "None", "level": "Foundation"}
+        }, admin=True, limit=50),
+        Scenario("DELETE", "/api/admin/course", lambda ctx, i: {"json": {"id": ctx.new_course_id(i)}}, admin=True, limit=50),
+        Scenario("GET", "/api/admin/studentsearch", lambda ctx, i: {"json": {"query": ctx.emails[i].split("@")[0]}}, admin=True),
+        Scenario("GET", "/api/admin/profile", lambda ctx, i: {"json": {"user_id": ctx.users[i]}}, admin=True),
+        Scenario("POST", "/api/admin/profile/batch", as_admin(batch_body), admin=True),
+        Scenario("GET", "/api/admin/export", lambda ctx, i: {"query": {"format": "csv", "year": "2021"}}, admin=True, limit=3),
+        Scenario("GET", "/api/admin/analytics", lambda ctx, i: {}, admin=True),
+        Scenario("POST", "/api/admin/import/completedcourse", lambda ctx, i: {
+            "query": {"format": "ndjson"},
+            "body": "".join(
+                json.dumps(dict(completed_body(ctx, j), user_id=ctx.users[j])) + "\n"
+                for j in range(i, i + 100)
+                if j < len(ctx.users)
+            ).encode(),
+            "content_type": "application/x-ndjson",
+        }, admin=True, limit=20, route="/api/admin/import/<string:kind>"),
+        # no worker runs here, so these time queuing and polling; the first
+        # job is still queued when its result is asked for (409)
+        Scenario("POST", "/api/admin/jobs/export", lambda ctx, i: {"json": {"format": "csv", "year": "2021"}},
+                 admin=True, limit=20, route="/api/admin/jobs/<string:job_type>"),
+        Scenario("GET", "/api/admin/jobs", admin=True),
+        Scenario("GET", "/api/admin/jobs/1", admin=True, route="/api/admin/jobs/<int:job_id>"),
+        Scenario("GET", "/api/admin/jobs/1/result", admin=True, route="/api/admin/jobs/<int:job_id>/result"),
+    ]
+    for prefix in ("/api", "/api/admin"):
+        result += detail_scenarios(prefix, "/student", student_body, ("PUT", "POST"))
+        result += detail_scenarios(prefix, "/school", school_body)
+        result += detail_scenarios(prefix, "/college", college_body)
+        result += detail_scenarios(prefix, "/jee", jee_body)
+        result += detail_scenarios(prefix, "/completedcourse", completed_body)
+    # StudentApi.post answers 404 for a user without a student row (and 300
+    # for one with a row), so nothing can put a deleted student back:
+    # delete them last
+    result += [
+        Scenario("DELETE", "/api/student", as_user(student_body)),
+        Scenario("DELETE", "/api/admin/student", as_admin(student_body), admin=True, spare=True),
+    ]
+    return result
+
+
+class Context:
+    """Sampled users and their tokens, shared by the scenarios of a run.
+    Twice ``requests`` users are sampled; the second half is kept for spare
+    scenarios."""
+
+    def __init__(self, app, requests, seed):
+        self.app = app
+        self.tag = str(int(time.time()))
+        rng = random.Random(seed)
+        with app.app_context():
+            student_ids = [row.id for row in User.query.with_entities(User.id).filter(User.id > 1)]
+            sample = rng.sample(student_ids, min(2 * requests, len(student_ids)))
+            by_id = {user.id: user for user in User.query.filter(User.id.in_(sample))}
+            users = [by_id[user_id] for user_id in sample]
+            self.users = [user.id for user in users]
+            self.emails = [user.email for user in users]
+            self.tokens = [user.get_auth_token() for user in users]
+            self.admin_token = User.query.get(1).get_auth_token()
+            first_course = {}
+            for row in CompletedCourse.query.filter(CompletedCourse.user_id.in_(self.users)).order_by(
+                CompletedCourse.user_id, CompletedCourse.course_id
+            ):
+                first_course.setdefault(row.user_id, row.course_id)
+            self.courses_of = [first_course[user_id] for user_id in self.users]
+            self.course_rows = [
+                {"id": c.id, "name": c.name, "code": c.code, "pre_requisite": c.pre_requisite, "level": c.level}
+                for c in Courses.query.order_by(Courses.id)
+            ]
+            self.course_ids = [c["id"] for c in self.course_rows]
+            db.session.remove()
+        self.spare = len(self.users) // 2
+        self._new_courses = None
+
+    def new_course_id(self, i):
+        # courses added by the POST /api/admin/course scenario
+        if self._new_courses is None:
+            with self.app.app_context():
+                self._new_courses = [
+                    c.id for c in Courses.query.filter(Courses.code.like(f"NEW{self.tag}%")).order_by(Courses.id)
+                ]
+                db.session.remove()
+        return self._new_courses[i] if i < len(self._new_courses) else 0
+
+
+def call(base, scenario, token, json_body=None, query=None, body=None, content_type=None):
+    url = base + scenario.path
+    if query:
+        url += "?" + urllib.parse.urlencode(query)
+    if json_body is not None:
+        body, content_type = json.dumps(json_body).encode(), "application/json"
+    headers = {"Authentication-Token": token}
+    if content_type:
+        headers["Content-Type"] = content_type
+    request = urllib.request.Request(url, method=scenario.method, data=body, headers=headers)
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        status = e.code
+    except OSError:
+        status = 599
+    return status, time.perf_counter() - started
+
+
+def measure(base, ctx, scenario, requests, clients):
+    count = min(requests, ctx.spare, scenario.limit or requests)
+    offset = ctx.spare if scenario.spare else 0
+
+    def one(i):
+        i += offset
+        kwargs = scenario.build(ctx, i)
+        token = ctx.admin_token if scenario.admin else ctx.tokens[i]
+        return call(base, scenario, token, kwargs.get("json"), kwargs.get("query"), kwargs.get("body"),
+                    kwargs.get("content_type"))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        results = list(pool.map(one, range(count)))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(t for status, t in results)
+    statuses = {}
+    for status, t in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    stats = {
+        "requests": count,
+        "requests_per_second": round(count / elapsed, 1),
+        "errors": sum(1 for status, t in results if status >= 500),
+        "statuses": statuses,
+        "mean_ms": round(sum(latencies) / count * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+    }
+    for key, quantile in QUANTILES.items():
+        stats[key] = round(latencies[max(int(count * quantile + 0.5) - 1, 0)] * 1000, 2)
+    return stats
+
+
+def run_scale(scale, args, selected):
+    students = datagen.students_for(scale)
+    pristine = os.path.join(args.dir, f"bench-{scale}.sqlite3")
+
+    def progress(done, total):
+        print(f"\rgenerating {scale}: {done}/{total} students", end="", file=sys.stderr, flush=True)
+
+    manifest = datagen.load(pristine, students, args.seed, progress)
+    work = os.path.join(args.dir, f"bench-{scale}-run.sqlite3")
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(work + suffix):
+            os.remove(work + suffix)
+    shutil.copyfile(pristine, work)
+
+    app, api, user_datastore = create_app(f"bench-{scale}", f"sqlite:///{work}", database_mode=args.database_mode)
+    register_resources(api)
+    ctx = Context(app, args.requests, args.seed)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    results = {}
+    try:
+        # some handlers print; keep stdout for the comparison report
+        with contextlib.redirect_stdout(sys.stderr):
+            for scenario in selected:
+                results[scenario.name] = measure(base, ctx, scenario, args.requests, args.clients)
+                print(f"{scale} {scenario.name}: {json.dumps(results[scenario.name])}", flush=True)
+    finally:
+        server.shutdown()
+        with app.app_context():
+            db.get_engine(app).dispose()
+            if db.get_read_engine(app) is not None:
+                db.get_read_engine(app).dispose()
+    if not args.keep:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(work + suffix):
+                os.remove(work + suffix)
+    return {"students": students, "generated_in_seconds": manifest.get("seconds"), "scenarios": results}
+
+
+def uncovered_routes(selected):
+    """Routes registered in main.py that no scenario exercises."""
+    covered = {(s.route, s.method) for s in selected}
+    missing = []
+    # an Api without an app keeps the list of resources added to it
+    registered = Api()
+    register_resources(registered)
+    for resource, urls, kwargs in registered.resources:
+        for url in urls:
+            for method in ("GET", "POST", "PUT", "DELETE"):
+                if hasattr(resource, method.lower()) and (url, method) not in covered:
+                    missing.append(f"{method} {url}")
+    return missing
+
+
+def compare(baseline, current, threshold):
+    """Scenarios whose p95 grew or throughput fell by more than
+    ``threshold`` (a fraction) between two result files."""
+    regressions = []
+    for scale, result in current["results"].items():
+        before = baseline.get("results", {}).get(scale)
+        if before is None:
+            continue
+        for name, stats in result["scenarios"].items():
+            old = before["scenarios"].get(name)
+            if old is None:
+                continue
+            if old["p95_ms"] > 0 and stats["p95_ms"] > old["p95_ms"] * (1 + threshold):
+                regressions.append(
+                    {"scale": scale, "scenario": name, "metric": "p95_ms", "before": old["p95_ms"], "after": stats["p95_ms"]}
+                )
+            if stats["requests_per_second"] < old["requests_per_second"] * (1 - threshold):
+                regressions.append({
+                    "scale": scale,
+                    "scenario": name,
+                    "metric": "requests_per_second",
+                    "before": old["requests_per_second"],
+                    "after": stats["requests_per_second"],
+                })
+            if stats["errors"] > old["errors"]:
+                regressions.append(
+                    {"scale": scale, "scenario": name, "metric": "errors", "before": old["errors"], "after": stats["errors"]}
+                )
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", nargs="+", default=["10k", "100k", "1m"], help="10k, 100k, 1m or numbers")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario")
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--routes", help="Only run scenarios whose 'METHOD /path' matches this regex")
+    parser.add_argument("--database-mode", default="production")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--dir", default=tempfile.gettempdir(), help="Where the databases are kept")
+    parser.add_argument("--keep", action="store_true", help="Keep the working copy of each database")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--baseline", help="Earlier --output file to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Allowed slowdown, 0.1 = 10%%")
+    parser.add_argument("--compare-only", action="store_true", help="Compare --output with --baseline without running")
+    args = parser.parse_args()
+
+    if args.compare_only:
+        with open(args.output) as f:
+            current = json.load(f)
+    else:
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+        selected = [s for s in scenarios() if args.routes is None or re.search(args.routes, s.name)]
+        for route in uncovered_routes(scenarios()):
+            print(f"warning: no scenario for {route}", file=sys.stderr)
+        current = {
+            "meta": {
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "requests": args.requests,
+                "clients": args.clients,
+                "database_mode": args.database_mode,
+                "seed": args.seed,
+            },
+            "results": {},
+        }
+        for scale in args.scales:
+            current["results"][scale] = run_scale(scale, args, selected)
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        print(json.dumps({"threshold": args.threshold, "regressions": regressions}, indent=2))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""Read throughput of the WSGI server against the ASGI entry point.
+
+Seeds a file database, starts each server in its own process on it, and
+holds ``--clients`` concurrent keep-alive connections that request the
+student and completed-course endpoints for ``--duration`` seconds, printing
+one JSON line per server:
+
+    python benchmarks/asgi_load.py --clients 500 --duration 20 --workers 4
+
+"wsgi" is ``wsgi.py`` under gunicorn with ``--threads`` threads per worker
+(the threaded server behind ``app.run`` when gunicorn is not installed,
+which runs a single worker); "asgi" is ``asgi.py`` under uvicorn. Both run
+``--workers`` processes in production database mode. Errors are failed
+connections and 5xx responses.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+try:
+    import gunicorn
+except ImportError:
+    gunicorn = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PATHS = ["/api/student", "/api/completedcourse"]
+WSGI_SERVER = "from main import make_app; make_app().run(host='127.0.0.1', port={port}, threaded=True)"
+
+
+def seed(path, users):
+    from main import create_app, db
+    from application.migrations import upgrade_schema
+    from application.model import CompletedCourse, Courses, Student
+
+    app, api, user_datastore = create_app("bench-seed", f"sqlite:///{path}", database_mode="production")
+    with app.app_context():
+        db.create_all()
+        upgrade_schema()
+        courses = [
+            Courses(name=f"Course {i}", code=f"BENCH{i}", pre_requisite="None", level="Foundation")
+            for i in range(4)
+        ]
+        db.session.add_all(courses)
+        db.session.flush()
+        tokens = []
+        for i in range(users):
+            user = user_datastore.create_user(
+                email=f"load{i}@example.com", password="unused", full_name=f"load {i}"
+            )
+            db.session.flush()
+            db.session.add(Student(user_id=user.id, dob=datetime(2000, 1, 1), roll_no=f"R{i}"))
+            for course in courses:
+                db.session.add(
+                    CompletedCourse(user_id=user.id, course_id=course.id, marks=70, term_of_completion="Jan 2024")
+                )
+            tokens.append(user.get_auth_token())
+        db.session.commit()
+        db.session.remove()
+        db.get_engine(app).dispose()
+        db.get_read_engine(app).dispose()
+    return tokens
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start(server, port, database, args):
+    env = dict(
+        os.environ,
+        DATABASE_URI=f"sqlite:///{database}",
+        DATABASE_MODE="production",
+        ASGI_PORT=str(port),
+        ASGI_WORKERS=str(args.workers),
+        ASGI_WSGI_THREADS=str(args.threads),
+        WEB_CONCURRENCY=str(args.workers),
+    )
+    if server == "wsgi" and gunicorn is not None:
+        command = [
+            sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}",
+            "--workers", str(args.workers), "--threads", str(args.threads), "wsgi:app",
+        ]
+    elif server == "wsgi":
+        command = [sys.executable, "-c", WSGI_SERVER.format(port=port)]
+    else:
+        command = [sys.executable, "asgi.py"]
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{server} server did not start")
+
+
+async def request(connection, port, path, token):
+    reader, writer = connection
+    writer.write(
+        f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nAuthentication-Token: {token}\r\n"
+        "Connection: keep-alive\r\n\r\n".encode()
+    )
+    await writer.drain()
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    version, status = lines[0].split(" ")[:2]
+    headers = dict(line.split(": ", 1) for line in lines[1:] if ": " in line)
+    headers = {name.lower(): value for name, value in headers.items()}
+    if "content-length" in headers:
+        await reader.readexactly(int(headers["content-length"]))
+    else:
+        await reader.read()
+    keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+    return int(status), keep_alive
+
+
+async def client(port, tokens, rng, deadline, results):
+    connection = None
+    while time.perf_counter() < deadline:
+        path = rng.choice(PATHS)
+        token = rng.choice(tokens)
+        started = time.perf_counter()
+        try:
+            if connection is None:
+                connection = await asyncio.open_connection("127.0.0.1", port)
+            status, keep_alive = await request(connection, port, path, token)
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            status, keep_alive = 599, False
+        results.append((status, time.perf_counter() - started))
+        if not keep_alive and connection is not None:
+            connection[1].close()
+            connection = None
+    if connection is not None:
+        connection[1].close()
+
+
+async def load(port, tokens, clients, duration, seed):
+    results = []
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(
+        *(client(port, tokens, random.Random(seed + i), deadline, results) for i in range(clients))
+    )
+    return results
+
+
+def run(server, database, tokens, args):
+    port = free_port()
+    process = start(server, port, database, args)
+    try:
+        # every token once per worker, so the auth cache is warm
+        asyncio.run(load(port, tokens, min(args.clients, 50), args.warmup, args.seed))
+        started = time.perf_counter()
+        results = asyncio.run(load(port, tokens, args.clients, args.duration, args.seed))
+        elapsed = time.perf_counter() - started
+    finally:
+        process.terminate()
+        process.wait()
+
+    ok = sorted(t for status, t in results if status < 500)
+
+    def latency(quantile):
+        if ok == []:
+            return None
+        return round(ok[max(int(len(ok) * quantile) - 1, 0)] * 1000, 1)
+
+    return {
+        "server": server,
+        "clients": args.clients,
+        "workers": args.workers,
+        "requests": len(results),
+        "requests_per_second": round(len(ok) / elapsed, 1),
+        "errors": len(results) - len(ok),
+        "p50_ms": latency(0.5),
+        "p95_ms": latency(0.95),
+        "p99_ms": latency(0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--servers", nargs="+", default=["wsgi", "asgi"])
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--warmup", type=float, default=5)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads", type=int, default=32, help="WSGI threads per worker")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--dir", default=tempfile.gettempdir(), help="Where the database file is created")
+    args = parser.parse_args()
+    if "wsgi" in args.servers and args.workers > 1 and gunicorn is None:
+        parser.error("wsgi with several --workers needs gunicorn")
+
+    database = os.path.join(args.dir, "asgi-load.sqlite3")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(database + suffix):
+            os.remove(database + suffix)
+    tokens = seed(database, args.users)
+    for server in args.servers:
+        print(json.dumps(run(server, database, tokens, args)), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""Deterministic synthetic data for the benchmarks.
+
+Fills every table of application/model.py: a course catalog, one admin and
+``--students`` users, each with student, school, college and JEE details and
+5-30 completed courses. The same seed and size always give the same rows
+(only the password salt differs), so runs at the same scale are comparable:
+
+    python benchmarks/datagen.py /tmp/bench-10k.sqlite3 --students 10k
+
+Every user's password is PASSWORD. Hashing it once keeps a 1M database
+generating in minutes; set BCRYPT_ROUNDS to control its cost at login.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SCALES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+PASSWORD = "benchmark-password"
+ADMIN_EMAIL = "admin@bench.example"
+COURSES = 60
+MIN_COMPLETED = 5
+MAX_COMPLETED = 30
+BATCH_SIZE = 5000
+
+LEVELS = ["Foundation", "Diploma", "Degree"]
+GENDERS = ["Male", "Female", "Other"]
+CATEGORIES = ["General", "OBC", "SC", "ST", "EWS"]
+COUNTRIES = ["India", "India", "India", "Nepal", "Sri Lanka", "UAE"]
+STATES = ["Tamil Nadu", "Kerala", "Karnataka", "Maharashtra", "Delhi", "Bihar", "Assam"]
+CITIES = ["Chennai", "Kochi", "Bengaluru", "Mumbai", "Delhi", "Patna", "Guwahati"]
+SCHOOL_TYPES = ["CBSE", "ICSE", "State Board"]
+FIELDS = ["Engineering", "Science", "Commerce", "Arts", "Medicine"]
+SOURCES = ["Friends", "Social media", "Newspaper", "College"]
+MONTHS = ["January", "April", "May", "June"]
+TERMS = ["Jan", "May", "Sep"]
+FIRST_NAMES = ["Aarav", "Diya", "Ishaan", "Kavya", "Rohan", "Saanvi", "Vihaan", "Anaya", "Arjun", "Meera"]
+LAST_NAMES = ["Sharma", "Iyer", "Patel", "Nair", "Reddy", "Das", "Singh", "Menon", "Khan", "Gupta"]
+
+
+def students_for(scale):
+    """``scale`` as a number of students: 10k, 100k, 1m or a plain number."""
+    scale = str(scale).lower()
+    return SCALES[scale] if scale in SCALES else int(scale)
+
+
+def course_rows(rng):
+    rows = []
+    for i in range(1, COURSES + 1):
+        level = LEVELS[(i - 1) * len(LEVELS) // COURSES]
+        # every course after the first few needs an earlier one
+        pre_requisite = f"BS{rng.randint(1, i - 1):03d}" if i > 5 and rng.random() < 0.6 else "None"
+        rows.append(
+            {"id": i, "name": f"Course {i:03d}", "code": f"BS{i:03d}", "pre_requisite": pre_requisite, "level": level}
+        )
+    return rows
+
+
+def user_rows(rng, user_id, i, password):
+    name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i}"
+    user = {
+        "id": user_id,
+        "email": f"student{i}@bench.example",
+        "password": password,
+        "full_name": name,
+        "active": True,
+        "fs_uniquifier": uuid.UUID(int=rng.getrandbits(128)).hex,
+    }
+    joined = 2015 + rng.randint(0, 8)
+    student = {
+        "user_id": user_id,
+        "dob": datetime(1995, 1, 1) + timedelta(days=rng.randint(0, 3650)),
+        "roll_no": f"{joined % 100}F{i:07d}",
+        "gender": rng.choice(GENDERS),
+        "category": rng.choice(CATEGORIES),
+        "country": rng.choice(COUNTRIES),
+        "pwd": rng.choice(["Yes", "No", "No", "No"]),
+        "type_of_disability": None,
+        "requirement": None,
+        "bandwith": rng.choice(["Low", "Medium", "High"]),
+        "reason_of_joining": rng.choice(["Career", "Upskilling", "Interest"]),
+        "hours_dedicated": rng.choice([5, 10, 15, 20, 30]),
+        "source_kind": rng.choice(SOURCES),
+        "target_for_iitm": rng.choice(["Degree", "Diploma"]),
+    }
+    school = {
+        "user_id": user_id,
+        "school_name": f"School {rng.randint(1, 5000)}",
+        "type_of_school": rng.choice(SCHOOL_TYPES),
+        "marks": rng.randint(50, 100),
+        "pass_status": "Passed",
+        "year_of_passing": joined - 1,
+        "city": rng.choice(CITIES),
+        "state": rng.choice(STATES),
+        "other_city": None,
+        "other_state": None,
+        "country_of_school": "India",
+    }
+    college = {
+        "user_id": user_id,
+        "college_name": f"College {rng.randint(1, 2000)}",
+        "university": f"University {rng.randint(1, 300)}",
+        "field_of_study": rng.choice(FIELDS),
+        "roll_no": f"C{i:08d}",
+        "college_status": rng.choice(["Pursuing", "Completed", "Dropped"]),
+        "year_of_joining": joined,
+        "year_of_completion": joined + 4,
+        "current_year": rng.randint(1, 4),
+        "reason_for_dropping": None,
+        "college_state": rng.choice(STATES),
+        "college_country": "India",
+        "qualifying_criteria": rng.choice(["JEE", "Board", "Entrance"]),
+    }
+    jee = {
+        "user_id": user_id,
+        "jee_qualified": rng.choice(["Yes", "No"]),
+        "reg_id": f"JEE{i:08d}",
+        "qualified_month": rng.choice(MONTHS),
+        "qualified_year": joined - 1,
+    }
+    completed = [
+        {
+            "user_id": user_id,
+            "course_id": course_id,
+            "marks": rng.randint(40, 100),
+            "term_of_completion": f"{rng.choice(TERMS)} {joined + rng.randint(0, 3)}",
+        }
+        for course_id in sorted(rng.sample(range(1, COURSES + 1), rng.randint(MIN_COMPLETED, MAX_COMPLETED)))
+    ]
+    return user, student, school, college, jee, completed
+
+
+def generate(path, students, seed=1, batch_size=BATCH_SIZE, progress=None):
+    """Create ``path`` and fill it. Writes a ``<path>.json`` manifest that
+    load() checks before reusing the file."""
+    from flask_security import hash_password
+    from main import create_app, db
+    from application.migrations import upgrade_schema
+    from application.model import (
+        CollegeDetails,
+        CompletedCourse,
+        Courses,
+        JeeDetails,
+        Role,
+        SchoolDetails,
+        Student,
+        User,
+        lookup_fields,
+        roles_users,
+    )
+
+    for suffix in ("", "-wal", "-shm", ".json"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    app, api, user_datastore = create_app("datagen", f"sqlite:///{path}", database_mode="production")
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    with app.app_context():
+        db.create_all()
+        upgrade_schema()
+        password = hash_password(PASSWORD)
+        engine = db.engine
+        with engine.begin() as connection:
+            connection.execute(Courses.__table__.insert(), course_rows(rng))
+            connection.execute(Role.__table__.insert(), [{"id": 1, "name": "admin", "description": "admin"}])
+            connection.execute(
+                User.__table__.insert(),
+                [{
+                    "id": 1,
+                    "email": ADMIN_EMAIL,
+                    "password": password,
+                    "full_name": "Benchmark Admin",
+                    "active": True,
+                    "fs_uniquifier": uuid.UUID(int=rng.getrandbits(128)).hex,
+                }],
+            )
+            connection.execute(roles_users.insert(), [{"user_id": 1, "role_id": 1}])
+        tables = [User, Student, SchoolDetails, CollegeDetails, JeeDetails]
+        lookups = [lookup_fields(model) for model in tables]
+        for start in range(0, students, batch_size):
+            batches = [[] for _ in tables] + [[]]
+            for i in range(start, min(start + batch_size, students)):
+                *rows, completed = user_rows(rng, i + 2, i, password)
+                for batch, row, fields in zip(batches, rows, lookups):
+                    for name, field in fields.items():
+                        row[field.column_key] = field.lookup.code(row.pop(name))
+                    batch.append(row)
+                batches[-1].extend(completed)
+            # labels seen for the first time were added through the session
+            db.session.commit()
+            with engine.begin() as connection:
+                for model, batch in zip(tables + [CompletedCourse], batches):
+                    connection.execute(model.__table__.insert(), batch)
+            if progress is not None:
+                progress(min(start + batch_size, students), students)
+        engine.dispose()
+        db.get_read_engine(app).dispose()
+    manifest = {"students": students, "seed": seed, "seconds": round(time.perf_counter() - started, 1)}
+    with open(path + ".json", "w") as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+def load(path, students, seed=1, progress=None):
+    """Reuse ``path`` when its manifest matches, otherwise generate it."""
+    try:
+        with open(path + ".json") as f:
+            manifest = json.load(f)
+        if manifest["students"] == students and manifest["seed"] == seed and os.path.exists(path):
+            return manifest
+    except (OSError, ValueError, KeyError):
+        pass
+    return generate(path, students, seed, progress=progress)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--students", default="10k", help="10k, 100k, 1m or a number")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    def progress(done, total):
+        print(f"\r{done}/{total} students", end="", file=sys.stderr, flush=True)
+
+    manifest = generate(args.path, students_for(args.students), args.seed, args.batch_size, progress)
+    print(file=sys.stderr)
+    print(json.dumps(manifest))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Mixed read/write endpoint traffic against a file-backed SQLite database.
+
+Builds a fresh database for each database mode, seeds users with completed
+courses, and fires concurrent profile and completed-course reads mixed with
+completed-course updates, printing one JSON line per mode:
+
+    python benchmarks/db_concurrency.py --modes default production --clients 32
+
+Errors are responses with a 5xx status, typically "database is locked".
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.serving import make_server
+
+from main import create_app, db, register_resources
+from application.migrations import upgrade_schema
+from application.model import CompletedCourse, Courses
+
+READS = ["/api/profile", "/api/completedcourse"]
+
+
+def seed(app, user_datastore, users):
+    with app.app_context():
+        db.create_all()
+        upgrade_schema()
+        course = Courses(name="Benchmark Course", code="BENCH1", pre_requisite="None", level="Foundation")
+        db.session.add(course)
+        db.session.commit()
+        tokens = []
+        for i in range(users):
+            user = user_datastore.create_user(
+                email=f"bench{i}@example.com", password="unused", full_name=f"bench {i}"
+            )
+            db.session.flush()
+            db.session.add(
+                CompletedCourse(user_id=user.id, course_id=course.id, marks=50, term_of_completion="Jan 2024")
+            )
+            tokens.append(user.get_auth_token())
+        db.session.commit()
+        course_id = course.id
+        db.session.remove()
+        return course_id, tokens
+
+
+def call(base, method, path, token, body=None):
+    request = urllib.request.Request(
+        base + path,
+        method=method,
+        data=None if body is None else json.dumps(body).encode(),
+        headers={"Content-Type": "application/json", "Authentication-Token": token},
+    )
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return method, status, time.perf_counter() - started
+
+
+def run(mode, args):
+    path = os.path.join(args.dir, f"concurrency-{mode}.sqlite3")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    app, api, user_datastore = create_app(f"bench-{mode}", f"sqlite:///{path}", database_mode=mode)
+    register_resources(api)
+    course_id, tokens = seed(app, user_datastore, args.users)
+
+    rng = random.Random(args.seed)
+    plan = []
+    for _ in range(args.requests):
+        token = rng.choice(tokens)
+        if rng.random() < args.write_ratio:
+            body = {"course_id": course_id, "marks": rng.randint(0, 100), "term_of_completion": "May 2024"}
+            plan.append(("PUT", "/api/completedcourse", token, body))
+        else:
+            plan.append(("GET", rng.choice(READS), token, None))
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.clients) as pool:
+            results = list(pool.map(lambda p: call(base, *p), plan))
+        elapsed = time.perf_counter() - started
+    finally:
+        server.shutdown()
+        with app.app_context():
+            db.get_engine(app).dispose()
+            if db.get_read_engine(app) is not None:
+                db.get_read_engine(app).dispose()
+
+    def latency(method, quantile):
+        values = sorted(t for m, status, t in results if m == method and status < 500)
+        if values == []:
+            return None
+        return round(values[max(int(len(values) * quantile) - 1, 0)] * 1000, 1)
+
+    return {
+        "mode": mode,
+        "clients": args.clients,
+        "requests": args.requests,
+        "write_ratio": args.write_ratio,
+        "requests_per_second": round(len(results) / elapsed, 1),
+        "errors": sum(1 for m, status, t in results if status >= 500),
+        "read_p50_ms": latency("GET", 0.5),
+        "read_p95_ms": latency("GET", 0.95),
+        "write_p50_ms": latency("PUT", 0.5),
+        "write_p95_ms": latency("PUT", 0.95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modes", nargs="+", default=["default", "production"])
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--dir", default=tempfile.gettempdir(), help="Where the database files are created")
+    args = parser.parse_args()
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    for mode in args.modes:
+        print(json.dumps(run(mode, args)), flush=True)
+
+
+if __name__ == "__main__":
+    main()
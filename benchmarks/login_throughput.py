@@ -0,0 +1,102 @@
+"""Login throughput against the number of password hashing workers.
+
+Starts the API on a local threaded server and fires concurrent logins at
+it for each worker count, printing one JSON line per run:
+
+    python benchmarks/login_throughput.py --workers 0 1 2 4 --clients 16
+
+Set BCRYPT_ROUNDS to match the environment being sized.
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.serving import make_server
+
+from main import make_app, db
+from application.passwords import password_hasher
+
+EMAIL = "bench@example.com"
+PASSWORD = "benchmark-password"
+
+
+def login(url):
+    request = urllib.request.Request(
+        url,
+        data=json.dumps({"email": EMAIL, "password": PASSWORD}).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request) as response:
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return status, time.perf_counter() - started
+
+
+def run(app, url, workers, clients, requests, queue_depth):
+    app.config["PASSWORD_HASH_WORKERS"] = workers
+    app.config["PASSWORD_HASH_QUEUE_DEPTH"] = queue_depth
+    password_hasher.shutdown()
+    login(url)  # start the pool outside the measurement
+    started = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        results = list(pool.map(lambda _: login(url), range(requests)))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(latency for status, latency in results if status == 200)
+    return {
+        "workers": workers,
+        "clients": clients,
+        "requests": requests,
+        "ok": len(latencies),
+        "rejected": sum(1 for status, latency in results if status == 429),
+        "logins_per_second": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1) if latencies else None,
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, os.cpu_count() or 1])
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument(
+        "--queue-depth", type=int, help="Hashing queue limit (defaults to --clients, so nothing is rejected)"
+    )
+    args = parser.parse_args()
+
+    app = make_app()
+    with app.app_context():
+        user_datastore = app.extensions["security"].datastore
+        if user_datastore.find_user(email=EMAIL) is None:
+            app.config["PASSWORD_HASH_WORKERS"] = 0
+            user_datastore.create_user(email=EMAIL, password=password_hasher.hash(PASSWORD), full_name="bench")
+            db.session.commit()
+        db.session.remove()
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/api/login"
+    try:
+        for workers in args.workers:
+            print(json.dumps(run(app, url, workers, args.clients, args.requests, args.queue_depth or args.clients)), flush=True)
+    finally:
+        server.shutdown()
+        password_hasher.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Per-request cost of reading and validating a write body.
+
+Compares the handlers' previous approach, a ``field_errors`` pass over the
+body followed by one ``request.get_json().get(...)`` per field, with one
+``RequestModel.load()``. Prints one JSON line per model:
+
+    python benchmarks/request_parsing.py --iterations 20000
+
+``parse_us`` is measured inside one request, where Flask has already
+decoded the JSON; ``request_us`` builds a fresh request each time, so it
+includes decoding the body and the request context.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, request
+
+from application.model import CollegeDetails, Student, lookup_fields, to_datetime, to_integer
+from application.validation import INTEGER_RANGES, MAX_LABEL_LENGTH, RequestModel
+
+BODIES = {
+    Student: {
+        "dob": "2001-02-03",
+        "roll_no": "24f1000001",
+        "gender": "Female",
+        "category": "General",
+        "country": "India",
+        "pwd": "No",
+        "type_of_disability": None,
+        "requirement": None,
+        "bandwith": "High",
+        "reason_of_joining": "Upskilling",
+        "hours_dedicated": "12",
+        "source_kind": "Friend",
+        "target_for_iitm": "Degree",
+    },
+    CollegeDetails: {
+        "college_name": "College 1",
+        "university": "University 1",
+        "field_of_study": "Physics",
+        "roll_no": "C1",
+        "college_status": "Studying",
+        "year_of_joining": "2021",
+        "year_of_completion": "2025",
+        "current_year": "3",
+        "reason_for_dropping": None,
+        "college_state": "Tamil Nadu",
+        "college_country": "India",
+        "qualifying_criteria": "Merit",
+    },
+}
+
+
+def previous_field_errors(model, data):
+    # application.validation.field_errors before RequestModel
+    if not isinstance(data, dict):
+        return "expected a JSON object"
+    columns = model.__table__.columns
+    for name, (minimum, maximum) in INTEGER_RANGES.items():
+        if name not in columns or data.get(name) is None:
+            continue
+        try:
+            value = to_integer(data[name])
+        except (TypeError, ValueError):
+            return f"{name} must be an integer"
+        if value is None:
+            continue
+        if minimum is not None and value < minimum:
+            return f"{name} must be at least {minimum}"
+        if maximum is not None and value > maximum:
+            return f"{name} must be at most {maximum}"
+    for column in columns:
+        if column.type.python_type is datetime and data.get(column.key) is not None:
+            try:
+                to_datetime(data[column.key])
+            except (TypeError, ValueError):
+                return f"{column.key} must be an ISO 8601 date"
+    for name in lookup_fields(model):
+        value = data.get(name)
+        if value is None:
+            continue
+        if not isinstance(value, (str, int, float)) or value == "":
+            return f"{name} must be a non-empty string"
+        if len(str(value)) > MAX_LABEL_LENGTH:
+            return f"{name} must be at most {MAX_LABEL_LENGTH} characters"
+    return None
+
+
+def previous(model, fields):
+    error = previous_field_errors(model, request.get_json())
+    if error is not None:
+        return None, error
+    return {name: request.get_json().get(name) for name in fields}, None
+
+
+def per_call(iterations, function):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return round((time.perf_counter() - started) / iterations * 1e6, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+    app = Flask(__name__)
+
+    for model, body in BODIES.items():
+        parser = RequestModel(model)
+        fields = [name for name, parse in parser.fields]
+        payload = json.dumps(body)
+        result = {"model": model.__name__, "fields": len(fields)}
+        with app.test_request_context(method="POST", data=payload, content_type="application/json"):
+            assert previous(model, fields)[1] is None and parser.load()[1] is None
+            result["parse_us_before"] = per_call(args.iterations, lambda: previous(model, fields))
+            result["parse_us_after"] = per_call(args.iterations, parser.load)
+
+        def fresh(function):
+            with app.test_request_context(method="POST", data=payload, content_type="application/json"):
+                function()
+
+        result["request_us_before"] = per_call(args.iterations, lambda: fresh(lambda: previous(model, fields)))
+        result["request_us_after"] = per_call(args.iterations, lambda: fresh(parser.load))
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Cost of building, encoding and compressing large list responses.
+
+Times the completed-course and search result lists the API returns, from
+rows to bytes on the wire, printing one JSON line per list and size:
+
+    python benchmarks/serialization.py --rows 1000 10000 100000
+
+Each line compares the hand-built dicts the handlers used to return with
+the generated schemas, the json module with the installed fast encoder,
+and the available compression codings by time and size.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from collections import namedtuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from application.model import CompletedCourse
+from application.serialization import brotli, compress, dumps, model_schema, orjson, schema
+
+SearchRow = namedtuple("SearchRow", "user_id full_name roll_no email")
+TERMS = ["Jan 2023", "May 2023", "Sep 2023", "Jan 2024"]
+
+
+def completed_rows(count, names):
+    return [
+        CompletedCourse(
+            id=i,
+            user_id=i // 20,
+            course_id=random.choice(list(names)),
+            marks=random.randint(0, 100),
+            term_of_completion=random.choice(TERMS),
+        )
+        for i in range(1, count + 1)
+    ]
+
+
+def search_rows(count):
+    return [
+        SearchRow(i, f"Student {i}", f"21f{i:07d}", f"student{i}@example.com") for i in range(1, count + 1)
+    ]
+
+
+def best_of(repeat, function):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - started)
+    return round(min(times) * 1000, 2), result
+
+
+def measure(name, rows, by_hand, schema, repeat):
+    result = {"list": name, "rows": len(rows)}
+    result["build_by_hand_ms"], data = best_of(repeat, lambda: [by_hand(row) for row in rows])
+    result["build_schema_ms"], built = best_of(repeat, lambda: [schema(row) for row in rows])
+    assert built == data
+    result["encode_json_ms"], body = best_of(repeat, lambda: (json.dumps(data) + "\n").encode())
+    result["encode_fast_ms"], fast = best_of(repeat, lambda: dumps(data) + b"\n")
+    assert json.loads(fast) == data
+    result["bytes"] = len(fast)
+    for encoding in ("gzip", "br") if brotli is not None else ("gzip",):
+        result[f"{encoding}_ms"], compressed = best_of(repeat, lambda: compress(fast, encoding))
+        result[f"{encoding}_bytes"] = len(compressed)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement; the fastest is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    names = {i: f"Course {i}" for i in range(1, 41)}
+    completed_by_hand = lambda c: {
+        "id": c.id,
+        "course_id": c.course_id,
+        "marks": c.marks,
+        "term_of_completion": c.term_of_completion,
+        "name": names.get(c.course_id),
+    }
+    completed_schema = model_schema(
+        CompletedCourse, exclude=("user_id",), extra={"name": lambda c: names.get(c.course_id)}
+    )
+    search_by_hand = lambda row: {
+        "user_id": row.user_id,
+        "full_name": row.full_name,
+        "roll_no": row.roll_no,
+        "email": row.email,
+    }
+    search_schema = schema(("user_id", "full_name", "roll_no", "email"))
+
+    print(json.dumps({"encoder": "orjson" if orjson is not None else "json", "brotli": brotli is not None}))
+    for count in args.rows:
+        rows = completed_rows(count, names)
+        print(json.dumps(measure("completedcourse", rows, completed_by_hand, completed_schema, args.repeat)))
+        rows = search_rows(count)
+        print(json.dumps(measure("search", rows, search_by_hand, search_schema, args.repeat)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+import os
+
+from flask import Flask, Response, current_app, render_template, request, redirect, url_for, flash, jsonify, send_file, stream_with_context
 from flask_security import (
     current_user,
     Security,
@@ -12,24 +14,79 @@ from flask_security import (
 )
 from flask_security import UserMixin, RoleMixin
 from flask_restful import Resource, Api, fields, marshal_with, reqparse
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from flask_cors import CORS
 from application.model import *
+from application.recommendation import (
+    mark_all_stale,
+    mark_stale,
+    recommend,
+    refresh_recommendations_command,
+)
+from application.analytics import cohort_analytics, recompute_rollups_command
+from application.auth_cache import auth_cache, init_auth_cache, request_user_id
+from application.catalog import course_catalog, init_catalog
+from application.database import configure_database
+from application.bulk_import import (
+    IMPORT_KINDS,
+    detect_format,
+    import_records,
+    import_records_command,
+)
+from application.export import EXPORT_FORMATS, export_students_command, iter_export
+from application.instrumentation import init_instrumentation
+from application.jobs import JOB_TYPES, init_jobs, run_jobs_command, submit_job
+from application.migrations import setup_database, upgrade_db_command
+from application.pagination import list_response, sequence_response
+from application.passwords import PasswordPoolFull, password_hasher
+from application.profile_batch import save_profile_batch
+from application.search import rebuild_search_index_command, search_students
+from application.serialization import init_serialization, model_schema, schema
+from application.validation import (
+    admin_college_body,
+    admin_completed_course_body,
+    admin_jee_body,
+    admin_school_body,
+    admin_student_body,
+    college_body,
+    completed_course_body,
+    jee_body,
+    school_body,
+    student_body,
+)
+from application.versioning import (
+    combined_etag,
+    commit_versioned,
+    conditional,
+    etag_header,
+    if_match_error,
+)
 
 
-def create_app(name,dbURI):
+def create_app(name,dbURI,database_mode=None):
     app = Flask(name)
 
     app.config["SQLALCHEMY_DATABASE_URI"] = dbURI
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    # the worker count gunicorn and uvicorn default to
+    app.config["WORKER_PROCESSES"] = int(os.environ.get("WEB_CONCURRENCY", 1))
+    configure_database(
+        app, database_mode or os.environ.get("DATABASE_MODE", "default"), identity=request_user_id
+    )
     db.init_app(app)
     api = Api(app)
     CORS(app)
-    app.app_context().push()
     app.config["SECRET_KEY"] = "secret key"
     app.config["SECURITY_PASSWORD_HASH"] = "bcrypt"
     app.config["SECURITY_PASSWORD_SINGLE_HASH"]="plaintext"
     app.config["SECURITY_PASSWORD_SALT"] = "mysecret"
+    app.config["SECURITY_PASSWORD_HASH_OPTIONS"] = {
+        "bcrypt": {"rounds": int(os.environ.get("BCRYPT_ROUNDS", 12))}
+    }
+    app.config["PASSWORD_HASH_WORKERS"] = int(
+        os.environ.get("PASSWORD_HASH_WORKERS", os.cpu_count() or 1)
+    )
+    app.config["COURSE_CACHE_URL"] = os.environ.get("COURSE_CACHE_URL")
     app.config["SECURITY_TOKEN_AUTHENTICATION_HEADER"] = "Authentication-Token"
     app.config["SECURITY_REGISTERABLE"] = False
     app.config["SECURITY_CONFIRMABLE"] = False
@@ -38,16 +95,88 @@ def create_app(name,dbURI):
     app.config["WTF_CSRF_ENABLED"] = False
     user_datastore = SQLAlchemySessionUserDatastore(db.session, User, Role)
     security = Security(app, user_datastore)
-    app.app_context().push()
+    init_auth_cache(security)
+    app.config["COURSE_CACHE_TTL"] = int(os.environ.get("COURSE_CACHE_TTL", 5))
+    init_catalog(app)
+    # before instrumentation, which times the encoder installed here
+    init_serialization(app, api)
+    init_instrumentation(app, api, caches={"auth": auth_cache})
+    init_jobs(app)
+    app.cli.add_command(refresh_recommendations_command)
+    app.cli.add_command(rebuild_search_index_command)
+    app.cli.add_command(import_records_command)
+    app.cli.add_command(export_students_command)
+    app.cli.add_command(upgrade_db_command)
+    app.cli.add_command(recompute_rollups_command)
+    app.cli.add_command(run_jobs_command)
     return app,api,user_datastore
 
 
-# app,api,user_datastore = create_app(__name__,"sqlite:///database.sqlite3")
-app,api,user_datastore = create_app(__name__,"sqlite:///:memory:")
+# numeric columns are still strings in the JSON contract (Api.yaml)
+student_details = model_schema(Student, text=("hours_dedicated",))
+school_details = model_schema(SchoolDetails, text=("marks", "year_of_passing"))
+college_details = model_schema(
+    CollegeDetails, text=("year_of_joining", "year_of_completion", "current_year")
+)
+jee_details = model_schema(JeeDetails, text=("qualified_year",))
+completed_course_details = model_schema(
+    CompletedCourse,
+    exclude=("user_id", "version"),
+    extra={"name": lambda c: (course_catalog.get(c.course_id) or {}).get("name")},
+)
+search_result = schema(("user_id", "full_name", "roll_no", "email"))
+job_details = model_schema(Job, exclude=("result_path",))
+
+
+def completed_courses(user_id):
+    return CompletedCourse.query.filter_by(user_id=user_id)
+
+
+def completed_courses_etag(rows):
+    # the course names come from the catalog
+    return combined_etag(course_catalog.snapshot().etag, *[row.version for row in rows])
+
+
+PROFILE_SECTIONS = {
+    "student": (User.student, student_details),
+    "school": (User.school, school_details),
+    "college": (User.college, college_details),
+    "jee": (User.jee, jee_details),
+    "completed_courses": (User.c_course, completed_course_details),
+}
 
 
+def user_profile(user_id, fields=None):
+    """Load a user and the selected profile sections with one joined query.
 
-db.create_all()
+    ``fields`` is a comma separated subset of PROFILE_SECTIONS; all sections
+    are returned when it is empty."""
+    sections = [f.strip() for f in fields.split(",") if f.strip()] if fields else list(PROFILE_SECTIONS)
+    unknown = [f for f in sections if f not in PROFILE_SECTIONS]
+    if unknown != []:
+        return {"error": "unknown fields: " + ", ".join(unknown)}, 400
+    user = user_with(user_id, *[PROFILE_SECTIONS[name][0] for name in sections])
+    if user is None:
+        return {"error": "User Not Found"}, 404
+    # the user's own fields have no version, so they are tagged as they are
+    parts = [user.full_name, user.email]
+    for name in sections:
+        parts += [name, *[row.version for row in getattr(user, PROFILE_SECTIONS[name][0].key)]]
+    if "completed_courses" in sections:
+        parts.append(course_catalog.snapshot().etag)
+
+    def build():
+        profile = {"user_id": user.id, "full_name": user.full_name, "email": user.email}
+        for name in sections:
+            relationship, details = PROFILE_SECTIONS[name]
+            rows = getattr(user, relationship.key)
+            if name == "completed_courses":
+                profile[name] = [details(row) for row in rows]
+            else:
+                profile[name] = details(rows[0]) if rows != [] else None
+        return profile, 200
+
+    return conditional(combined_etag(*parts), build)
 
 
 class Login(Resource):
@@ -57,7 +186,11 @@ class Login(Resource):
         user = User.query.filter_by(email=email).first()
         if user is None:
             return {"error": "User Not Found"}, 404
-        if verify_password(password, user.password):
+        try:
+            verified = password_hasher.verify(password, user.password)
+        except PasswordPoolFull:
+            return {"error": "Too many login attempts, retry shortly"}, 429, {"Retry-After": "1"}
+        if verified:
             role = "user"
             if user.roles != []:
                 role = user.roles[0].name
@@ -72,8 +205,12 @@ class Register(Resource):
         full_name = request.get_json().get("full_name")
         role_name = request.get_json().get("role")
         try:
-            user = user_datastore.create_user(
-                email=email, password=hash_password(password), full_name=full_name
+            hashed = password_hasher.hash(password)
+        except PasswordPoolFull:
+            return {"error": "Too many registrations, retry shortly"}, 429, {"Retry-After": "1"}
+        try:
+            user = current_app.extensions["security"].datastore.create_user(
+                email=email, password=hashed, full_name=full_name
             )
             db.session.commit()
             if role_name != "admin":
@@ -91,16 +228,20 @@ class CourseApi(Resource):
     # @auth_required("token")
     def get(self):
         print(request.headers.get('Authentication-Token'))
-        id = request.get_json().get("id")
-        course = Courses.query.get(id)
+        try:
+            id = to_integer(request.get_json().get("id"))
+        except (TypeError, ValueError):
+            id = None
+        catalog = course_catalog.snapshot()
+        course = catalog.get(id)
         if course is None:
             return {"error": "course not found"}, 404
-        return {
-            "name": course.name,
-            "code": course.code,
-            "pre_requisite": course.pre_requisite,
-            "level": course.level
-        }, 200
+        return conditional(catalog.etag, lambda: ({
+            "name": course["name"],
+            "code": course["code"],
+            "pre_requisite": course["pre_requisite"],
+            "level": course["level"]
+        }, 200))
 
     # @auth_required("token")
     # @roles_required("admin")
@@ -114,7 +255,9 @@ class CourseApi(Resource):
         level = request.get_json().get("level")
         course = Courses(name=name, code=code, pre_requisite=pre_requisite, level=level)
         db.session.add(course)
+        mark_all_stale()
         db.session.commit()
+        course_catalog.invalidate()
         return {"message": "Course Added"}, 200
 
     # @auth_required("token")
@@ -128,7 +271,9 @@ class CourseApi(Resource):
         course.code = request.get_json().get("code")
         course.pre_requisite = request.get_json().get("pre_requisite")
         course.level = request.get_json().get("level")
+        mark_all_stale()
         db.session.commit()
+        course_catalog.invalidate()
         return {"message": "Course Updated"}, 200
 
     # @auth_required("token")
@@ -139,98 +284,81 @@ class CourseApi(Resource):
         if course is None:
             return {"error": "course doesnot exits"}, 404
         db.session.delete(course)
+        mark_all_stale()
         db.session.commit()
+        course_catalog.invalidate()
         return {"message": "Course deleted"}, 200
 
 
+class CourseListApi(Resource):
+    @auth_required("token")
+    def get(self):
+        catalog = course_catalog.snapshot()
+        courses = catalog.courses
+        level = request.args.get("level")
+        if level is not None:
+            courses = [course for course in courses if course["level"] == level]
+        return conditional(
+            catalog.etag, lambda: sequence_response(courses, lambda course: course["id"], dict)
+        )
+
+
 class StudentApi(Resource):
     @auth_required("token")
     def get(self):
         student = Student.query.filter_by(user_id=current_user.id).first()
         if student is None:
             return {"error": "no detail found"}, 404
-        return {
-            "dob": str(student.dob),
-            "roll_no": student.roll_no,
-            "gender": student.gender,
-            "category": student.category,
-            "country": student.country,
-            "pwd": student.pwd,
-            "type_of_disability": student.type_of_disability,
-            "requirement": student.requirement,
-            "bandwith": student.bandwith,
-            "reason_of_joining": student.reason_of_joining,
-            "hours_dedicated": student.hours_dedicated,
-            "source_kind": student.source_kind,
-            "target_for_iitm": student.target_for_iitm
-        }
+        return conditional(student.version, lambda: student_details(student))
 
     @auth_required("token")
     def post(self):
+        body, error = student_body.load()
+        if error is not None:
+            return {"error": error}, 400
         student = Student.query.filter_by(user_id=current_user.id).first()
         if student is None:
             return {"error": "no detail found"}, 404
-        dob = request.get_json().get("dob")
-        roll_no = request.get_json().get("roll_no")
-        gender = request.get_json().get("gender")
-        category = request.get_json().get("category")
-        country = request.get_json().get("country")
-        pwd = request.get_json().get("pwd")
-        type_of_disability = request.get_json().get("type_of_disability")
-        requirement = request.get_json().get("requirement")
-        bandwith = request.get_json().get("bandwith")
-        reason_of_joining = request.get_json().get("reason_of_joining")
-        hours_dedicated = request.get_json().get("hours_dedicated")
-        source_kind = request.get_json().get("source_kind")
-        target_for_iitm = request.get_json().get("target_for_iitm")
-        student = Student(
-            user_id=current_user.id,
-            dob=dob,
-            roll_no=roll_no,
-            gender=gender,
-            category=category,
-            country=country,
-            pwd=pwd,
-            type_of_disability=type_of_disability,
-            requirement=requirement,
-            bandwith=bandwith,
-            reason_of_joining=reason_of_joining,
-            hours_dedicated=hours_dedicated,
-            source_kind=source_kind,
-            target_for_iitm=target_for_iitm
-        )
+        student = Student(user_id=current_user.id, **body)
         db.session.add(student)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # each user has at most one student row
+            db.session.rollback()
+            return {"error": "details already exits"}, 300
         return {"message": "Student detailed added"}, 200
 
     @auth_required("token")
     def put(self):
+        body, error = student_body.load()
+        if error is not None:
+            return {"error": error}, 400
         student = Student.query.filter_by(user_id=current_user.id).first()
         if student is None:
             return {"error": "no detail found"}, 404
-        student.dob = request.get_json().get("dob")
-        student.roll_no = request.get_json().get("roll_no")
-        student.gender = request.get_json().get("gender")
-        student.category = request.get_json().get("category")
-        student.country = request.get_json().get("country")
-        student.pwd = request.get_json().get("pwd")
-        student.type_of_disability = request.get_json().get("type_of_disability")
-        student.requirement = request.get_json().get("requirement")
-        student.bandwith = request.get_json().get("bandwith")
-        student.reason_of_joining = request.get_json().get("reason_of_joining")
-        student.hours_dedicated = request.get_json().get("hours_dedicated")
-        student.source_kind = request.get_json().get("source_kind")
-        student.target_for_iitm = request.get_json().get("target_for_iitm")
-        db.session.commit()
-        return {"message": "Student detail updated"}, 200
+        error = if_match_error(student)
+        if error is not None:
+            return error
+        for name, value in body.items():
+            setattr(student, name, value)
+        error = commit_versioned()
+        if error is not None:
+            return error
+        return {"message": "Student detail updated"}, 200, etag_header(student)
 
     @auth_required("token")
     def delete(self):
         student = Student.query.filter_by(user_id=current_user.id).first()
         if student is None:
             return {"error": "no detail found"}, 404
+        error = if_match_error(student)
+        if error is not None:
+            return error
         db.session.delete(student)
-        db.session.commit()
+        error = commit_versioned()
+        if error is not None:
+            return error
         return {"message": "Student detailed delete"}, 200
 
 
@@ -241,69 +369,44 @@ class SchoolApi(Resource):
         if school == []:
             return {"error": "no detail found"}, 404
         school = school[0]
-        return {
-            "school_name": school.school_name,
-            "type_of_school": school.type_of_school,
-            "marks": school.marks,
-            "pass_status": school.pass_status,
-            "year_of_passing": school.year_of_passing,
-            "city": school.city,
-            "state": school.state,
-            "other_city": school.other_city,
-            "other_state": school.other_state,
-            "country_of_school": school.country_of_school
-        }
+        return conditional(school.version, lambda: school_details(school))
 
     @auth_required("token")
     def post(self):
+        body, error = school_body.load()
+        if error is not None:
+            return {"error": error}, 400
         school = current_user.school
         if school != []:
             return {"error": "details already exits"}, 300
-        school_name = request.get_json().get("school_name")
-        type_of_school = request.get_json().get("type_of_school")
-        marks = request.get_json().get("marks")
-        pass_status = request.get_json().get("pass_status")
-        year_of_passing = request.get_json().get("year_of_passing")
-        city = request.get_json().get("city")
-        state = request.get_json().get("state")
-        other_city = request.get_json().get("other_city")
-        other_state = request.get_json().get("other_state")
-        country_of_school = request.get_json().get("country_of_school")
-        school = SchoolDetails(
-            user_id=current_user.id,
-            school_name=school_name,
-            type_of_school=type_of_school,
-            marks=marks,
-            pass_status=pass_status,
-            year_of_passing=year_of_passing,
-            city=city,
-            state=state,
-            other_city=other_city,
-            other_state=other_state,
-            country_of_school=country_of_school
-        )
+        school = SchoolDetails(user_id=current_user.id, **body)
         db.session.add(school)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # a concurrent request added it after the check above
+            db.session.rollback()
+            return {"error": "details already exits"}, 300
         return {"message": "school details added"}
 
     @auth_required("token")
     def put(self):
+        body, error = school_body.load()
+        if error is not None:
+            return {"error": error}, 400
         school = current_user.school
         if school == []:
             return {"error": "details doesnot exits"}, 400
         school = school[0]
-        school.school_name = request.get_json().get("school_name")
-        school.type_of_school = request.get_json().get("type_of_school")
-        school.marks = request.get_json().get("marks")
-        school.pass_status = request.get_json().get("pass_status")
-        school.year_of_passing = request.get_json().get("year_of_passing")
-        school.city = request.get_json().get("city")
-        school.state = request.get_json().get("state")
-        school.other_city = request.get_json().get("other_city")
-        school.other_state = request.get_json().get("other_state")
-        school.country_of_school = request.get_json().get("country_of_school")
-        db.session.commit()
-        return {"message": "school details updated"}, 200
+        error = if_match_error(school)
+        if error is not None:
+            return error
+        for name, value in body.items():
+            setattr(school, name, value)
+        error = commit_versioned()
+        if error is not None:
+            return error
+        return {"message": "school details updated"}, 200, etag_header(school)
 
     @auth_required("token")
     def delete(self):
@@ -311,8 +414,13 @@ class SchoolApi(Resource):
         if school == []:
             return {"error": "details doesnot exits"}, 400
         school = school[0]
+        error = if_match_error(school)
+        if error is not None:
+            return error
         db.session.delete(school)
-        db.session.commit()
+        error = commit_versioned()
+        if error is not None:
+            return error
         return {"message": "school details delete"}, 200
 
 
@@ -323,76 +431,43 @@ class CollegeApi(Resource):
         if college == []:
             return {"error": "details doesnot exits"}, 400
         college = college[0]
-        return {
-            "college_name": college.college_name,
-            "university": college.university,
-            "field_of_study": college.field_of_study,
-            "roll_no": college.roll_no,
-            "college_status": college.college_status,
-            "year_of_joining": college.year_of_joining,
-            "year_of_completion": college.year_of_completion,
-            "current_year": college.current_year,
-            "reason_for_dropping": college.reason_for_dropping,
-            "college_state": college.college_state,
-            "college_country": college.college_country,
-            "qualifying_criteria": college.qualifying_criteria
-        }
+        return conditional(college.version, lambda: college_details(college))
 
     @auth_required("token")
     def post(self):
+        body, error = college_body.load()
+        if error is not None:
+            return {"error": error}, 400
         if current_user.college != []:
             return {"error": "details already exits"}
-        college_name = request.get_json().get("college_name")
-        university = request.get_json().get("university")
-        field_of_study = request.get_json().get("field_of_study")
-        roll_no = request.get_json().get("roll_no")
-        college_status = request.get_json().get("college_status")
-        year_of_joining = request.get_json().get("year_of_joining")
-        year_of_completion = request.get_json().get("year_of_completion")
-        current_year = request.get_json().get("current_year")
-        reason_for_dropping = request.get_json().get("reason_for_dropping")
-        college_state = request.get_json().get("college_state")
-        college_country = request.get_json().get("college_country")
-        qualifying_criteria = request.get_json().get("qualifying_criteria")
-        college = CollegeDetails(
-            user_id=current_user.id,
-            college_name=college_name,
-            university=university,
-            field_of_study=field_of_study,
-            roll_no=roll_no,
-            college_status=college_status,
-            year_of_joining=year_of_joining,
-            year_of_completion=year_of_completion,
-            current_year=current_year,
-            reason_for_dropping=reason_for_dropping,
-            college_state=college_state,
-            college_country=college_country,
-            qualifying_criteria=qualifying_criteria
-        )
+        college = CollegeDetails(user_id=current_user.id, **body)
         db.session.add(college)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # a concurrent request added it after the check above
+            db.session.rollback()
+            return {"error": "details already exits"}
         return {"message": "Details added"}, 200
 
     @auth_required("token")
     def put(self):
+        body, error = college_body.load()
+        if error is not None:
+            return {"error": error}, 400
         college = current_user.college
         if college == []:
             return {"error": "details doesnot exits"}, 404
         college = college[0]
-        college.college_name = request.get_json().get("college_name")
-        college.university = request.get_json().get("university")
-        college.field_of_study = request.get_json().get("field_of_study")
-        college.roll_no = request.get_json().get("roll_no")
-        college.college_status = request.get_json().get("college_status")
-        college.year_of_joining = request.get_json().get("year_of_joining")
-        college.year_of_completion = request.get_json().get("year_of_completion")
-        college.current_year = request.get_json().get("current_year")
-        college.reason_for_dropping = request.get_json().get("reason_for_dropping")
-        college.college_state = request.get_json().get("college_state")
-        college.college_country = request.get_json().get("college_country")
-        college.qualifying_criteria = request.get_json().get("qualifying_criteria")
-        db.session.commit()
-        return {"message": "Details updated"}, 200
+        error = if_match_error(college)
+        if error is not None:
+            return error
+        for name, value in body.items():
+            setattr(college, name, value)
+        error = commit_versioned()
+        if error is not None:
+            return error
+        return {"message": "Details updated"}, 200, etag_header(college)
 
     @auth_required("token")
     def delete(self):
@@ -400,8 +475,13 @@ class CollegeApi(Resource):
         if college == []:
             return {"error": "details doesnot exits"}, 404
         college = college[0]
+        error = if_match_error(college)
+        if error is not None:
+            return error
         db.session.delete(college)
-        db.session.commit()
+        error = commit_versioned()
+        if error is not None:
+            return error
         return {"message": "Details deleted"}, 200
 
 
@@ -412,45 +492,44 @@ class JeeApi(Resource):
         if jee == []:
             return {"error": "Details doesnot exits"}, 404
         jee = jee[0]
-        return {
-            "jee_qualified": jee.jee_qualified,
-            "reg_id": jee.reg_id,
-            "qualified_month": jee.qualified_month,
-            "qualified_year": jee.qualified_year
-        }, 200
+        return conditional(jee.version, lambda: jee_details(jee))
 
     @auth_required("token")
     def post(self):
+        body, error = jee_body.load()
+        if error is not None:
+            return {"error": error}, 400
         jee = current_user.jee
         if jee != []:
             return {"error": "Details already exits"}, 300
-        jee_qualified = request.get_json().get("jee_qualified")
-        reg_id = request.get_json().get("reg_id")
-        qualified_month = request.get_json().get("qualified_month")
-        qualified_year = request.get_json().get("qualified_year")
-        jee = JeeDetails(
-            user_id=current_user.id,
-            jee_qualified=jee_qualified,
-            reg_id=reg_id,
-            qualified_month=qualified_month,
-            qualified_year=qualified_year
-        )
+        jee = JeeDetails(user_id=current_user.id, **body)
         db.session.add(jee)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # a concurrent request added it after the check above
+            db.session.rollback()
+            return {"error": "Details already exits"}, 300
         return {"message": "details added"}, 200
 
     @auth_required("token")
     def put(self):
+        body, error = jee_body.load()
+        if error is not None:
+            return {"error": error}, 400
         jee = current_user.jee
         if jee == []:
             return {"error": "Details doesnot exits"}, 404
         jee = jee[0]
-        jee.jee_qualified = request.get_json().get("jee_qualified")
-        jee.reg_id = request.get_json().get("reg_id")
-        jee.qualified_month = request.get_json().get("qualified_month")
-        jee.qualified_year = request.get_json().get("qualified_year")
-        db.session.commit()
-        return {"message": "details updated"}, 200
+        error = if_match_error(jee)
+        if error is not None:
+            return error
+        for name, value in body.items():
+            setattr(jee, name, value)
+        error = commit_versioned()
+        if error is not None:
+            return error
+        return {"message": "details updated"}, 200, etag_header(jee)
 
     @auth_required("token")
     def delete(self):
@@ -458,62 +537,72 @@ class JeeApi(Resource):
         if jee == []:
             return {"error": "Details doesnot exits"}, 404
         jee = jee[0]
+        error = if_match_error(jee)
+        if error is not None:
+            return error
         db.session.delete(jee)
-        db.session.commit()
+        error = commit_versioned()
+        if error is not None:
+            return error
         return {"message": "details deleted"}, 200
 
 
 class CompletedCourseApi(Resource):
     @auth_required("token")
     def get(self):
-        c_course = current_user.c_course
-        if c_course == []:
-            return {"error": "Details doesnot exits"}, 404
-        c_list = []
-        for c in c_course:
-            course = c.course
-            d = {
-                "id": c.id,
-                "course_id": c.course_id,
-                "marks": c.marks,
-                "term_of_completion": c.term_of_completion,
-                "name": course.name,
-            }
-            c_list.append(d)
-        return c_list,200
+        return list_response(
+            completed_courses(current_user.id),
+            [CompletedCourse.id],
+            completed_course_details,
+            empty=({"error": "Details doesnot exits"}, 404),
+            etag=completed_courses_etag,
+        )
 
     @auth_required("token")
     def post(self):
-        course_id = request.get_json().get("course_id")
+        body, error = completed_course_body.load()
+        if error is not None:
+            return {"error": error}, 400
+        course_id = body["course_id"]
+        if course_catalog.get(course_id) is None:
+            return {"error": f"course {course_id} does not exist"}, 400
         c_course = CompletedCourse.query.filter_by(
             user_id=current_user.id, course_id=course_id
         ).first()
         if c_course is not None:
             return {"error": "Course already exits"}, 404
         user_id = current_user.id
-        marks = request.get_json().get("marks")
-        term_of_completion = request.get_json().get("term_of_completion")
-        c_course = CompletedCourse(
-            user_id=user_id,
-            course_id=course_id,
-            marks=marks,
-            term_of_completion=term_of_completion
-        )
+        c_course = CompletedCourse(user_id=user_id, **body)
         db.session.add(c_course)
-        db.session.commit()
+        mark_stale(user_id)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # a concurrent request added it after the check above
+            db.session.rollback()
+            return {"error": "Course already exits"}, 404
         return {"message": "Course added"}, 200
 
     @auth_required("token")
     def put(self):
-        course_id = request.get_json().get("course_id")
+        body, error = completed_course_body.load()
+        if error is not None:
+            return {"error": error}, 400
+        course_id = body["course_id"]
         c_course = CompletedCourse.query.filter_by(
             user_id=current_user.id, course_id=course_id
         ).first()
         if c_course is None:
             return {"error": "Course doesnot exits"}, 404
-        c_course.marks = request.get_json().get("marks")
-        c_course.term_of_completion = request.get_json().get("term_of_completion")
-        return {"message": "Course updated"}, 200
+        error = if_match_error(c_course)
+        if error is not None:
+            return error
+        c_course.marks = body["marks"]
+        c_course.term_of_completion = body["term_of_completion"]
+        error = commit_versioned()
+        if error is not None:
+            return error
+        return {"message": "Course updated"}, 200, etag_header(c_course)
 
     @auth_required("token")
     def delete(self):
@@ -523,15 +612,36 @@ class CompletedCourseApi(Resource):
         ).first()
         if c_course is None:
             return {"error": "Course doesnot exits"}, 404
+        error = if_match_error(c_course)
+        if error is not None:
+            return error
         db.session.delete(c_course)
-        db.session.commit()
+        mark_stale(c_course.user_id)
+        error = commit_versioned()
+        if error is not None:
+            return error
         return {"message": "Course deleted"}, 200
 
 
 class Recommendation(Resource):
     @auth_required("token")
     def get(self):
-        return {"error": "No Recommendation"}, 500
+        courses = recommend(current_user.id)
+        if courses == []:
+            return {"error": "No Recommendation"}, 404
+        return courses, 200
+
+
+class ProfileApi(Resource):
+    @auth_required("token")
+    def get(self):
+        return user_profile(current_user.id, request.args.get("fields"))
+
+
+class ProfileBatchApi(Resource):
+    @auth_required("token")
+    def post(self):
+        return save_profile_batch(current_user.id, request.get_json())
 
 
 ###########################################################################################################################
@@ -542,28 +652,23 @@ class AdminStudentSearch(Resource):
     @roles_required("admin")
     def get(self):
         query = request.get_json().get("query")
-        if query is None:
+        if query is None or query.strip() == "":
             return {"error": "query cant be empty"}, 404
-        result = []
-        students = Student.query.filter(Student.roll_no.ilike(f"%{query}%")).all()
-        users = User.query.filter(User.full_name.ilike(f"%{query}%")).all()
-        if users != []:
-            slist = Student.query.filter(
-                Student.user_id.in_([user.id for user in users])
-            ).all()
-            result += [
-                {"user_id": u.id, "full_name": u.full_name, "roll_no": s.roll_no}
-                for u, s in list(zip(users, slist))
-            ]
-        if students != []:
-            ulist = User.query.filter(
-                User.id.in_([students.user_id for student in students])
-            ).all()
-            result += [
-                {"user_id": u.id, "full_name": u.full_name, "roll_no": s.roll_no}
-                for u, s in list(zip(ulist, students))
-            ]
-        return result, 200
+        matches, columns = search_students(query.strip())
+        return list_response(matches, columns, search_result)
+
+
+class AdminAnalyticsApi(Resource):
+    @auth_required("token")
+    @roles_required("admin")
+    def get(self):
+        course_id = request.args.get("course_id")
+        if course_id is not None and not course_id.isdigit():
+            return {"error": "course_id must be an integer"}, 400
+        return cohort_analytics(
+            course_id=int(course_id) if course_id is not None else None,
+            term=request.args.get("term"),
+        )
 
 
 class AdminStudentApi(Resource):
@@ -574,84 +679,47 @@ class AdminStudentApi(Resource):
         student = Student.query.filter_by(user_id=user_id).first()
         if student is None:
             return {"error": "no detail found"}, 404
-        return {
-            "dob": str(student.dob),
-            "roll_no": student.roll_no,
-            "gender": student.gender,
-            "category": student.category,
-            "country": student.country,
-            "pwd": student.pwd,
-            "type_of_disability": student.type_of_disability,
-            "requirement": student.requirement,
-            "bandwith": student.bandwith,
-            "reason_of_joining": student.reason_of_joining,
-            "hours_dedicated": student.hours_dedicated,
-            "source_kind": student.source_kind,
-            "target_for_iitm": student.target_for_iitm
-        }
+        return conditional(student.version, lambda: student_details(student))
 
     @auth_required("token")
     @roles_required("admin")
     def post(self):
-        user_id = request.get_json().get("user_id")
+        body, error = admin_student_body.load()
+        if error is not None:
+            return {"error": error}, 400
+        user_id = body.pop("user_id")
         student = Student.query.filter_by(user_id=user_id).first()
         if student is None:
             return {"error": "no detail found"}, 404
-        dob = request.get_json().get("dob")
-        roll_no = request.get_json().get("roll_no")
-        gender = request.get_json().get("gender")
-        category = request.get_json().get("category")
-        country = request.get_json().get("country")
-        pwd = request.get_json().get("pwd")
-        type_of_disability = request.get_json().get("type_of_disability")
-        requirement = request.get_json().get("requirement")
-        bandwith = request.get_json().get("bandwith")
-        reason_of_joining = request.get_json().get("reason_of_joining")
-        hours_dedicated = request.get_json().get("hours_dedicated")
-        source_kind = request.get_json().get("source_kind")
-        target_for_iitm = request.get_json().get("target_for_iitm")
-        student = Student(
-            user_id=user_id,
-            dob=dob,
-            roll_no=roll_no,
-            gender=gender,
-            category=category,
-            country=country,
-            pwd=pwd,
-            type_of_disability=type_of_disability,
-            requirement=requirement,
-            bandwith=bandwith,
-            reason_of_joining=reason_of_joining,
-            hours_dedicated=hours_dedicated,
-            source_kind=source_kind,
-            target_for_iitm=target_for_iitm
-        )
+        student = Student(user_id=user_id, **body)
         db.session.add(student)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # each user has at most one student row
+            db.session.rollback()
+            return {"error": "details already exits"}, 300
         return {"message": "Student detailed added"}, 200
 
     @auth_required("token")
     @roles_required("admin")
     def put(self):
-        user_id = request.get_json().get("user_id")
+        body, error = admin_student_body.load()
+        if error is not None:
+            return {"error": error}, 400
+        user_id = body.pop("user_id")
         student = Student.query.filter_by(user_id=user_id).first()
         if student is None:
             return {"error": "no detail found"}, 404
-        student.dob = request.get_json().get("dob")
-        student.roll_no = request.get_json().get("roll_no")
-        student.gender = request.get_json().get("gender")
-        student.category = request.get_json().get("category")
-        student.country = request.get_json().get("country")
-        student.pwd = request.get_json().get("pwd")
-        student.type_of_disability = request.get_json().get("type_of_disability")
-        student.requirement = request.get_json().get("requirement")
-        student.bandwith = request.get_json().get("bandwith")
-        student.reason_of_joining = request.get_json().get("reason_of_joining")
-        student.hours_dedicated = request.get_json().get("hours_dedicated")
-        student.source_kind = request.get_json().get("source_kind")
-        student.target_for_iitm = request.get_json().get("target_for_iitm")
-        db.session.commit()
-        return {"message": "Student detailed updated"}, 200
+        error = if_match_error(student)
+        if error is not None:
+            return error
+        for name, value in body.items():
+            setattr(student, name, value)
+        error = commit_versioned()
+        if error is not None:
+            return error
+        return {"message": "Student detailed updated"}, 200, etag_header(student)
 
     @auth_required("token")
     @roles_required("admin")
@@ -660,8 +728,13 @@ class AdminStudentApi(Resource):
         student = Student.query.filter_by(user_id=user_id).first()
         if student is None:
             return {"error": "no detail found"}, 404
+        error = if_match_error(student)
+        if error is not None:
+            return error
         db.session.delete(student)
-        db.session.commit()
+        error = commit_versioned()
+        if error is not None:
+            return error
         return {"message": "Student detailed delete"}, 200
 
 
@@ -670,92 +743,80 @@ class AdminSchoolApi(Resource):
     @roles_required("admin")
     def get(self):
         user_id = request.get_json().get("user_id")
-        user = User.query.get(user_id)
+        user = user_with(user_id, User.school)
+        if user is None:
+            return {"error": "User Not Found"}, 404
         school = user.school
         if school == []:
             return {"error": "no detail found"}, 404
         school = school[0]
-        return {
-            "school_name": school.school_name,
-            "type_of_school": school.type_of_school,
-            "marks": school.marks,
-            "pass_status": school.pass_status,
-            "year_of_passing": school.year_of_passing,
-            "city": school.city,
-            "state": school.state,
-            "other_city": school.other_city,
-            "other_state": school.other_state,
-            "country_of_school": school.country_of_school
-        }
+        return conditional(school.version, lambda: school_details(school))
 
     @auth_required("token")
     @roles_required("admin")
     def post(self):
-        user_id = request.get_json().get("user_id")
-        user = User.query.get(user_id)
+        body, error = admin_school_body.load()
+        if error is not None:
+            return {"error": error}, 400
+        user_id = body.pop("user_id")
+        user = user_with(user_id, User.school)
+        if user is None:
+            return {"error": "User Not Found"}, 404
         school = user.school
         if school != []:
             return {"error": "details already exits"}, 300
-        school_name = request.get_json().get("school_name")
-        type_of_school = request.get_json().get("type_of_school")
-        marks = request.get_json().get("marks")
-        pass_status = request.get_json().get("pass_status")
-        year_of_passing = request.get_json().get("year_of_passing")
-        city = request.get_json().get("city")
-        state = request.get_json().get("state")
-        other_city = request.get_json().get("other_city")
-        other_state = request.get_json().get("other_state")
-        country_of_school = request.get_json().get("country_of_school")
-        school = SchoolDetails(
-            user_id=user.id,
-            school_name=school_name,
-            type_of_school=type_of_school,
-            marks=marks,
-            pass_status=pass_status,
-            year_of_passing=year_of_passing,
-            city=city,
-            state=state,
-            other_city=other_city,
-            other_state=other_state,
-            country_of_school=country_of_school
-        )
+        school = SchoolDetails(user_id=user.id, **body)
         db.session.add(school)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # a concurrent request added it after the check above
+            db.session.rollback()
+            return {"error": "details already exits"}, 300
         return {"message": "school details added"}
 
     @auth_required("token")
     @roles_required("admin")
     def put(self):
-        user_id = request.get_json().get("user_id")
-        user = User.query.get(user_id)
+        body, error = admin_school_body.load()
+        if error is not None:
+            return {"error": error}, 400
+        user_id = body.pop("user_id")
+        user = user_with(user_id, User.school)
+        if user is None:
+            return {"error": "User Not Found"}, 404
         school = user.school
         if school == []:
             return {"error": "details doesnot exits"}, 400
         school = school[0]
-        school.school_name = request.get_json().get("school_name")
-        school.type_of_school = request.get_json().get("type_of_school")
-        school.marks = request.get_json().get("marks")
-        school.pass_status = request.get_json().get("pass_status")
-        school.year_of_passing = request.get_json().get("year_of_passing")
-        school.city = request.get_json().get("city")
-        school.state = request.get_json().get("state")
-        school.other_city = request.get_json().get("other_city")
-        school.other_state = request.get_json().get("other_state")
-        school.country_of_school = request.get_json().get("country_of_school")
-        db.session.commit()
-        return {"message": "school details updated"}, 200
+        error = if_match_error(school)
+        if error is not None:
+            return error
+        for name, value in body.items():
+            setattr(school, name, value)
+        error = commit_versioned()
+        if error is not None:
+            return error
+        return {"message": "school details updated"}, 200, etag_header(school)
 
     @auth_required("token")
     @roles_required("admin")
     def delete(self):
         user_id = request.get_json().get("user_id")
-        user = User.query.get(user_id)
+        user = user_with(user_id, User.school)
+        if user is None:
+            return {"error": "User Not Found"}, 404
         school = user.school
         if school == []:
             return {"error": "details doesnot exits"}, 400
         school = school[0]
+        error = if_match_error(school)
+        if error is not None:
+            return error
         db.session.delete(school)
-        db.session.commit()
+        error = commit_versioned()
+        if error is not None:
+            return error
         return {"message": "school details delete"}, 200
 
 
@@ -764,99 +825,79 @@ class AdminCollegeApi(Resource):
     @roles_required("admin")
     def get(self):
         user_id = request.get_json().get("user_id")
-        user = User.query.get(user_id)
+        user = user_with(user_id, User.college)
+        if user is None:
+            return {"error": "User Not Found"}, 404
         college = user.college
         if college == []:
             return {"error": "details doesnot exits"}, 400
         college = college[0]
-        return {
-            "college_name": college.college_name,
-            "university": college.university,
-            "field_of_study": college.field_of_study,
-            "roll_no": college.roll_no,
-            "college_status": college.college_status,
-            "year_of_joining": college.year_of_joining,
-            "year_of_completion": college.year_of_completion,
-            "current_year": college.current_year,
-            "reason_for_dropping": college.reason_for_dropping,
-            "college_state": college.college_state,
-            "college_country": college.college_country,
-            "qualifying_criteria": college.qualifying_criteria
-        }
+        return conditional(college.version, lambda: college_details(college))
 
     @auth_required("token")
     @roles_required("admin")
     def post(self):
-        user_id = request.get_json().get("user_id")
-        user = User.query.get(user_id)
+        body, error = admin_college_body.load()
+        if error is not None:
+            return {"error": error}, 400
+        user_id = body.pop("user_id")
+        user = user_with(user_id, User.college)
+        if user is None:
+            return {"error": "User Not Found"}, 404
         if user.college != []:
             return {"error": "details already exits"}
-        college_name = request.get_json().get("college_name")
-        university = request.get_json().get("university")
-        field_of_study = request.get_json().get("field_of_study")
-        roll_no = request.get_json().get("roll_no")
-        college_status = request.get_json().get("college_status")
-        year_of_joining = request.get_json().get("year_of_joining")
-        year_of_completion = request.get_json().get("year_of_completion")
-        current_year = request.get_json().get("current_year")
-        reason_for_dropping = request.get_json().get("reason_for_dropping")
-        college_state = request.get_json().get("college_state")
-        college_country = request.get_json().get("college_country")
-        qualifying_criteria = request.get_json().get("qualifying_criteria")
-        college = CollegeDetails(
-            user_id=user.id,
-            college_name=college_name,
-            university=university,
-            field_of_study=field_of_study,
-            roll_no=roll_no,
-            college_status=college_status,
-            year_of_joining=year_of_joining,
-            year_of_completion=year_of_completion,
-            current_year=current_year,
-            reason_for_dropping=reason_for_dropping,
-            college_state=college_state,
-            college_country=college_country,
-            qualifying_criteria=qualifying_criteria
-        )
+        college = CollegeDetails(user_id=user.id, **body)
         db.session.add(college)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # a concurrent request added it after the check above
+            db.session.rollback()
+            return {"error": "details already exits"}
         return {"message": "Details added"}, 200
 
     @auth_required("token")
     @roles_required("admin")
     def put(self):
-        user_id = request.get_json().get("user_id")
-        user = User.query.get(user_id)
+        body, error = admin_college_body.load()
+        if error is not None:
+            return {"error": error}, 400
+        user_id = body.pop("user_id")
+        user = user_with(user_id, User.college)
+        if user is None:
+            return {"error": "User Not Found"}, 404
         college = user.college
         if college == []:
             return {"error": "details doesnot exits"}, 404
         college = college[0]
-        college.college_name = request.get_json().get("college_name")
-        college.university = request.get_json().get("university")
-        college.field_of_study = request.get_json().get("field_of_study")
-        college.roll_no = request.get_json().get("roll_no")
-        college.college_status = request.get_json().get("college_status")
-        college.year_of_joining = request.get_json().get("year_of_joining")
-        college.year_of_completion = request.get_json().get("year_of_completion")
-        college.current_year = request.get_json().get("current_year")
-        college.reason_for_dropping = request.get_json().get("reason_for_dropping")
-        college.college_state = request.get_json().get("college_state")
-        college.college_country = request.get_json().get("college_country")
-        college.qualifying_criteria = request.get_json().get("qualifying_criteria")
-        db.session.commit()
-        return {"message": "Details updated"}, 200
+        error = if_match_error(college)
+        if error is not None:
+            return error
+        for name, value in body.items():
+            setattr(college, name, value)
+        error = commit_versioned()
+        if error is not None:
+            return error
+        return {"message": "Details updated"}, 200, etag_header(college)
 
     @auth_required("token")
     @roles_required("admin")
     def delete(self):
         user_id = request.get_json().get("user_id")
-        user = User.query.get(user_id)
+        user = user_with(user_id, User.college)
+        if user is None:
+            return {"error": "User Not Found"}, 404
         college = user.college
         if college == []:
             return {"error": "details doesnot exits"}, 404
         college = college[0]
+        error = if_match_error(college)
+        if error is not None:
+            return error
         db.session.delete(college)
-        db.session.commit()
+        error = commit_versioned()
+        if error is not None:
+            return error
         return {"message": "Details deleted"}, 200
 
 
@@ -865,68 +906,80 @@ class AdminJeeApi(Resource):
     @roles_required("admin")
     def get(self):
         user_id = request.get_json().get("user_id")
-        user = User.query.get(user_id)
+        user = user_with(user_id, User.jee)
+        if user is None:
+            return {"error": "User Not Found"}, 404
         jee = user.jee
         if jee == []:
             return {"error": "Details doesnot exits"}, 404
         jee = jee[0]
-        return {
-            "jee_qualified": jee.jee_qualified,
-            "reg_id": jee.reg_id,
-            "qualified_month": jee.qualified_month,
-            "qualified_year": jee.qualified_year
-        }, 200
+        return conditional(jee.version, lambda: jee_details(jee))
 
     @auth_required("token")
     @roles_required("admin")
     def post(self):
-        user_id = request.get_json().get("user_id")
-        user = User.query.get(user_id)
+        body, error = admin_jee_body.load()
+        if error is not None:
+            return {"error": error}, 400
+        user_id = body.pop("user_id")
+        user = user_with(user_id, User.jee)
+        if user is None:
+            return {"error": "User Not Found"}, 404
         jee = user.jee
         if jee != []:
             return {"error": "Details already exits"}, 300
-        jee_qualified = request.get_json().get("jee_qualified")
-        reg_id = request.get_json().get("reg_id")
-        qualified_month = request.get_json().get("qualified_month")
-        qualified_year = request.get_json().get("qualified_year")
-        jee = JeeDetails(
-            user_id=user.id,
-            jee_qualified=jee_qualified,
-            reg_id=reg_id,
-            qualified_month=qualified_month,
-            qualified_year=qualified_year
-        )
+        jee = JeeDetails(user_id=user.id, **body)
         db.session.add(jee)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # a concurrent request added it after the check above
+            db.session.rollback()
+            return {"error": "Details already exits"}, 300
         return {"message": "details added"}, 200
 
     @auth_required("token")
     @roles_required("admin")
     def put(self):
-        user_id = request.get_json().get("user_id")
-        user = User.query.get(user_id)
+        body, error = admin_jee_body.load()
+        if error is not None:
+            return {"error": error}, 400
+        user_id = body.pop("user_id")
+        user = user_with(user_id, User.jee)
+        if user is None:
+            return {"error": "User Not Found"}, 404
         jee = user.jee
         if jee == []:
             return {"error": "Details doesnot exits"}, 404
         jee = jee[0]
-        jee.jee_qualified = request.get_json().get("jee_qualified")
-        jee.reg_id = request.get_json().get("reg_id")
-        jee.qualified_month = request.get_json().get("qualified_month")
-        jee.qualified_year = request.get_json().get("qualified_year")
-        db.session.commit()
-        return {"message": "details updated"}, 200
+        error = if_match_error(jee)
+        if error is not None:
+            return error
+        for name, value in body.items():
+            setattr(jee, name, value)
+        error = commit_versioned()
+        if error is not None:
+            return error
+        return {"message": "details updated"}, 200, etag_header(jee)
 
     @auth_required("token")
     @roles_required("admin")
     def delete(self):
         user_id = request.get_json().get("user_id")
-        user = User.query.get(user_id)
+        user = user_with(user_id, User.jee)
+        if user is None:
+            return {"error": "User Not Found"}, 404
         jee = user.jee
         if jee == []:
             return {"error": "Details doesnot exits"}, 404
         jee = jee[0]
+        error = if_match_error(jee)
+        if error is not None:
+            return error
         db.session.delete(jee)
-        db.session.commit()
+        error = commit_versioned()
+        if error is not None:
+            return error
         return {"message": "details deleted"}, 200
 
 
@@ -935,58 +988,62 @@ class AdminCompletedCourseApi(Resource):
     @roles_required("admin")
     def get(self):
         user_id = request.get_json().get("user_id")
-        user = User.query.get(user_id)
-        c_course = user.c_course
-        if c_course == []:
-            return {"error": "Details doesnot exits"}, 404
-        c_list = []
-        for c in c_course:
-            course = c.course
-            d = {
-                "id": c.id,
-                "course_id": c.course_id,
-                "marks": c.marks,
-                "term_of_completion": c.term_of_completion,
-                "name": course.name,
-            }
-            c_list.append(d)
-        return c_list
+        return list_response(
+            completed_courses(user_id),
+            [CompletedCourse.id],
+            completed_course_details,
+            empty=({"error": "Details doesnot exits"}, 404),
+            etag=completed_courses_etag,
+        )
 
     @auth_required("token")
     @roles_required("admin")
     def post(self):
-        course_id = request.get_json().get("course_id")
-        user_id = request.get_json().get("user_id")
+        body, error = admin_completed_course_body.load()
+        if error is not None:
+            return {"error": error}, 400
+        user_id = body.pop("user_id")
+        course_id = body["course_id"]
+        if course_catalog.get(course_id) is None:
+            return {"error": f"course {course_id} does not exist"}, 400
         c_course = CompletedCourse.query.filter_by(
             user_id=user_id, course_id=course_id
         ).first()
         if c_course is not None:
             return {"error": "Course already exits"}, 404
-        marks = request.get_json().get("marks")
-        term_of_completion = request.get_json().get("term_of_completion")
-        c_course = CompletedCourse(
-            user_id=user_id,
-            course_id=course_id,
-            marks=marks,
-            term_of_completion=term_of_completion
-        )
+        c_course = CompletedCourse(user_id=user_id, **body)
         db.session.add(c_course)
-        db.session.commit()
+        mark_stale(user_id)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # a concurrent request added it after the check above
+            db.session.rollback()
+            return {"error": "Course already exits"}, 404
         return {"message": "Course added"}, 200
 
     @auth_required("token")
     @roles_required("admin")
     def put(self):
-        course_id = request.get_json().get("course_id")
-        user_id = request.get_json().get("user_id")
+        body, error = admin_completed_course_body.load()
+        if error is not None:
+            return {"error": error}, 400
+        user_id = body.pop("user_id")
+        course_id = body["course_id"]
         c_course = CompletedCourse.query.filter_by(
             user_id=user_id, course_id=course_id
         ).first()
         if c_course is None:
             return {"error": "Course doesnot exits"}, 404
-        c_course.marks = request.get_json().get("marks")
-        c_course.term_of_completion = request.get_json().get("term_of_completion")
-        return {"message": "Course updated"}, 200
+        error = if_match_error(c_course)
+        if error is not None:
+            return error
+        c_course.marks = body["marks"]
+        c_course.term_of_completion = body["term_of_completion"]
+        error = commit_versioned()
+        if error is not None:
+            return error
+        return {"message": "Course updated"}, 200, etag_header(c_course)
 
     @auth_required("token")
     @roles_required("admin")
@@ -998,27 +1055,184 @@ class AdminCompletedCourseApi(Resource):
         ).first()
         if c_course is None:
             return {"error": "Course doesnot exits"}, 404
+        error = if_match_error(c_course)
+        if error is not None:
+            return error
         db.session.delete(c_course)
-        db.session.commit()
+        mark_stale(c_course.user_id)
+        error = commit_versioned()
+        if error is not None:
+            return error
         return {"message": "Course deleted"}, 200
 
 
-api.add_resource(Login, "/api/login")
-api.add_resource(Register, "/api/register")
-api.add_resource(StudentApi, "/api/student")
-api.add_resource(SchoolApi, "/api/school")
-api.add_resource(CollegeApi, "/api/college")
-api.add_resource(JeeApi, "/api/jee")
-api.add_resource(CompletedCourseApi, "/api/completedcourse")
-api.add_resource(Recommendation, "/api/recommendation")
+class AdminProfileApi(Resource):
+    @auth_required("token")
+    @roles_required("admin")
+    def get(self):
+        user_id = request.get_json().get("user_id")
+        return user_profile(user_id, request.args.get("fields"))
+
+
+class AdminProfileBatchApi(Resource):
+    @auth_required("token")
+    @roles_required("admin")
+    def post(self):
+        payload = request.get_json()
+        user_id = payload.get("user_id") if isinstance(payload, dict) else None
+        if user_id is None:
+            return {"error": "user_id is required"}, 400
+        return save_profile_batch(user_id, payload)
+
+
+class AdminImportApi(Resource):
+    @auth_required("token")
+    @roles_required("admin")
+    def post(self, kind):
+        if kind not in IMPORT_KINDS:
+            return {"error": "unknown import kind"}, 404
+        upload = request.files.get("file")
+        if upload is not None:
+            stream, fmt = upload.stream, detect_format(upload.filename, upload.mimetype)
+        else:
+            stream, fmt = request.stream, detect_format(None, request.mimetype)
+        try:
+            report = import_records(kind, stream, request.args.get("format", fmt))
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        return report, 200
+
+
+class AdminExportApi(Resource):
+    @auth_required("token")
+    @roles_required("admin")
+    def get(self):
+        fmt = request.args.get("format", "csv")
+        try:
+            chunks = iter_export(
+                fmt,
+                category=request.args.get("category"),
+                country=request.args.get("country"),
+                year=request.args.get("year"),
+            )
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        mimetype, extension = EXPORT_FORMATS[fmt]
+        return Response(
+            stream_with_context(chunks),
+            mimetype=mimetype,
+            headers={"Content-Disposition": f"attachment; filename=students.{extension}"},
+        )
+
+
+class AdminJobListApi(Resource):
+    @auth_required("token")
+    @roles_required("admin")
+    def get(self):
+        jobs = Job.query
+        if request.args.get("status") is not None:
+            jobs = jobs.filter(Job.status == request.args["status"])
+        if request.args.get("type") is not None:
+            jobs = jobs.filter(Job.type == request.args["type"])
+        return list_response(jobs, [Job.id], job_details, descending=True)
+
+
+class AdminJobSubmitApi(Resource):
+    @auth_required("token")
+    @roles_required("admin")
+    def post(self, job_type):
+        if job_type not in JOB_TYPES:
+            return {"error": "unknown job type"}, 404
+        args = request.args.to_dict()
+        if request.is_json:
+            body = request.get_json(silent=True)
+            if not isinstance(body, dict):
+                return {"error": "expected a JSON object"}, 400
+            args.update(body)
+        try:
+            job = submit_job(job_type, args, current_user.id)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        return job_details(job), 202, {"Location": f"/api/admin/jobs/{job.id}"}
+
+
+class AdminJobApi(Resource):
+    @auth_required("token")
+    @roles_required("admin")
+    def get(self, job_id):
+        job = db.session.get(Job, job_id)
+        if job is None:
+            return {"error": "job not found"}, 404
+        return job_details(job)
+
+
+class AdminJobResultApi(Resource):
+    @auth_required("token")
+    @roles_required("admin")
+    def get(self, job_id):
+        job = db.session.get(Job, job_id)
+        if job is None:
+            return {"error": "job not found"}, 404
+        if job.status != "succeeded":
+            return {"error": f"job is {job.status}", "job": job_details(job)}, 409
+        if job.result_path is None:
+            return job.result
+        mimetype, extension = EXPORT_FORMATS[job.params["format"]]
+        return send_file(
+            job.result_path, mimetype=mimetype, as_attachment=True, download_name=f"students.{extension}"
+        )
+
+
+def register_resources(api):
+    api.add_resource(Login, "/api/login")
+    api.add_resource(Register, "/api/register")
+    api.add_resource(StudentApi, "/api/student")
+    api.add_resource(SchoolApi, "/api/school")
+    api.add_resource(CollegeApi, "/api/college")
+    api.add_resource(JeeApi, "/api/jee")
+    api.add_resource(CompletedCourseApi, "/api/completedcourse")
+    api.add_resource(Recommendation, "/api/recommendation")
+    api.add_resource(ProfileApi, "/api/profile")
+    api.add_resource(ProfileBatchApi, "/api/profile/batch")
+
+    api.add_resource(CourseListApi, "/api/courses")
+    api.add_resource(CourseApi, "/api/admin/course")
+    api.add_resource(AdminStudentSearch, "/api/admin/studentsearch")
+    api.add_resource(AdminStudentApi, "/api/admin/student")
+    api.add_resource(AdminSchoolApi, "/api/admin/school")
+    api.add_resource(AdminCollegeApi, "/api/admin/college")
+    api.add_resource(AdminJeeApi, "/api/admin/jee")
+    api.add_resource(AdminCompletedCourseApi, "/api/admin/completedcourse")
+    api.add_resource(AdminProfileApi, "/api/admin/profile")
+    api.add_resource(AdminProfileBatchApi, "/api/admin/profile/batch")
+    api.add_resource(AdminImportApi, "/api/admin/import/<string:kind>")
+    api.add_resource(AdminExportApi, "/api/admin/export")
+    api.add_resource(AdminAnalyticsApi, "/api/admin/analytics")
+    api.add_resource(AdminJobListApi, "/api/admin/jobs")
+    api.add_resource(AdminJobSubmitApi, "/api/admin/jobs/<string:job_type>")
+    api.add_resource(AdminJobApi, "/api/admin/jobs/<int:job_id>")
+    api.add_resource(AdminJobResultApi, "/api/admin/jobs/<int:job_id>/result")
+
+
+def make_app(database_uri=None, database_mode=None):
+    """The app with every resource registered and the schema up to date,
+    on DATABASE_URI (default: in memory).
+
+    Importing this module builds nothing, so servers can import it before
+    forking and call this in each worker (wsgi.py, asgi.py), or call it
+    once before forking: open connections are not carried into the
+    workers. ``FLASK_APP="main:make_app()" flask ...`` runs the CLI
+    commands."""
+    database_uri = database_uri or os.environ.get("DATABASE_URI", "sqlite:///:memory:")
+    app, api, user_datastore = create_app(__name__, database_uri, database_mode)
+    register_resources(api)
+    setup_database(app)
+    # load the course catalog now rather than in the first request; it
+    # would also load itself on first use
+    with app.app_context():
+        course_catalog.snapshot()
+    return app
 
-api.add_resource(CourseApi, "/api/admin/course")
-api.add_resource(AdminStudentSearch, "/api/admin/studentsearch")
-api.add_resource(AdminStudentApi, "/api/admin/student")
-api.add_resource(AdminSchoolApi, "/api/admin/school")
-api.add_resource(AdminCollegeApi, "/api/admin/college")
-api.add_resource(AdminJeeApi, "/api/admin/jee")
-api.add_resource(AdminCompletedCourseApi, "/api/admin/completedcourse")
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    make_app().run(debug=True)
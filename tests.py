@@ -1,9 +1,31 @@
+import contextlib
+import gzip
+import re
 import pytest
+from sqlalchemy import event
 from main import *
+from application.passwords import password_hasher
+from application.recommendation import level_rank, refresh_recommendations
+from application.serialization import dumps
+from application.validation import RequestModel
+from application.versioning import PRECONDITION_FAILED, commit_versioned
 import json
 import mpl_toolkits
 
 
+@contextlib.contextmanager
+def count_statements():
+    """Collect the SQL statements run on the current app's engine as
+    (statement, parameters) pairs."""
+    statements = []
+    record = lambda conn, cursor, statement, parameters, *args: statements.append((statement, parameters))
+    event.listen(db.engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", record)
+
+
 @pytest.fixture(scope="module")
 def client():
     app, api , user_datastore = create_app(__name__,"sqlite:///:memory:")
@@ -17,7 +39,10 @@ def client():
     api.add_resource(JeeApi, "/api/jee")
     api.add_resource(CompletedCourseApi, "/api/completedcourse")
     api.add_resource(Recommendation, "/api/recommendation")
+    api.add_resource(ProfileApi, "/api/profile")
+    api.add_resource(ProfileBatchApi, "/api/profile/batch")
 
+    api.add_resource(CourseListApi, "/api/courses")
     api.add_resource(CourseApi, "/api/admin/course")
     api.add_resource(AdminStudentSearch, "/api/admin/studentsearch")
     api.add_resource(AdminStudentApi, "/api/admin/student")
@@ -25,6 +50,15 @@ def client():
     api.add_resource(AdminCollegeApi, "/api/admin/college")
     api.add_resource(AdminJeeApi, "/api/admin/jee")
     api.add_resource(AdminCompletedCourseApi, "/api/admin/completedcourse")
+    api.add_resource(AdminProfileApi, "/api/admin/profile")
+    api.add_resource(AdminProfileBatchApi, "/api/admin/profile/batch")
+    api.add_resource(AdminImportApi, "/api/admin/import/<string:kind>")
+    api.add_resource(AdminExportApi, "/api/admin/export")
+    api.add_resource(AdminAnalyticsApi, "/api/admin/analytics")
+    api.add_resource(AdminJobListApi, "/api/admin/jobs")
+    api.add_resource(AdminJobSubmitApi, "/api/admin/jobs/<string:job_type>")
+    api.add_resource(AdminJobApi, "/api/admin/jobs/<int:job_id>")
+    api.add_resource(AdminJobResultApi, "/api/admin/jobs/<int:job_id>/result")
     app.app_context().push()
 
     with api.app.test_client() as testing_client:
@@ -270,6 +304,55 @@ def test_jee_api_delete(client,access_token_user):
     assert response.status_code == 200
 
 
+def test_typed_fields(client,access_token_user):
+    headers = {'Authentication-Token':access_token_user}
+    response = client.post('/api/jee', json={"jee_qualified": True, "qualified_month": "May", "qualified_year": "2022"}, headers=headers)
+    assert response.status_code == 200
+    jee = JeeDetails.query.filter_by(jee_qualified="1").one()
+    assert (jee.qualified_year, jee.qualified_month, type(jee.qualified_month_id)) == (2022, "May", int)
+    # the JSON contract is unchanged: every field is still a string
+    response = client.get('/api/jee', headers=headers)
+    assert response.json == {"jee_qualified": "1", "reg_id": None, "qualified_month": "May", "qualified_year": "2022"}
+    for body, error in [
+        ({"qualified_year": "twenty"}, "qualified_year must be an integer"),
+        ({"qualified_year": 1800}, "qualified_year must be at least 1900"),
+        ({"qualified_year": 2022.5}, "qualified_year must be an integer"),
+        ({"qualified_month": ["May"]}, "qualified_month must be a non-empty string"),
+    ]:
+        response = client.put('/api/jee', json=body, headers=headers)
+        assert response.status_code == 400 and response.json == {"error": error}
+    assert client.delete('/api/jee', headers=headers).status_code == 200
+
+
+
+
+def test_request_validation(client,access_token_user,access_token_admin):
+    headers = {'Authentication-Token':access_token_user}
+    values, error = RequestModel(SchoolDetails).parse({"marks": "88", "school_name": 12, "city": None})
+    assert error is None
+    assert values == dict({name: None for name, parse in RequestModel(SchoolDetails).fields}, marks=88, school_name="12")
+    # token and course catalog cached
+    client.get('/api/jee', headers=headers)
+    client.get('/api/courses', headers=headers)
+    for url, body, error in [
+        ('/api/student', {"dob": "yesterday"}, "dob must be an ISO 8601 date"),
+        ('/api/student', {"roll_no": "R1"}, "dob is required"),
+        ('/api/jee', {"reg_id": {"id": 1}}, "reg_id must be a string"),
+        ('/api/school', ["marks"], "expected a JSON object"),
+        ('/api/completedcourse', {"marks": 90}, "course_id is required"),
+        ('/api/completedcourse', {"course_id": 10 ** 6}, f"course {10 ** 6} does not exist"),
+    ]:
+        with count_statements() as statements:
+            response = client.post(url, json=body, headers=headers)
+        assert response.status_code == 400 and response.json == {"error": error}
+        # rejected before any query
+        assert statements == []
+    response = client.post('/api/school', data="marks=1", headers=headers)
+    assert response.status_code == 400 and response.json == {"error": "expected a JSON object"}
+    response = client.put('/api/admin/jee', json={"reg_id": "J1"}, headers={'Authentication-Token':access_token_admin})
+    assert response.status_code == 400 and response.json == {"error": "user_id is required"}
+    response = client.put('/api/admin/jee', json={"user_id": 10 ** 6}, headers={'Authentication-Token':access_token_admin})
+    assert response.status_code == 404
 
 
 def test_completed_course_api_post(client,access_token_user):
@@ -322,3 +405,1112 @@ def test_completed_course_api_delete(client,access_token_user):
     response = client.delete('/api/completedcourse', json=data, headers={'Authentication-Token':access_token_user})
     assert response.status_code == 200
 
+
+
+def test_recommendation_api_get(client,access_token_admin,access_token_user):
+    headers = {'Authentication-Token':access_token_admin}
+    for data in [
+        {"name": "Rec Foundation", "code": "REC1", "pre_requisite": "None", "level": "Foundation"},
+        {"name": "Rec Diploma", "code": "REC2", "pre_requisite": "REC1", "level": "Diploma"},
+        {"name": "Rec Degree", "code": "REC3", "pre_requisite": "REC1, Rec Diploma", "level": "Degree"},
+    ]:
+        response = client.post('/api/admin/course', json=data, headers=headers)
+        assert response.status_code == 200
+    course = Courses.query.filter_by(code="REC1").first()
+    response = client.post('/api/completedcourse', json={"course_id": course.id, "marks": 70, "term_of_completion": "Jan 2024"}, headers={'Authentication-Token':access_token_user})
+    assert response.status_code == 200
+
+    response = client.get('/api/recommendation', headers={'Authentication-Token':access_token_user})
+    assert response.status_code == 200
+    codes = [c["code"] for c in response.json]
+    assert "REC2" in codes
+    assert "REC1" not in codes
+    assert "REC3" not in codes
+    levels = [c["level"] for c in response.json]
+    assert levels == sorted(levels, key=level_rank)
+
+
+def test_prerequisite_names_with_and():
+    from application.recommendation import PrerequisiteGraph
+    rows = [
+        {"id": 1, "name": "Data Structures and Algorithms", "code": "DSA", "pre_requisite": None, "level": "Diploma"},
+        {"id": 2, "name": "Maths", "code": "MA1", "pre_requisite": "None", "level": "Foundation"},
+        {"id": 3, "name": "Stats", "code": "ST1", "pre_requisite": "-", "level": "Foundation"},
+        {"id": 4, "name": "Systems", "code": "SY1", "pre_requisite": "Data Structures and Algorithms; MA1", "level": "Degree"},
+        {"id": 5, "name": "Models", "code": "ML1", "pre_requisite": "Maths and Stats & DSA", "level": "Degree"},
+    ]
+    courses, requires, order = PrerequisiteGraph()._build(rows)
+    assert requires[4] == {1, 2}
+    assert requires[5] == {1, 2, 3}
+
+
+def test_refresh_recommendations(client,access_token_user):
+    refresh_recommendations(batch_size=1, stale_only=False)
+    assert RecommendedCourses.query.count() == User.query.count()
+    row = RecommendedCourses.query.get(2)
+    assert row.stale is False
+    response = client.get('/api/recommendation', headers={'Authentication-Token':access_token_user})
+    assert [c["course_id"] for c in response.json] == [int(id) for id in row.course_ids.split(",")]
+
+    course = Courses.query.filter_by(code="REC2").first()
+    response = client.post('/api/completedcourse', json={"course_id": course.id, "marks": 75, "term_of_completion": "May 2024"}, headers={'Authentication-Token':access_token_user})
+    assert response.status_code == 200
+    assert RecommendedCourses.query.get(2).stale is True
+    assert RecommendedCourses.query.get(1).stale is False
+    assert refresh_recommendations() == 1
+    response = client.get('/api/recommendation', headers={'Authentication-Token':access_token_user})
+    assert "REC3" in [c["code"] for c in response.json]
+
+    # a stale row is rewritten before completions are read, so a completed
+    # course committed meanwhile waits and marks the new row stale again
+    mark_stale(2)
+    db.session.commit()
+    with count_statements() as statements:
+        response = client.get('/api/recommendation', headers={'Authentication-Token':access_token_user})
+    assert "REC3" in [c["code"] for c in response.json]
+    sql = [statement for statement, parameters in statements]
+    write = next(i for i, statement in enumerate(sql) if statement.startswith("UPDATE recommendation"))
+    read = next(i for i, statement in enumerate(sql) if "FROM completedcourse" in statement)
+    assert write < read
+    assert RecommendedCourses.query.get(2).stale is False
+
+
+def test_profile_api_get(client,access_token_user):
+    response = client.get('/api/profile', headers={'Authentication-Token':access_token_user})
+    assert response.status_code == 200
+    assert response.json["email"] == "user@gmail.com"
+    assert set(response.json) >= {"student", "school", "college", "jee", "completed_courses"}
+    assert len(response.json["completed_courses"]) == CompletedCourse.query.filter_by(user_id=2).count()
+
+    response = client.get('/api/profile?fields=jee,completed_courses', headers={'Authentication-Token':access_token_user})
+    assert response.status_code == 200
+    assert "student" not in response.json
+    assert "jee" in response.json
+
+    response = client.get('/api/profile?fields=grades', headers={'Authentication-Token':access_token_user})
+    assert response.status_code == 400
+
+
+def test_admin_profile_api_get(client,access_token_admin):
+    response = client.get('/api/admin/profile', json={"user_id": 2}, headers={'Authentication-Token':access_token_admin})
+    assert response.status_code == 200
+    assert response.json["user_id"] == 2
+
+    response = client.get('/api/admin/profile', json={"user_id": 999}, headers={'Authentication-Token':access_token_admin})
+    assert response.status_code == 404
+
+
+def test_admin_student_search(client,access_token_admin):
+    from datetime import datetime
+    db.session.add(Student(user_id=2, dob=datetime(2000, 1, 1), roll_no="22f300123"))
+    db.session.commit()
+    headers = {'Authentication-Token':access_token_admin}
+
+    response = client.get('/api/admin/studentsearch', json={"query": "f3001"}, headers=headers)
+    assert response.status_code == 200
+    assert response.json == [{"user_id": 2, "full_name": "this is user", "roll_no": "22f300123", "email": "user@gmail.com"}]
+
+    response = client.get('/api/admin/studentsearch', json={"query": "THIS IS"}, headers=headers)
+    assert {r["user_id"]: r["roll_no"] for r in response.json} == {1: None, 2: "22f300123"}
+
+    response = client.get('/api/admin/studentsearch?limit=1', json={"query": "this is"}, headers=headers)
+    assert len(response.json) == 1
+    cursor = response.headers['X-Next-Cursor']
+    response = client.get(f'/api/admin/studentsearch?limit=1&after={cursor}', json={"query": "this is"}, headers=headers)
+    assert len(response.json) == 1
+    assert 'X-Next-Cursor' not in response.headers
+
+    response = client.get('/api/admin/studentsearch', json={"query": "22"}, headers=headers)
+    assert [r["user_id"] for r in response.json] == [2]
+
+    response = client.get('/api/admin/studentsearch', json={"query": ""}, headers=headers)
+    assert response.status_code == 404
+
+
+def test_course_list_api_pagination(client,access_token_user):
+    headers = {'Authentication-Token':access_token_user}
+    response = client.get('/api/courses', headers=headers)
+    assert response.status_code == 200
+    all_ids = [c["id"] for c in response.json]
+    assert all_ids == sorted(all_ids) and len(all_ids) > 2
+
+    ids = []
+    url = '/api/courses?limit=2'
+    while True:
+        response = client.get(url, headers=headers)
+        assert len(response.json) <= 2
+        ids += [c["id"] for c in response.json]
+        cursor = response.headers.get('X-Next-Cursor')
+        if cursor is None:
+            break
+        url = f'/api/courses?limit=2&after={cursor}'
+    assert ids == all_ids
+
+    response = client.get('/api/courses?after=garbage', headers=headers)
+    assert response.status_code == 400
+
+
+def test_completed_course_api_stream(client,access_token_user,access_token_admin):
+    response = client.get('/api/completedcourse?stream=ndjson', headers={'Authentication-Token':access_token_user})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    rows = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [r["course_id"] for r in rows] == [c.course_id for c in CompletedCourse.query.filter_by(user_id=2).order_by(CompletedCourse.id)]
+
+    response = client.get('/api/admin/completedcourse?limit=1', json={"user_id": 2}, headers={'Authentication-Token':access_token_admin})
+    assert response.json == rows[:1]
+    assert 'X-Next-Cursor' in response.headers
+
+    # forged cursors never reach the query
+    from application.pagination import encode_cursor
+    for values in ([[1]], [{"id": 1}], ["1"], [True], [2**70], [None]):
+        response = client.get(f'/api/completedcourse?after={encode_cursor(values)}', headers={'Authentication-Token':access_token_user})
+        assert response.status_code == 400, values
+
+
+def test_response_compression(client,access_token_user):
+    headers = {'Authentication-Token':access_token_user}
+    plain = client.get('/api/courses', headers=headers)
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary']
+    config = client.application.config
+    min_size = config["COMPRESSION_MIN_SIZE"]
+    config["COMPRESSION_MIN_SIZE"] = 0
+    try:
+        response = client.get('/api/courses', headers=dict(headers, **{'Accept-Encoding': 'br;q=0.5, gzip'}))
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert json.loads(gzip.decompress(response.data)) == plain.json
+        assert response.headers['ETag'] == 'W/' + plain.headers['ETag']
+        response = client.get('/api/courses', headers=dict(headers, **{'If-None-Match': response.headers['ETag']}))
+        assert response.status_code == 304
+
+        response = client.get('/api/completedcourse?stream=ndjson', headers=dict(headers, **{'Accept-Encoding': 'gzip'}))
+        rows = [json.loads(line) for line in gzip.decompress(response.data).decode().splitlines()]
+        assert rows == client.get('/api/completedcourse', headers=headers).json
+    finally:
+        config["COMPRESSION_MIN_SIZE"] = min_size
+    # integers orjson cannot hold fall back to the json module
+    assert json.loads(dumps({1: 2 ** 70})) == {"1": 2 ** 70}
+
+
+def test_admin_import_completed_courses(client,access_token_admin):
+    import io
+    course = Courses.query.filter_by(code="REC3").first()
+    other = Courses.query.filter_by(code="REC1").first()
+    data = (
+        "user_id,course_id,marks,term_of_completion\n"
+        f"1,{course.id},60,Jan 2024\n"
+        f"1,{course.id},65,May 2024\n"
+        f"2,{other.id},88,Sept 2024\n"
+        f"999,{course.id},50,Jan 2024\n"
+        f"1,999,50,Jan 2024\n"
+        f"1,{other.id},not a number,Jan 2024\n"
+        f"2,{course.id},70,Jan 2024,extra\n"
+    )
+    response = client.post('/api/admin/import/completedcourse', data={"file": (io.BytesIO(data.encode()), "grades.csv")}, headers={'Authentication-Token':access_token_admin})
+    assert response.status_code == 200
+    assert response.json["inserted"] == 1
+    assert response.json["updated"] == 1
+    assert [e["row"] for e in response.json["errors"]] == [4, 5, 6, 7]
+    assert response.json["errors"][-1]["error"] == "1 more fields than the header"
+    assert CompletedCourse.query.filter_by(user_id=1, course_id=course.id).one().marks == 65
+    assert CompletedCourse.query.filter_by(user_id=2, course_id=other.id).one().marks == 88
+
+
+def test_admin_import_school_ndjson(client,access_token_admin):
+    data = '{"user_id": 1, "school_name": "Imported School", "marks": "91"}\n{"user_id": 1, "grade": "A"}\nnot json\n'
+    response = client.post('/api/admin/import/school', data=data, content_type='application/x-ndjson', headers={'Authentication-Token':access_token_admin})
+    assert response.status_code == 200
+    assert response.json["inserted"] + response.json["updated"] == 1
+    assert [e["row"] for e in response.json["errors"]] == [2, 3]
+    assert SchoolDetails.query.filter_by(user_id=1).one().school_name == "Imported School"
+
+    response = client.post('/api/admin/import/grades', data=data, headers={'Authentication-Token':access_token_admin})
+    assert response.status_code == 404
+
+
+def test_admin_import_checks_integers(client,access_token_admin):
+    lines = [
+        {"user_id": 1, "marks": 88.7},
+        {"user_id": 1, "marks": True},
+        {"user_id": 1, "year_of_passing": 1066},
+        {"user_id": 1, "marks": "93", "year_of_passing": 2020.0},
+    ]
+    data = "\n".join(json.dumps(line) for line in lines)
+    response = client.post('/api/admin/import/school', data=data, content_type='application/x-ndjson', headers={'Authentication-Token':access_token_admin})
+    assert response.status_code == 200
+    assert response.json["errors"] == [
+        {"row": 1, "error": "marks must be an integer"},
+        {"row": 2, "error": "marks must be an integer"},
+        {"row": 3, "error": "year_of_passing must be at least 1900"},
+    ]
+    school = SchoolDetails.query.filter_by(user_id=1).one()
+    assert (school.marks, school.year_of_passing) == (93, 2020)
+
+
+def test_admin_export_csv(client,access_token_admin):
+    import csv
+    import io
+    headers = {'Authentication-Token':access_token_admin}
+    response = client.get('/api/admin/export', headers=headers)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    rows = list(csv.DictReader(io.StringIO(response.data.decode())))
+    assert {r["user_id"] for r in rows} == {"2"}
+    assert len(rows) == CompletedCourse.query.filter_by(user_id=2).count()
+    assert rows[0]["roll_no"] == "22f300123"
+
+    response = client.get('/api/admin/export?year=2024', headers=headers)
+    rows = list(csv.DictReader(io.StringIO(response.data.decode())))
+    assert rows != [] and all(r["term_of_completion"].endswith("2024") for r in rows)
+
+    response = client.get('/api/admin/export?category=General', headers=headers)
+    assert list(csv.DictReader(io.StringIO(response.data.decode()))) == []
+
+    response = client.get('/api/admin/export?format=xlsx', headers=headers)
+    assert response.status_code == 400
+
+
+def test_admin_jobs(client,access_token_admin,access_token_user,tmp_path):
+    import io
+    from application.jobs import claim_job, requeue_abandoned, run_pending, worker_name
+    client.application.config["JOB_DIR"] = str(tmp_path)
+    headers = {'Authentication-Token':access_token_admin}
+    response = client.post('/api/admin/jobs/export', json={"year": "2024"}, headers=headers)
+    assert response.status_code == 202 and response.json["status"] == "queued"
+    export = response.headers["Location"]
+    assert client.get(export + '/result', headers=headers).status_code == 409
+    course_id = Courses.query.filter_by(code="REC1").first().id
+    data = f"user_id,course_id,marks,term_of_completion\n2,{course_id},77,Jan 2024\n999,{course_id},50,Jan 2024\n"
+    response = client.post('/api/admin/jobs/import?kind=completedcourse', data={"file": (io.BytesIO(data.encode()), "grades.csv")}, headers=headers)
+    assert response.status_code == 202
+    imported = response.headers["Location"]
+
+    # one export at a time: a second stays queued while the first runs
+    second = client.post('/api/admin/jobs/export', headers=headers).json["id"]
+    running = claim_job("elsewhere:0", {"export": 1})
+    assert running.id == int(export.rsplit("/", 1)[1])
+    assert claim_job("elsewhere:1", {"export": 1, "import": 0}) is None
+    # its worker is gone, so the job is queued again
+    running.worker = f"{worker_name().split(':')[0]}:{2 ** 22 + 1}"
+    db.session.commit()
+    assert requeue_abandoned() == 1
+
+    # jobs run in the order queued, so the export comes before the import
+    expected = client.get('/api/admin/export?year=2024', headers=headers).data
+    assert run_pending() == 3
+    job = client.get(export, headers=headers).json
+    assert job["status"] == "succeeded" and job["attempts"] == 2
+    assert job["progress"] == job["result"]["rows"] > 0
+    response = client.get(export + '/result', headers=headers)
+    assert response.status_code == 200 and response.mimetype == 'text/csv'
+    assert response.data == expected
+    response.close()
+    job = client.get(imported, headers=headers).json
+    assert job["status"] == "succeeded"
+    assert client.get(imported + '/result', headers=headers).json["errors"] == [{"row": 2, "error": "user 999 does not exist"}]
+    assert CompletedCourse.query.filter_by(user_id=2, course_id=course_id).one().marks == 77
+    assert [j["id"] for j in client.get('/api/admin/jobs?type=export', headers=headers).json][:2] == [second, job["id"] - 1]
+    # newest first, a page at a time
+    response = client.get('/api/admin/jobs?limit=1', headers=headers)
+    assert [j["id"] for j in response.json] == [second]
+    response = client.get('/api/admin/jobs?limit=2&after=' + response.headers['X-Next-Cursor'], headers=headers)
+    assert [j["id"] for j in response.json] == [job["id"], job["id"] - 1]
+    lines = client.get('/api/admin/jobs?stream=ndjson', headers=headers).data.splitlines()
+    assert [json.loads(line)["id"] for line in lines] == [second, job["id"], job["id"] - 1]
+
+    assert client.post('/api/admin/jobs/reindex', headers=headers).status_code == 404
+    response = client.post('/api/admin/jobs/export', json={"format": "xlsx"}, headers=headers)
+    assert response.status_code == 400 and response.json == {"error": "unsupported format: xlsx"}
+    assert client.post('/api/admin/jobs/refresh_recommendations', json={"batch_size": 0}, headers=headers).status_code == 400
+    assert client.post('/api/admin/jobs/export', headers={'Authentication-Token':access_token_user}).status_code == 403
+    assert client.get('/api/admin/jobs/100000', headers=headers).status_code == 404
+
+
+def test_admin_analytics(client,access_token_admin,access_token_user):
+    from datetime import datetime
+    from sqlalchemy import text
+    from application.analytics import recompute_rollups
+    headers = {'Authentication-Token':access_token_admin}
+    course = Courses(name="Analytics", code="AN101", pre_requisite="None", level="Degree")
+    db.session.add(course)
+    db.session.commit()
+    first = CompletedCourse(user_id=1, course_id=course.id, marks=60, term_of_completion="Jan 2030")
+    second = CompletedCourse(user_id=2, course_id=course.id, marks=80, term_of_completion="Jan 2030")
+    jee = JeeDetails(user_id=1, jee_qualified="Yes", qualified_year=2030)
+    db.session.add_all([first, second, jee, Student(user_id=1, dob=datetime(2000, 1, 1), category="SC", country="Nepal")])
+    db.session.commit()
+    first.marks = 90
+    db.session.commit()
+
+    response = client.get(f'/api/admin/analytics?course_id={course.id}', headers=headers)
+    assert response.status_code == 200
+    assert response.json["courses"] == [{"course_id": course.id, "term": "Jan 2030", "completions": 2, "average_marks": 85.0}]
+    assert {"value": "Nepal", "count": 1} in response.json["students"]["country"]
+    assert response.json["jee"]["qualified"] >= 1
+    # the triggers keep the same totals a full recompute finds
+    rollups = client.get('/api/admin/analytics', headers=headers).json
+    for vectorized in (True, False):
+        recompute_rollups(vectorized=vectorized)
+        assert client.get('/api/admin/analytics', headers=headers).json == rollups
+    # a code with no label counts under "" with the students without one
+    db.session.execute(text("UPDATE student SET category_id = 9999 WHERE user_id = 1"))
+    db.session.commit()
+    rollups = client.get('/api/admin/analytics', headers=headers).json
+    assert {"value": None, "count": 2} in rollups["students"]["category"]
+    for vectorized in (True, False):
+        recompute_rollups(vectorized=vectorized)
+        assert client.get('/api/admin/analytics', headers=headers).json == rollups
+
+    db.session.delete(second)
+    db.session.commit()
+    response = client.get(f'/api/admin/analytics?course_id={course.id}', headers=headers)
+    assert response.json["courses"][0]["completions"] == 1
+    assert client.get('/api/admin/analytics?course_id=x', headers=headers).status_code == 400
+    assert client.get('/api/admin/analytics', headers={'Authentication-Token':access_token_user}).status_code == 403
+    db.session.delete(first)
+    db.session.delete(jee)
+    Student.query.filter_by(user_id=1).delete()
+    db.session.commit()
+
+
+def test_profile_batch(client,access_token_admin,access_token_user):
+    user = User.query.filter_by(email="user@gmail.com").one()
+    course = Courses(name="Batch Course", code="BT101", pre_requisite="None", level="Foundation")
+    db.session.add(course)
+    db.session.commit()
+    headers = {'Authentication-Token':access_token_user}
+    had_student = Student.query.filter_by(user_id=user.id).count() != 0
+    before = (SchoolDetails.query.filter_by(user_id=user.id).count(), JeeDetails.query.filter_by(user_id=user.id).count())
+    response = client.post('/api/profile/batch', json={
+        "school": {"marks": "eighty"},
+        "jee": {"grade": "A"},
+        "completed_courses": [{"course_id": 0}],
+        "hobbies": {},
+    }, headers=headers)
+    assert response.status_code == 400
+    assert set(response.json["errors"]) == {"school", "jee", "completed_courses", "hobbies"}
+    assert (SchoolDetails.query.filter_by(user_id=user.id).count(), JeeDetails.query.filter_by(user_id=user.id).count()) == before
+
+    payload = {
+        "student": {"dob": "2001-02-03", "roll_no": "24f100200", "gender": "Female", "hours_dedicated": "12"},
+        "jee": {"jee_qualified": "Yes", "qualified_year": 2023},
+        "completed_courses": [{"course_id": course.id, "marks": 77, "term_of_completion": "Jan 2025"}],
+    }
+    commits = []
+    record = lambda connection: commits.append(connection)
+    event.listen(db.engine, "commit", record)
+    try:
+        response = client.post('/api/profile/batch', json=payload, headers=headers)
+    finally:
+        event.remove(db.engine, "commit", record)
+    assert response.status_code == 200
+    assert response.json["results"] == {
+        "student": "updated" if had_student else "created",
+        "jee": "updated" if before[1] else "created",
+        "completed_courses": [{"course_id": course.id, "result": "created"}],
+    }
+    assert len(commits) == 1
+    profile = client.get('/api/profile', headers=headers).json
+    assert profile["student"]["dob"] == "2001-02-03 00:00:00" and profile["student"]["hours_dedicated"] == "12"
+    assert profile["jee"]["qualified_year"] == "2023"
+
+    response = client.post('/api/admin/profile/batch', json=dict(payload, user_id=user.id), headers={'Authentication-Token':access_token_admin})
+    assert response.json["results"]["student"] == "updated"
+    assert response.json["results"]["completed_courses"] == [{"course_id": course.id, "result": "updated"}]
+    assert Student.query.filter_by(user_id=user.id).count() == 1
+    response = client.post('/api/admin/profile/batch', json=payload, headers={'Authentication-Token':access_token_admin})
+    assert response.status_code == 400
+    response = client.post('/api/admin/profile/batch', json=dict(payload, user_id=10**6), headers={'Authentication-Token':access_token_admin})
+    assert response.status_code == 404
+    response = client.post('/api/profile/batch', json={"student": {"roll_no": "x"}}, headers=headers)
+    assert response.status_code == 200 and response.json["results"] == {"student": "updated"}
+    # items are parsed as the single endpoints parse them
+    response = client.post('/api/profile/batch', json={"completed_courses": [{"course_id": str(course.id), "marks": "81"}]}, headers=headers)
+    assert response.json["results"] == {"completed_courses": [{"course_id": course.id, "result": "updated"}]}
+    assert CompletedCourse.query.filter_by(user_id=user.id, course_id=course.id).one().marks == 81
+    response = client.post('/api/profile/batch', json={"school": {"marks": 88.5}}, headers=headers)
+    assert response.status_code == 400 and response.json["errors"] == {"school": "marks must be an integer"}
+
+    CompletedCourse.query.filter_by(user_id=user.id, course_id=course.id).delete()
+    if not before[1]:
+        JeeDetails.query.filter_by(user_id=user.id).delete()
+    if not had_student:
+        Student.query.filter_by(user_id=user.id).delete()
+    db.session.commit()
+
+
+def test_conditional_requests(client,access_token_user):
+    user = User.query.filter_by(email="user@gmail.com").one()
+    headers = {'Authentication-Token':access_token_user}
+    created = JeeDetails.query.filter_by(user_id=user.id).count() == 0
+    if created:
+        assert client.post('/api/jee', json={"jee_qualified": "No", "reg_id": "J1"}, headers=headers).status_code == 200
+    response = client.get('/api/jee', headers=headers)
+    etag = response.headers['ETag']
+    assert etag == f'"{JeeDetails.query.filter_by(user_id=user.id).one().version}"'
+    assert client.get('/api/jee', headers=dict(headers, **{'If-None-Match': etag})).status_code == 304
+
+    data = {"jee_qualified": "Yes", "reg_id": "J2", "qualified_month": "May", "qualified_year": "2024"}
+    response = client.put('/api/jee', json=data, headers=dict(headers, **{'If-Match': '"stale"'}))
+    assert response.status_code == 412
+    response = client.put('/api/jee', json=data, headers=dict(headers, **{'If-Match': etag}))
+    assert response.status_code == 200
+    new_etag = response.headers['ETag']
+    assert new_etag != etag
+    response = client.get('/api/jee', headers=dict(headers, **{'If-None-Match': etag}))
+    assert response.status_code == 200 and response.headers['ETag'] == new_etag
+    assert response.json["reg_id"] == "J2"
+
+    for url in ('/api/completedcourse', '/api/profile'):
+        response = client.get(url, headers=headers)
+        if response.status_code == 200:
+            assert client.get(url, headers=dict(headers, **{'If-None-Match': response.headers['ETag']})).status_code == 304
+
+    # a write racing another one that committed first loses
+    jee = JeeDetails.query.filter_by(user_id=user.id).one()
+    db.session.execute(JeeDetails.__table__.update().where(JeeDetails.id == jee.id).values(reg_id="other"))
+    jee.reg_id = "mine"
+    assert commit_versioned() == PRECONDITION_FAILED
+    assert JeeDetails.query.filter_by(user_id=user.id).one().reg_id == "J2"
+
+    if created:
+        etag = client.get('/api/jee', headers=headers).headers['ETag']
+        assert client.delete('/api/jee', headers=dict(headers, **{'If-Match': '"stale"'})).status_code == 412
+        assert client.delete('/api/jee', headers=dict(headers, **{'If-Match': etag})).status_code == 200
+
+
+def test_auth_token_cache(client,access_token_admin):
+    from application.auth_cache import auth_cache
+    response = client.post('/api/register', json={"email": "cache@gmail.com", "password": "password", "full_name": "cache user", "role": "user"})
+    assert response.status_code == 200
+    token = client.post('/api/login', json={"email": "cache@gmail.com", "password": "password"}).json['token']
+    headers = {'Authentication-Token':token}
+
+    assert client.get('/api/profile', headers=headers).status_code == 200
+    hits = auth_cache.hits
+    response = client.get('/api/profile', headers=headers)
+    assert response.json["email"] == "cache@gmail.com"
+    assert auth_cache.hits == hits + 1
+    assert client.get('/api/admin/profile', json={"user_id": 1}, headers=headers).status_code == 403
+
+    user = User.query.filter_by(email="cache@gmail.com").first()
+    user.roles.append(Role.query.filter_by(name="admin").first())
+    db.session.commit()
+    assert client.get('/api/admin/profile', json={"user_id": 1}, headers=headers).status_code == 200
+
+    user.roles = []
+    db.session.commit()
+    assert client.get('/api/admin/profile', json={"user_id": 1}, headers=headers).status_code == 403
+
+    user.fs_uniquifier = "rotated"
+    db.session.commit()
+    assert client.get('/api/profile', headers=headers).status_code != 200
+
+
+def test_login_backpressure(client):
+    client.application.config["PASSWORD_HASH_QUEUE_DEPTH"] = 0
+    password_hasher.shutdown()
+    try:
+        response = client.post('/api/login', json={'email': 'user@gmail.com', 'password': 'password'})
+        assert response.status_code == 429
+        assert response.headers['Retry-After'] == '1'
+    finally:
+        del client.application.config["PASSWORD_HASH_QUEUE_DEPTH"]
+        password_hasher.shutdown()
+    response = client.post('/api/login', json={'email': 'user@gmail.com', 'password': 'wrong'})
+    assert response.status_code == 300
+
+
+def test_password_hash_timeout(client):
+    import time
+    config = client.application.config
+    workers = config["PASSWORD_HASH_WORKERS"]
+    config.update(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_QUEUE_DEPTH=1, PASSWORD_HASH_TIMEOUT=0.001)
+    password_hasher.shutdown()
+    try:
+        # a call that outlives its caller still holds the only slot
+        response = client.post('/api/login', json={'email': 'user@gmail.com', 'password': 'password'})
+        assert response.status_code == 429
+        executor, slots = password_hasher._pool()
+        assert slots.acquire(blocking=False) is False
+        deadline = time.time() + 30
+        while not slots.acquire(blocking=False):
+            assert time.time() < deadline
+            time.sleep(0.05)
+        slots.release()
+    finally:
+        config["PASSWORD_HASH_WORKERS"] = workers
+        del config["PASSWORD_HASH_QUEUE_DEPTH"], config["PASSWORD_HASH_TIMEOUT"]
+        password_hasher.shutdown()
+
+
+def test_course_catalog_cache(client,access_token_admin,access_token_user):
+    headers = {'Authentication-Token':access_token_admin}
+    response = client.get('/api/courses', headers=headers)
+    etag = response.headers['ETag']
+    response = client.get('/api/courses', headers=dict(headers, **{'If-None-Match': etag}))
+    assert response.status_code == 304
+
+    course = Courses.query.filter_by(code="REC3").first()
+    data = {"id": course.id, "name": "Renamed Course", "code": "REC3", "pre_requisite": course.pre_requisite, "level": course.level}
+    assert client.put('/api/admin/course', json=data, headers=headers).status_code == 200
+    response = client.get('/api/courses', headers=dict(headers, **{'If-None-Match': etag}))
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert "Renamed Course" in [c["name"] for c in response.json]
+    response = client.get('/api/admin/course', json={"id": str(course.id)}, headers=headers)
+    assert response.status_code == 200
+    assert response.json["name"] == "Renamed Course"
+    assert client.get('/api/admin/course', json={"id": "REC3"}, headers=headers).status_code == 404
+
+    with count_statements() as statements:
+        response = client.get('/api/completedcourse', headers={'Authentication-Token':access_token_user})
+    assert response.status_code == 200
+    assert not any("FROM course" in s for s, p in statements)
+
+    # every app keeps its own catalog
+    db.session.remove()
+    other, other_api, other_datastore = create_app("other", "sqlite:///:memory:")
+    try:
+        with other.test_request_context():
+            db.create_all()
+            assert course_catalog.snapshot().courses == []
+    finally:
+        db.session.remove()
+    assert "Renamed Course" in [c["name"] for c in course_catalog.snapshot().courses]
+
+
+# (url, token, body, statements per request once the token is cached)
+READ_ENDPOINTS = [
+    ('/api/completedcourse', 'user', None, 1),
+    ('/api/profile', 'user', None, 1),
+    ('/api/courses', 'user', None, 0),
+    ('/api/admin/completedcourse', 'admin', {"user_id": 2}, 1),
+    ('/api/admin/student', 'admin', {"user_id": 2}, 1),
+    ('/api/admin/school', 'admin', {"user_id": 2}, 1),
+    ('/api/admin/college', 'admin', {"user_id": 2}, 1),
+    ('/api/admin/jee', 'admin', {"user_id": 2}, 1),
+    ('/api/admin/profile', 'admin', {"user_id": 2}, 1),
+]
+
+
+@pytest.mark.parametrize("url,token,body,expected", READ_ENDPOINTS)
+def test_statement_count(client,access_token_admin,access_token_user,url,token,body,expected):
+    headers = {'Authentication-Token': access_token_admin if token == 'admin' else access_token_user}
+    client.get(url, json=body, headers=headers)
+    with count_statements() as statements:
+        response = client.get(url, json=body, headers=headers)
+    assert response.status_code in (200, 400, 404)
+    assert len(statements) == expected, statements
+
+
+@pytest.mark.parametrize("url,token,body,expected", READ_ENDPOINTS)
+def test_query_plans_use_indexes(client,access_token_admin,access_token_user,url,token,body,expected):
+    headers = {'Authentication-Token': access_token_admin if token == 'admin' else access_token_user}
+    client.get(url, json=body, headers=headers)  # cache the token; only the endpoint's queries remain
+    with count_statements() as statements:
+        client.get(url, json=body, headers=headers)
+    with db.engine.connect() as connection:
+        for statement, parameters in statements:
+            plan = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()
+            scans = [row[-1] for row in plan if re.match(r"SCAN (?!.*\bUSING\b)(?!.*VIRTUAL TABLE)", row[-1])]
+            assert scans == [], (statement, scans)
+
+
+def test_production_database_mode(tmp_path):
+    from flask import Flask
+    from application.database import configure_database
+    prod = Flask("production")
+    prod.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'app.db'}"
+    prod.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    configure_database(prod, "production")
+    db.init_app(prod)
+    with prod.app_context():
+        db.create_all()
+        with db.engine.connect() as connection:
+            assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+            assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+        read_engine = db.get_read_engine()
+        with read_engine.connect() as connection:
+            assert connection.exec_driver_sql("PRAGMA query_only").scalar() == 1
+        session = db.create_session({})()
+        with prod.test_request_context(method="GET"):
+            assert session.get_bind() is read_engine
+        with prod.test_request_context(method="POST"):
+            assert session.get_bind() is db.engine
+        session.close()
+        db.engine.dispose()
+        read_engine.dispose()
+
+    memory = Flask("memory")
+    memory.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+    with pytest.raises(ValueError):
+        configure_database(memory, "production")
+
+
+def test_read_replica_routing(tmp_path):
+    from flask import Flask, request
+    from sqlalchemy.exc import OperationalError
+    from application.database import configure_database
+    primary, replica = tmp_path / "primary.db", tmp_path / "replica.db"
+    for path in (primary, replica):
+        setup = Flask("setup")
+        setup.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{path}"
+        setup.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+        db.init_app(setup)
+        with setup.app_context():
+            Courses.__table__.create(db.engine)
+            db.engine.dispose()
+
+    app = Flask("routing")
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{primary}"
+    app.config["SQLALCHEMY_READ_DATABASE_URI"] = f"sqlite:///{replica}"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    configure_database(app, "default", identity=lambda: request.headers.get("X-User"))
+    db.init_app(app)
+    app.add_url_rule("/courses", "list", lambda: {"count": Courses.query.count()})
+
+    def add():
+        db.session.execute(Courses.__table__.insert().values(name="Replica", code="REP1"))
+        db.session.commit()
+        return {"message": "added"}
+    app.add_url_rule("/courses", "add", add, methods=["POST"])
+
+    db.session.remove()
+    try:
+        client = app.test_client()
+        assert client.post('/courses', headers={"X-User": "1"}).status_code == 200
+        # the writer reads its own write from the primary, others read the replica
+        assert client.get('/courses', headers={"X-User": "1"}).json["count"] == 1
+        assert client.get('/courses', headers={"X-User": "2"}).json["count"] == 0
+        assert client.get('/courses').json["count"] == 0
+        app.extensions["recent_writers"].clear()
+        assert client.get('/courses', headers={"X-User": "1"}).json["count"] == 0
+
+        with app.app_context():
+            with pytest.raises(OperationalError):
+                with db.get_read_engine().begin() as connection:
+                    connection.execute(Courses.__table__.delete())
+            db.get_read_engine().dispose()
+            db.engine.dispose()
+    finally:
+        db.session.remove()
+
+
+def test_asgi_fast_path(tmp_path):
+    import asyncio
+    from datetime import datetime
+    from flask import Flask
+    from application.async_api import AsyncApi, AsyncRoute
+    from application.auth_cache import auth_cache
+    pytest.importorskip("aiosqlite")
+    pytest.importorskip("a2wsgi")
+    app = Flask("asgi")
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'asgi.db'}"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SECURITY_TOKEN_AUTHENTICATION_HEADER"] = "Authentication-Token"
+    db.init_app(app)
+    with app.app_context():
+        for table in [lookup.table for lookup in LOOKUPS.values()] + [Student.__table__]:
+            table.create(db.engine)
+        db.session.execute(Student.__table__.insert().values(
+            user_id=7, dob=datetime(2000, 1, 2), roll_no="R7", gender_id=LOOKUPS["gender"].code("Female")))
+        db.session.commit()
+        version = db.session.query(Student.version).scalar()
+        db.session.remove()
+        db.engine.dispose()
+    app.add_url_rule("/api/student", "student", lambda: {"fallback": True})
+    app.add_url_rule("/api/admin/student", "admin_student", lambda: ({"fallback": True}, 403))
+    asgi = AsyncApi(app, {
+        "/api/student": AsyncRoute(Student, student_details, ({"error": "no detail found"}, 404)),
+        "/api/admin/student": AsyncRoute(Student, student_details, ({"error": "no detail found"}, 404), admin=True),
+    })
+
+    async def get(path, token=None, query=b"", extra_headers=()):
+        messages = [{"type": "http.request", "body": b"", "more_body": False}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+        headers = [(b"host", b"test")] + ([(b"authentication-token", token)] if token else []) + list(extra_headers)
+        await asgi({"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+                    "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": query,
+                    "root_path": "", "headers": headers, "server": ("test", 80), "client": ("test", 1)},
+                   receive, send)
+        body = b"".join(m.get("body", b"") for m in sent[1:])
+        return sent[0]["status"], json.loads(body) if body else None
+
+    async def requests():
+        return [
+            await get("/api/student", b"cached"),
+            await get("/api/student", b"unknown"),
+            await get("/api/student", b"cached", query=b"limit=1"),
+            await get("/api/admin/student", b"cached"),
+            await get("/api/student", b"cached", extra_headers=[(b"if-none-match", f'"{version}"'.encode())]),
+            await get("/api/student", b"cached", extra_headers=[(b"if-none-match", b'"stale"')]),
+        ]
+
+    auth_cache.set("cached", (7, "uniq7", True, ()))
+    try:
+        cached, unknown, with_query, not_admin, not_modified, stale = asyncio.run(requests())
+        asyncio.run(asgi.engine.dispose())
+    finally:
+        auth_cache.delete("cached")
+    assert cached == (200, dict(student_details(Student(dob=datetime(2000, 1, 2), roll_no="R7")), gender="Female"))
+    # anything the fast path cannot answer is served by the Flask app
+    assert unknown == (200, {"fallback": True})
+    assert with_query == (200, {"fallback": True})
+    assert not_admin == (403, {"fallback": True})
+    assert not_modified == (304, None)
+    assert stale == cached
+
+
+def test_instrumentation_metrics_and_profiler(tmp_path):
+    import time
+    from flask import Flask
+    from flask_restful import Api, Resource
+    from application.cache import TTLCache
+    from application.instrumentation import init_instrumentation
+    app = Flask("instrumented")
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["INSTRUMENTATION"] = True
+    app.config["PROFILE_SLOW_REQUEST_MS"] = 20
+    app.config["PROFILE_DIR"] = str(tmp_path)
+    app.config["METRICS_TOKEN"] = "scrape"
+    db.init_app(app)
+    api = Api(app)
+    cache = TTLCache()
+    cache.get("missing")
+
+    class Slow(Resource):
+        def get(self):
+            db.session.execute(db.text("SELECT 1")).scalar()
+            db.session.execute(db.text("SELECT 2")).scalar()
+            time.sleep(0.1)
+            return {"slow": True}
+
+    class Broken(Resource):
+        def get(self):
+            db.session.execute(db.text("SELECT * FROM missing")).scalar()
+
+    api.add_resource(Slow, "/slow")
+    api.add_resource(Broken, "/broken")
+    init_instrumentation(app, api, caches={"test": cache})
+    testing = app.test_client()
+    with app.app_context():
+        assert testing.get("/slow").json == {"slow": True}
+        assert testing.get("/broken").status_code == 500
+        # a failed statement does not leave its start time behind
+        with db.engine.connect() as connection:
+            assert connection.info["instrumentation_started"] == {}
+        assert testing.get("/metrics").status_code == 403
+        assert testing.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 403
+        metrics = testing.get("/metrics", headers={"Authorization": "Bearer scrape"})
+        db.session.remove()
+    assert metrics.content_type.startswith("text/plain")
+    text = metrics.get_data(as_text=True)
+    assert 'http_request_sql_statements_sum{route="/slow",method="GET"} 2' in text
+    assert 'http_request_duration_seconds_bucket{route="/slow",method="GET",le="0.05"} 0' in text
+    assert 'http_request_duration_seconds_count{route="/slow",method="GET"} 1' in text
+    assert 'http_request_serialization_duration_seconds_count{route="/slow",method="GET"} 1' in text
+    assert 'app_cache_misses_total{cache="test"} 1' in text
+    [profile] = tmp_path.glob("*-GET-slow-*.folded")
+    assert ";get (" in profile.read_text()
+
+
+def test_typed_fields_migration(tmp_path):
+    from flask import Flask
+    from sqlalchemy import func
+    from application.migrations import upgrade_schema
+    old = Flask("typed")
+    old.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'old.db'}"
+    old.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(old)
+    db.session.remove()
+    with old.app_context():
+        with db.engine.begin() as connection:
+            for statement in [
+                """CREATE TABLE student (id INTEGER PRIMARY KEY, user_id INTEGER, dob DATETIME NOT NULL,
+                roll_no VARCHAR, gender VARCHAR, category VARCHAR, country VARCHAR, pwd VARCHAR,
+                type_of_disability VARCHAR, requirement VARCHAR, bandwith VARCHAR, reason_of_joining VARCHAR,
+                hours_dedicated VARCHAR, source_kind VARCHAR, target_for_iitm VARCHAR)""",
+                """CREATE TABLE schooldetails (id INTEGER PRIMARY KEY, user_id INTEGER, school_name VARCHAR,
+                type_of_school VARCHAR, marks VARCHAR, pass_status VARCHAR, year_of_passing VARCHAR, city VARCHAR,
+                state VARCHAR, other_city VARCHAR, other_state VARCHAR, country_of_school VARCHAR)""",
+                """INSERT INTO student (user_id, dob, roll_no, gender, category, hours_dedicated)
+                VALUES (1, '2000-01-01 00:00:00', 'R1', 'Male', 'General', '10'),
+                (2, '2000-01-01 00:00:00', 'R2', 'Female', '', 'ten'),
+                (3, '2000-01-01 00:00:00', 'R3', NULL, NULL, char(9) || '12' || char(10))""",
+                """INSERT INTO schooldetails (user_id, type_of_school, marks, pass_status, year_of_passing)
+                VALUES (1, 'Public', '80', '1', '2019'), (2, 'Private', ' 90 ', '0', '2021.0'),
+                (3, NULL, '88.5', NULL, '')""",
+            ]:
+                connection.exec_driver_sql(statement)
+        db.create_all()
+        # values that are not whole numbers stop the migration, which changes nothing
+        with pytest.raises(ValueError) as error:
+            upgrade_schema()
+        assert str(error.value) == "not whole numbers: student.hours_dedicated in rows 2; schooldetails.marks in rows 3"
+        with db.engine.begin() as connection:
+            assert connection.exec_driver_sql("SELECT hours_dedicated FROM student WHERE id = 2").scalar() == "ten"
+            connection.exec_driver_sql("UPDATE student SET hours_dedicated = '-3' WHERE id = 2")
+            connection.exec_driver_sql("UPDATE schooldetails SET marks = '88' WHERE id = 3")
+        assert 2 in upgrade_schema()
+        assert upgrade_schema() == []
+        students = Student.query.order_by(Student.user_id).all()
+        # a blank label keeps a code of its own, as Lookup.code gives it one
+        assert [(s.gender, s.category, s.hours_dedicated) for s in students] == [
+            ("Male", "General", 10), ("Female", "", -3), (None, None, 12)]
+        schools = SchoolDetails.query.order_by(SchoolDetails.user_id).all()
+        assert [(s.type_of_school, s.marks, s.pass_status, s.year_of_passing) for s in schools] == [
+            ("Public", 80, "1", 2019), ("Private", 90, "0", 2021), (None, 88, None, None)]
+        # numbers aggregate and range-filter as numbers
+        assert db.session.query(func.avg(SchoolDetails.marks)).scalar() == 86
+        assert SchoolDetails.query.filter(SchoolDetails.year_of_passing >= 2020).count() == 1
+        assert SchoolDetails.query.filter(SchoolDetails.type_of_school == "Public").count() == 1
+        # the search triggers on student survive the conversion
+        student = Student(user_id=4, dob=students[0].dob, roll_no="R4", gender="Male")
+        db.session.add(student)
+        db.session.commit()
+        assert student.gender_id == students[0].gender_id
+        db.session.remove()
+        db.engine.dispose()
+
+
+def test_upgrade_shipped_database(tmp_path):
+    import os
+    import shutil
+    import sqlite3
+    from sqlalchemy.exc import IntegrityError
+    from sqlalchemy import text
+    from application.migrations import MIGRATIONS
+    from application.analytics import recompute_sql
+    path = tmp_path / "shipped.sqlite3"
+    shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "database.sqlite3"), path)
+    with sqlite3.connect(path) as connection:
+        connection.execute("INSERT INTO schooldetails (user_id, school_name) VALUES (1, 'Duplicate')")
+    db.session.remove()
+    try:
+        app = make_app(f"sqlite:///{path}")
+        with app.app_context():
+            # make_app loads the course catalog up front
+            with count_statements() as statements:
+                course_catalog.snapshot()
+            assert statements == []
+            versions = db.session.execute(text("SELECT version FROM schema_version ORDER BY version")).scalars().all()
+            assert versions == [version for version, description, statements in MIGRATIONS]
+            assert Student.query.count() == 1 and CompletedCourse.query.count() == 2
+            # students written before the search index existed are found
+            from application.search import search_students
+            matches, columns = search_students("jayvin")
+            assert [(m.user_id, m.roll_no) for m in matches] == [(1, "21f200000")]
+            # duplicated one-per-user rows keep the first, and no more can be added
+            assert [s.school_name for s in SchoolDetails.query] == [None]
+            db.session.add(SchoolDetails(user_id=1))
+            with pytest.raises(IntegrityError):
+                db.session.commit()
+            db.session.rollback()
+            # the rollup triggers on every table work on the upgraded schema
+            JeeDetails.query.filter_by(user_id=1).one().jee_qualified = "Yes"
+            db.session.commit()
+            assert db.session.get(CohortRollup, ("jee_qualified", "Yes")).count == 1
+            counted = {(r.dimension, r.value): r.count for r in CohortRollup.query}
+            with db.engine.begin() as connection:
+                connection.execute(CohortRollup.__table__.delete())
+                connection.execute(CourseTermRollup.__table__.delete())
+                recompute_sql(connection)
+            db.session.remove()
+            assert {(r.dimension, r.value): r.count for r in CohortRollup.query} == counted
+            db.session.remove()
+            db.engine.dispose()
+    finally:
+        db.session.remove()
+
+
+def test_forked_process_drops_inherited_connections(tmp_path):
+    import multiprocessing
+    from flask import Flask
+    from application.database import configure_database
+    app = Flask("fork")
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'fork.db'}"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    configure_database(app, "production")
+    db.init_app(app)
+
+    def child(connection):
+        db.session.remove()
+        pooled = db.engine.pool.checkedin()
+        connection.send((pooled, Courses.query.count()))
+        db.session.remove()
+
+    db.session.remove()
+    try:
+        with app.app_context():
+            db.create_all()
+            db.session.add(Courses(name="Forked", code="FORK1"))
+            db.session.commit()
+            db.session.remove()
+            assert db.engine.pool.checkedin() == 1
+            receiver, sender = multiprocessing.Pipe()
+            process = multiprocessing.get_context("fork").Process(target=child, args=(sender,))
+            process.start()
+            # the child starts with an empty pool and opens its own connection
+            assert receiver.recv() == (0, 1)
+            process.join()
+            assert Courses.query.count() == 1
+            db.session.remove()
+            db.engine.dispose()
+            db.get_read_engine().dispose()
+    finally:
+        db.session.remove()
+
+
+def test_caches_with_several_workers(client, tmp_path):
+    import time
+    from flask import Flask, current_app
+    from application.auth_cache import AUTH_CACHE_TTL, AUTH_CACHE_WORKERS_TTL, _cache_ttl
+    from application.catalog import LocalBackend
+    from application.database import configure_database
+    security = current_app.extensions["security"]
+    assert _cache_ttl("token", security) == AUTH_CACHE_TTL
+    current_app.config["WORKER_PROCESSES"] = 2
+    try:
+        # other workers never hear of a change, so tokens are rechecked soon
+        assert _cache_ttl("token", security) == AUTH_CACHE_WORKERS_TTL
+    finally:
+        current_app.config["WORKER_PROCESSES"] = 1
+
+    backend = LocalBackend(ttl=0.05)
+    backend.set("key", "value")
+    assert backend.get("key") == "value"
+    time.sleep(0.1)
+    assert backend.get("key") is None
+
+    for uri, replica in [("sqlite:///:memory:", None),
+                         (f"sqlite:///{tmp_path / 'a.db'}", f"sqlite:///{tmp_path / 'b.db'}")]:
+        app = Flask("workers")
+        app.config["SQLALCHEMY_DATABASE_URI"] = uri
+        app.config["SQLALCHEMY_READ_DATABASE_URI"] = replica
+        app.config["WORKER_PROCESSES"] = 2
+        with pytest.raises(ValueError):
+            configure_database(app, "default", identity=lambda: None)
+    app = Flask("workers")
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'a.db'}"
+    app.config["WORKER_PROCESSES"] = 2
+    configure_database(app, "production", identity=lambda: None)
+
+
+@contextlib.contextmanager
+def serve_workers(database, workers):
+    """asgi.py under uvicorn with ``workers`` processes on one database file;
+    yields the base URL and the server process."""
+    import os
+    import socket
+    import subprocess
+    import sys
+    import time
+    import urllib.request
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    env = dict(os.environ, DATABASE_URI=f"sqlite:///{database}", DATABASE_MODE="production", BCRYPT_ROUNDS="4",
+               WEB_CONCURRENCY=str(workers))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "asgi:application", "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+    )
+    base = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.time() + 60
+        while True:
+            try:
+                urllib.request.urlopen(base + "/api/courses", timeout=5).close()
+                break
+            except urllib.error.HTTPError:
+                break
+            except OSError:
+                if time.time() > deadline or process.poll() is not None:
+                    raise
+                time.sleep(0.2)
+        yield base, process
+    finally:
+        process.terminate()
+        process.wait(30)
+
+
+def call_json(base, method, path, body=None, token=None):
+    import urllib.request
+    headers = {"Content-Type": "application/json"}
+    if token is not None:
+        headers["Authentication-Token"] = token
+    request = urllib.request.Request(
+        base + path, data=None if body is None else json.dumps(body).encode(), headers=headers, method=method
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.status, json.loads(response.read() or b"null")
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b"null")
+
+
+def login_new_user(base, email):
+    body = {"email": email, "password": "password", "full_name": email}
+    assert call_json(base, "POST", "/api/register", body)[0] == 200
+    status, data = call_json(base, "POST", "/api/login", body)
+    assert status == 200
+    return data["token"]
+
+
+def test_workers_share_one_database(tmp_path):
+    import os
+    pytest.importorskip("uvicorn")
+    pytest.importorskip("a2wsgi")
+    with serve_workers(tmp_path / "shared.db", 2) as (base, process):
+        children = f"/proc/{process.pid}/task/{process.pid}/children"
+        if os.path.exists(children):
+            with open(children) as f:
+                assert len(f.read().split()) >= 2
+        token = login_new_user(base, "worker@gmail.com")
+        status, data = call_json(base, "POST", "/api/school", {"school_name": "Shared School", "marks": 80}, token)
+        assert status == 200
+        # each request is a new connection, taken by whichever worker is free
+        for _ in range(20):
+            status, data = call_json(base, "GET", "/api/school", token=token)
+            assert status == 200 and data["school_name"] == "Shared School"
+            status, data = call_json(base, "GET", "/api/profile", token=token)
+            assert status == 200 and data["email"] == "worker@gmail.com"
+
+
+def profile_requests(base, token, seconds):
+    import time
+    done = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        if call_json(base, "GET", "/api/profile", token=token)[0] == 200:
+            done += 1
+    return done
+
+
+def test_throughput_scales_with_workers(tmp_path):
+    import multiprocessing
+    import os
+    pytest.importorskip("uvicorn")
+    pytest.importorskip("a2wsgi")
+    cores = os.cpu_count() or 1
+    if cores < 2:
+        pytest.skip("needs at least two cores")
+    workers = min(cores, 4)
+    rates = {}
+    for count in (1, workers):
+        with serve_workers(tmp_path / "scale.db", count) as (base, process):
+            token = login_new_user(base, f"scale{count}@gmail.com")
+            profile_requests(base, token, 1)
+            with multiprocessing.get_context("fork").Pool(2 * workers) as pool:
+                done = pool.starmap(profile_requests, [(base, token, 3)] * (2 * workers))
+            rates[count] = sum(done) / 3
+    assert rates[workers] >= rates[1] * 1.3, rates
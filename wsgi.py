@@ -0,0 +1,17 @@
+"""WSGI entry point for preforking servers.
+
+    DATABASE_URI=sqlite:////srv/students/database.sqlite3 DATABASE_MODE=production \
+        WEB_CONCURRENCY=4 gunicorn --threads 8 wsgi:app
+
+Set the worker count with WEB_CONCURRENCY rather than --workers: gunicorn
+defaults to it and the app reads it too. Each worker imports this module
+and builds its own app, engines and caches; they share only the database,
+so several workers need a file database, and cached tokens and course
+catalogs are rechecked after a few seconds instead of being invalidated
+across processes (COURSE_CACHE_URL shares the catalog). With ``--preload``
+the app is built once before the fork instead, and each worker drops the
+connections it inherits.
+"""
+from main import make_app
+
+app = make_app()